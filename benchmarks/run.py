@@ -0,0 +1,263 @@
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+Benchmarks of the main stages of a run, on synthetic portfolios (see synthetic.py).
+
+Run from the repository root:
+    python3 -m benchmarks.run [--symbols 200] [--years 10] [--fills-per-day 20] [--repeat 5]
+                              [--output results.json] [--compare baseline.json]
+
+The data set is generated once per set of parameters under cache/benchmarks and reused. Each
+scenario runs --repeat times, and the results (min / median / mean seconds of every scenario,
+with the parameters, commit and library versions) are printed and written as JSON. With
+--compare, every scenario is compared with the same scenario of an earlier results file and the
+exit status is 1 when one got slower than --threshold times the baseline.
+"""
+
+DEFAULT_DATA_ROOT = os.path.join('cache', 'benchmarks')
+TRADEBOOK_FILE_PATTERN = 'tradebook-*.csv'
+DEFAULT_THRESHOLD = 1.2
+DATA_PARAMETERS = ['symbols', 'years', 'fills_per_day', 'aliases', 'corporate_actions', 'seed']
+# bumped when synthetic.generate writes different data for the same parameters
+DATA_VERSION = 3
+
+def data_dir_for(root, parameters):
+    key = dict({name: parameters[name] for name in DATA_PARAMETERS}, version=DATA_VERSION)
+    key = json.dumps(key, sort_keys=True)
+    return os.path.join(root, hashlib.sha256(key.encode()).hexdigest()[:12])
+
+def prepare_data(data_dir, parameters):
+    """
+    Generates the data set unless data_dir already has it
+    """
+    marker = os.path.join(data_dir, 'dataset.json')
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    from . import synthetic
+    started = time.perf_counter()
+    counts = synthetic.generate(data_dir, **{name: parameters[name] for name in DATA_PARAMETERS})
+    print(f'Generated {counts} in {data_dir} in {time.perf_counter() - started:.1f}s')
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(counts, f, indent=1)
+    return counts
+
+def scenarios():
+    """
+    Returns [(name, setup)], setup() doing the untimed preparation of a scenario and returning
+    the function to time. Scenarios run in this order, later ones reuse the data loaded by
+    earlier ones through state.
+    """
+    import shutil
+    from investinganalytics import benchmark_comparison
+    from investinganalytics import cashflows
+    from investinganalytics import dividends
+    from investinganalytics import lots
+    from investinganalytics import trades_to_pf_series
+    from investinganalytics import trades_to_snapshots
+    from investinganalytics import xirr_filter_multiple
+    from investinganalytics import xirr_memo
+    from investinganalytics import xirr_series
+    from investinganalytics.yfinutils import price_store
+    from investinganalytics.yfinutils.yfin_helper import StocksHistory
+    from investinganalytics.zerodha import tradebooks_reader
+
+    state = {}
+    ingestion_cache_dir = os.path.join('cache', 'tradebooks')
+
+    def ingestion_parse():
+        return lambda: tradebooks_reader.getTrades('portfolio', TRADEBOOK_FILE_PATTERN)
+
+    def ingestion_cold_cache():
+        def run():
+            shutil.rmtree(ingestion_cache_dir, ignore_errors=True)
+            return tradebooks_reader.getTrades('portfolio', TRADEBOOK_FILE_PATTERN, cache_dir=ingestion_cache_dir)
+        return run
+
+    def ingestion_cached():
+        tradebooks_reader.getTrades('portfolio', TRADEBOOK_FILE_PATTERN, cache_dir=ingestion_cache_dir)
+        return lambda: tradebooks_reader.getTrades('portfolio', TRADEBOOK_FILE_PATTERN, cache_dir=ingestion_cache_dir)
+
+    def load_portfolio():
+        def run():
+            state['tradebooks'], state['holdings'], state['trades'] = xirr_filter_multiple.load_portfolio(
+                'portfolio', cache_dir=ingestion_cache_dir)
+        return run
+
+    def cashflow_arrays():
+        return lambda: cashflows.trades_to_cashflow_arrays(state['trades'])
+
+    def portfolio_xirr():
+        return lambda: xirr_filter_multiple.calculate_xirr(state['trades'])
+
+    def per_symbol_xirr():
+        return lambda: xirr_filter_multiple.calculate_xirr_stock(state['trades'], 'xirr', None)
+
+    def per_symbol_xirr_batched():
+        return lambda: xirr_filter_multiple.calculate_xirr_stock(state['trades'], 'xirr', None, batched=True)
+
+    def per_symbol_xirr_memo():
+        # memo filled by a first run: the cashflows of every symbol are already in it
+        memo = xirr_memo.XirrMemo(filename=None)
+        xirr_filter_multiple.calculate_xirr_stock(state['trades'], 'xirr', None, memo=memo)
+        return lambda: xirr_filter_multiple.calculate_xirr_stock(state['trades'], 'xirr', None, memo=memo)
+
+    def lot_matching():
+        return lambda: lots.match_lots(state['tradebooks'])
+
+    def snapshots():
+        def run():
+            state['snapshots'] = trades_to_snapshots.convert(state['tradebooks'])
+        return run
+
+    def load_prices():
+        store = price_store.PriceStore('prices')
+        symbols = [str(symbol) for symbol in state['trades']['symbol'].unique()]
+        def run():
+            histories = {symbol: store.load(symbol) for symbol in symbols}
+            state['prices'] = StocksHistory({symbol: history for symbol, history in histories.items()
+                                             if history is not None})
+            state['prices'].price_matrix()
+        return run
+
+    def dividend_cashflows():
+        return lambda: dividends.dividend_trades(state['tradebooks'], dividends.dividend_table(state['prices']))
+
+    def benchmark_replay():
+        store = price_store.PriceStore('prices')
+        indices = {name: store.load(name) for name in ['NIFTY50', 'NIFTY500']}
+        return lambda: benchmark_comparison.compare(state['tradebooks'], state['holdings'], indices, state['prices'])
+
+    def valuation():
+        return lambda: trades_to_pf_series.createSnapshots(state['tradebooks'], state['snapshots'], state['prices'])
+
+    def asof_xirr_series():
+        asof_dates = xirr_series.month_ends(end_date=state['prices'].price_matrix().dates[-1])
+        return lambda: xirr_series.asof_xirr_series(state['tradebooks'], state['prices'], asof_dates)
+
+    return [
+        ('ingestion_parse', ingestion_parse),
+        ('ingestion_cold_cache', ingestion_cold_cache),
+        ('ingestion_cached', ingestion_cached),
+        ('load_portfolio', load_portfolio),
+        ('cashflows', cashflow_arrays),
+        ('portfolio_xirr', portfolio_xirr),
+        ('per_symbol_xirr', per_symbol_xirr),
+        ('per_symbol_xirr_batched', per_symbol_xirr_batched),
+        ('per_symbol_xirr_memo', per_symbol_xirr_memo),
+        ('lot_matching', lot_matching),
+        ('snapshots', snapshots),
+        ('load_prices', load_prices),
+        ('dividends', dividend_cashflows),
+        ('benchmark_replay', benchmark_replay),
+        ('valuation', valuation),
+        ('asof_xirr_series', asof_xirr_series)
+    ]
+
+def time_scenario(setup, repeat):
+    run = setup()
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    return {
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'mean': statistics.fmean(seconds),
+        'runs': seconds
+    }
+
+def environment():
+    import numpy as np
+    import pandas as pd
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+def run_benchmarks(parameters, repeat, only=None, data_root=DEFAULT_DATA_ROOT):
+    """
+    Returns the results dictionary of the scenarios (all of them, or the ones named in only)
+    """
+    data_dir = data_dir_for(data_root, parameters)
+    dataset = prepare_data(data_dir, parameters)
+    results = {'environment': environment(), 'parameters': parameters, 'dataset': dataset,
+               'repeat': repeat, 'scenarios': {}}
+    cwd = os.getcwd()
+    # the readers look for resources/ and cache/ in the current directory
+    os.chdir(data_dir)
+    try:
+        for name, setup in scenarios():
+            if only and name not in only:
+                # still run once, later scenarios may need what it loads
+                time_scenario(setup, 1)
+                continue
+            timings = time_scenario(setup, repeat)
+            results['scenarios'][name] = timings
+            print(f'{name:<26} min {timings["min"] * 1000:10.1f} ms   median {timings["median"] * 1000:10.1f} ms')
+    finally:
+        os.chdir(cwd)
+    return results
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Prints the median of every scenario against the baseline's.
+    Returns the names of the scenarios slower than threshold times the baseline.
+    """
+    slower = []
+    print(f'\n{"scenario":<26} {"baseline":>12} {"now":>12} {"ratio":>8}')
+    for name, timings in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        ratio = timings['median'] / before['median'] if before['median'] else float('inf')
+        flag = '  SLOWER' if ratio > threshold else ''
+        print(f'{name:<26} {before["median"] * 1000:10.1f}ms {timings["median"] * 1000:10.1f}ms {ratio:8.2f}{flag}')
+        if ratio > threshold:
+            slower.append(name)
+    return slower
+
+def parseCommandLine():
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of a run on a synthetic portfolio')
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--fills-per-day', type=float, default=20)
+    parser.add_argument('--aliases', type=int, default=20, help='number of renamed symbols')
+    parser.add_argument('--corporate-actions', type=int, default=10, help='number of splits and mergers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every scenario')
+    parser.add_argument('--only', nargs='*', help='scenarios to time (the others run once, untimed)')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='ratio to the baseline above which a scenario counts as slower')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parseCommandLine()
+    from investinganalytics import reporting
+    reporting.configure_logging(logging.WARNING)
+    parameters = {name: getattr(args, name) for name in DATA_PARAMETERS}
+    results = run_benchmarks(parameters, args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            slower = compare(results, json.load(f), args.threshold)
+        sys.exit(1 if slower else 0)
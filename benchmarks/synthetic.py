@@ -0,0 +1,202 @@
+import os
+import numpy as np
+import pandas as pd
+from investinganalytics.yfinutils import price_store
+
+"""
+Deterministic synthetic portfolios in the Zerodha formats.
+
+generate() writes, under a data directory:
+    portfolio/tradebook-<year>.csv: one tradebook per calendar year, with the columns of the
+                                    tradebooks downloaded from Kite
+    portfolio/holdings.csv: what is held at the end, as downloaded from the Kite holdings page
+    resources/aliases.csv: old names of renamed symbols (older trades use the old name)
+    resources/corporate-actions.csv: splits and mergers of some symbols
+    prices/: a price store (see price_store.PriceStore) filled offline from FakePriceProvider,
+             with quarterly dividends on half of the symbols, and the indices NIFTY50 (equal
+             weighted, of the first 50 symbols) and NIFTY500 (of all the symbols)
+
+Every symbol's close follows a random walk. Each business day has a Poisson number of fills on
+symbols drawn with skewed weights (a few symbols trade much more than the rest). Sells never
+exceed what is held, so the ledger is consistent with the corporate actions and the holdings.
+The same parameters and seed always give the same files.
+"""
+
+TRADEBOOK_COLUMNS = ['symbol', 'isin', 'trade_date', 'exchange', 'segment', 'series', 'trade_type',
+                     'auction', 'quantity', 'price', 'trade_id', 'order_id', 'order_execution_time']
+HOLDINGS_COLUMNS = ['Instrument', 'Qty.', 'Avg. cost', 'LTP', 'Cur. val', 'P&L', 'Net chg.', 'Day chg.']
+SPLIT_RATIOS = [2, 5, 10]
+MERGER_RATIOS = [1, 2, 3]
+DEFAULT_END_DATE = '2024-12-31'
+DIVIDEND_INTERVAL_DAYS = 63
+
+def symbol_names(n_symbols):
+    return [f'SYM{i:04d}' for i in range(n_symbols)]
+
+class FakePriceProvider:
+    """
+    Price provider (see price_store) serving the synthetic histories, listed on NSE only
+    """
+    def __init__(self, histories):
+        self.histories = histories
+
+    def history(self, yfinance_symbol, start=None):
+        symbol, _, suffix = yfinance_symbol.rpartition('.')
+        history = self.histories.get(symbol) if suffix == 'NS' else None
+        if history is None:
+            return None
+        if start is not None:
+            history = history[history.index >= start]
+        return history
+
+def generate(data_dir, symbols=200, years=10, fills_per_day=20, aliases=20, corporate_actions=10,
+             seed=0, end_date=DEFAULT_END_DATE):
+    """
+    Writes a synthetic portfolio to data_dir (see the module docstring).
+    Returns a dictionary with the number of trades, holdings, aliases and corporate actions written.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end_date)
+    days = pd.bdate_range(end - pd.DateOffset(years=years), end)
+    n_days, n_symbols = len(days), symbols
+    names = symbol_names(n_symbols)
+
+    # closes of every symbol on every day
+    start_prices = rng.uniform(20, 3000, n_symbols)
+    returns = rng.normal(0.0003, 0.02, (n_days, n_symbols))
+    closes = start_prices * np.exp(np.cumsum(returns, axis=0))
+
+    # renamed symbols: trades before the rename day use the old name
+    renamed = rng.choice(n_symbols, min(aliases, n_symbols), replace=False)
+    rename_day = np.full(n_symbols, -1)
+    rename_day[renamed] = rng.integers(1, n_days, len(renamed))
+
+    # corporate actions: (day, kind, symbol, target, ratio); mergers from symbols never merged into
+    n_mergers = min(corporate_actions // 4, n_symbols // 2)
+    n_splits = corporate_actions - n_mergers
+    shuffled = rng.permutation(n_symbols)
+    merged_away, acquirers = shuffled[:n_mergers], shuffled[n_mergers:2 * n_mergers]
+    actions = [(int(day), 'merger', int(source), int(target), int(rng.choice(MERGER_RATIOS)))
+               for day, source, target in zip(rng.integers(1, n_days, n_mergers), merged_away, acquirers)]
+    actions += [(int(day), 'split', int(symbol), int(symbol), int(rng.choice(SPLIT_RATIOS)))
+                for day, symbol in zip(rng.integers(1, n_days, n_splits), rng.choice(shuffled[n_mergers:], n_splits))]
+    actions.sort()
+
+    # fills, drawn up front
+    fills_on_day = rng.poisson(fills_per_day, n_days)
+    n_fills = int(fills_on_day.sum())
+    fill_day = np.repeat(np.arange(n_days), fills_on_day)
+    weights = 1.0 / np.arange(1, n_symbols + 1) ** 0.8
+    fill_symbol = rng.choice(n_symbols, n_fills, p=weights / weights.sum())
+    fill_is_buy = rng.random(n_fills) < 0.6
+    fill_quantity = rng.integers(1, 100, n_fills)
+    fill_noise = 1 + rng.normal(0, 0.005, n_fills)
+    fill_suffix = rng.random(n_fills) < 0.05
+
+    held = np.zeros(n_symbols)
+    split_factor = np.ones(n_symbols)
+    listed = np.ones(n_symbols, dtype=bool)
+    rows = {column: [] for column in ['symbol', 'day', 'trade_type', 'quantity', 'price']}
+    next_action = 0
+    for i in range(n_fills):
+        day = fill_day[i]
+        # actions of a day apply to the trades made before it
+        while next_action < len(actions) and actions[next_action][0] <= day:
+            _, kind, source, target, ratio = actions[next_action]
+            if kind == 'split':
+                held[source] *= ratio
+                split_factor[source] *= ratio
+            else:
+                held[target] += held[source] * ratio
+                held[source] = 0
+                listed[source] = False
+            next_action += 1
+
+        symbol = fill_symbol[i]
+        if not listed[symbol]:
+            continue
+        quantity = fill_quantity[i]
+        is_buy = fill_is_buy[i] or held[symbol] < quantity
+        held[symbol] += quantity if is_buy else -quantity
+        name = names[symbol] if day >= rename_day[symbol] else 'OLD' + names[symbol][3:]
+        rows['symbol'].append(name + '-BE' if fill_suffix[i] else name)
+        rows['day'].append(day)
+        rows['trade_type'].append('buy' if is_buy else 'sell')
+        rows['quantity'].append(quantity)
+        rows['price'].append(round(closes[day, symbol] / split_factor[symbol] * fill_noise[i], 2))
+
+    trade_days = days[np.array(rows['day'], dtype=np.int64)]
+    trades = pd.DataFrame({
+        'symbol': rows['symbol'],
+        'isin': 'INE000000000',
+        'trade_date': trade_days.strftime('%Y-%m-%d'),
+        'exchange': 'NSE',
+        'segment': 'EQ',
+        'series': 'EQ',
+        'trade_type': rows['trade_type'],
+        'auction': False,
+        'quantity': np.array(rows['quantity'], dtype=np.float64),
+        'price': rows['price'],
+        'trade_id': np.arange(len(trade_days)) + 10_000_000,
+        'order_id': np.arange(len(trade_days)) + 1_000_000_000_000,
+        'order_execution_time': trade_days.strftime('%Y-%m-%dT09:15:00')
+    }, columns=TRADEBOOK_COLUMNS)
+
+    portfolio_dir = os.path.join(data_dir, 'portfolio')
+    resources_dir = os.path.join(data_dir, 'resources')
+    os.makedirs(portfolio_dir, exist_ok=True)
+    os.makedirs(resources_dir, exist_ok=True)
+    for year, tradebook in trades.groupby(trade_days.year):
+        tradebook.to_csv(os.path.join(portfolio_dir, f'tradebook-{year}.csv'), index=False)
+
+    last_price = np.round(closes[-1] / split_factor, 2)
+    holding = np.flatnonzero(listed & (held > 0))
+    pd.DataFrame({
+        'Instrument': [names[i] for i in holding],
+        'Qty.': held[holding].astype(np.int64),
+        'Avg. cost': last_price[holding],
+        'LTP': last_price[holding],
+        'Cur. val': np.round(held[holding] * last_price[holding], 2),
+        'P&L': 0.0,
+        'Net chg.': 0.0,
+        'Day chg.': 0.0
+    }, columns=HOLDINGS_COLUMNS).to_csv(os.path.join(portfolio_dir, 'holdings.csv'), index=False)
+
+    with open(os.path.join(resources_dir, 'aliases.csv'), 'w', encoding='utf-8') as f:
+        for symbol in sorted(renamed):
+            f.write(f'OLD{names[symbol][3:]}, {names[symbol]}\n')
+    pd.DataFrame({
+        'date': [days[day].strftime('%Y-%m-%d') for day, *_ in actions],
+        'original-symbol': [names[source] for _, _, source, _, _ in actions],
+        'original-qty': 1,
+        'converted-symbol': [names[target] for _, _, _, target, _ in actions],
+        'converted-qty': [ratio for *_, ratio in actions]
+    }).to_csv(os.path.join(resources_dir, 'corporate-actions.csv'), index=False)
+
+    # split adjusted histories, as yahoo finance gives them; merged away symbols are delisted.
+    # Dividends are drawn from their own generator, the trades stay the same as without them
+    dividend_rng = np.random.default_rng([seed, 1])
+    pays_dividends = dividend_rng.random(n_symbols) < 0.5
+    dividend_yield = dividend_rng.uniform(0.002, 0.01, n_symbols)
+    first_ex_day = dividend_rng.integers(0, DIVIDEND_INTERVAL_DAYS, n_symbols)
+    dates = days.date
+    histories = {}
+    for symbol in np.flatnonzero(listed):
+        close = closes[:, symbol] / split_factor[symbol]
+        dividends = np.zeros(n_days)
+        if pays_dividends[symbol]:
+            ex_days = np.arange(first_ex_day[symbol], n_days, DIVIDEND_INTERVAL_DAYS)
+            dividends[ex_days] = np.round(close[ex_days] * dividend_yield[symbol], 2)
+        histories[names[symbol]] = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close,
+                                                 'Volume': 1000, 'Dividends': dividends, 'Stock Splits': 0.0},
+                                                index=dates)
+    store = price_store.PriceStore(os.path.join(data_dir, 'prices'), FakePriceProvider(histories))
+    for symbol in names:
+        store.get_history(symbol, refresh=False)
+    for index, members in [('NIFTY50', slice(0, 50)), ('NIFTY500', slice(None))]:
+        level = 10_000 * np.exp(np.cumsum(returns[:, members].mean(axis=1)))
+        store.save(index, pd.DataFrame({'Open': level, 'High': level, 'Low': level, 'Close': level,
+                                        'Volume': 0, 'Dividends': 0.0, 'Stock Splits': 0.0}, index=dates))
+
+    return {'trades': len(trades), 'holdings': len(holding), 'aliases': len(renamed),
+            'corporate_actions': len(actions)}
@@ -1,4 +1,7 @@
 import csv
+import logging
+
+logger = logging.getLogger(__name__)
 
 def getAliases(aliasFilePath):
     """
@@ -10,8 +13,7 @@ def getAliases(aliasFilePath):
     Returns:
         A dictionary where keys are the first values in each row of the CSV,
         and values are the second values. Returns an empty dictionary if the file
-        is empty or if there's an error.  Prints an error message to the console
-        if an error occurs.
+        is empty or if there's an error.  Logs a warning if an error occurs.
     """
     aliases = {}
     try:
@@ -23,13 +25,13 @@ def getAliases(aliasFilePath):
                     value = row[1].strip()
                     aliases[key] = value
                 elif row: # checks if the row is not empty
-                    print(f"WARN: Skipping row with incorrect number of values: {row}")
+                    logger.warning('Skipping row with incorrect number of values: %s', row)
     except FileNotFoundError:
-        print(f"WARN: Alias file not found at {aliasFilePath}")
+        logger.warning('Alias file not found at %s', aliasFilePath)
     except csv.Error as e: # catch csv related errors
-        print(f"WARN: Error reading CSV: {e}")
+        logger.warning('Error reading CSV: %s', e)
     except Exception as e: # catch other errors
-        print(f"WARN: An unexpected error occurred: {e}")
+        logger.warning('An unexpected error occurred: %s', e)
     return aliases
 
 if __name__ == "__main__":
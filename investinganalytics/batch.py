@@ -0,0 +1,158 @@
+import contextlib
+import csv
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from . import ingestion_cache
+from . import reporting
+from . import symbols
+from . import xirr_filter_multiple
+from .yfinutils import price_store
+
+"""
+Batch mode: XIRR of many portfolios in one run.
+
+Every portfolio is a folder laid out as for xirr.py (tradebook-*.csv and holdings.csv). The
+portfolios are processed on a pool of worker processes, so the CPU bound parsing and solving
+scales with the number of cores. The parent process loads the alias table once and hands it to
+every worker. With prices, the parent downloads the price history of the symbols of all the
+portfolios once into the shared price cache, and workers only read from it.
+
+Outputs, under the output directory:
+    results.csv: one row per portfolio (portfolio XIRR, profit, counts, status)
+    <portfolio>/xirr.csv: XIRR, profit and return of every stock
+    <portfolio>/nav.csv: daily value of the portfolio (only with prices)
+    <portfolio>/log.txt: everything the run of that portfolio logged
+"""
+
+logger = logging.getLogger(__name__)
+
+TRADEBOOK_FILE_PATTERN = 'tradebook-*.csv'
+RESULTS_FILE = 'results.csv'
+
+def find_portfolios(root):
+    """
+    Returns {portfolio name: folder}.
+    root is either a directory, whose sub-directories containing tradebooks are the portfolios,
+    or a manifest CSV file with the columns name, folder (relative folders are relative to the
+    manifest).
+    """
+    if os.path.isdir(root):
+        folders = sorted(os.path.dirname(path) for path in glob.glob(os.path.join(root, '*', TRADEBOOK_FILE_PATTERN)))
+        return {os.path.basename(folder): folder for folder in dict.fromkeys(folders)}
+
+    portfolios = {}
+    with open(root, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            folder = row['folder'].strip()
+            if not os.path.isabs(folder):
+                folder = os.path.join(os.path.dirname(root), folder)
+            portfolios[row['name'].strip()] = folder
+    return portfolios
+
+def _init_worker(aliases, log_level):
+    symbols.use_shared_aliases(aliases)
+    reporting.configure_logging(log_level)
+
+@contextlib.contextmanager
+def _portfolio_log(output_dir, name):
+    portfolio_dir = os.path.join(output_dir, name)
+    os.makedirs(portfolio_dir, exist_ok=True)
+    with open(os.path.join(portfolio_dir, 'log.txt'), 'a', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log):
+        yield portfolio_dir
+
+def process_portfolio(name, folder, output_dir, cache_dir):
+    """
+    Computes the XIRR of one portfolio and writes its report. Runs in a worker process.
+    Returns the portfolio's row of the consolidated results, plus its symbols.
+    """
+    started = time.perf_counter()
+    result = {'portfolio': name, 'folder': folder}
+    with _portfolio_log(output_dir, name) as portfolio_dir:
+        try:
+            # portfolios do not share a tradebook cache, so that workers never write the same manifest
+            tradebooks, holdings, trades = xirr_filter_multiple.load_portfolio(
+                folder, cache_dir=os.path.join(cache_dir, name))
+            report = xirr_filter_multiple.portfolio_report(tradebooks, holdings, trades, with_lots=False)
+            report.stocks.to_csv(os.path.join(portfolio_dir, 'xirr.csv'))
+            result.update({
+                'status': 'ok',
+                'xirr': report.portfolio_xirr,
+                'profit': float(report.stocks['profit'].sum()) if len(report.stocks) else 0.0,
+                'trades': len(trades),
+                'symbols': int(trades['symbol'].nunique()),
+                'symbols_with_no_sells': len(report.symbols_with_no_sells),
+                'symbols_with_no_buys': len(report.symbols_with_no_buys)
+            })
+            traded_symbols = [str(symbol) for symbol in pd.unique(trades['symbol'])]
+        except Exception as e:
+            logger.exception('Processing portfolio %s failed', name)
+            result.update({'status': f'error: {e}'})
+            traded_symbols = []
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result, traded_symbols
+
+def write_nav(name, folder, output_dir, cache_dir, price_cache_dir):
+    """
+    Writes the daily value of one portfolio, prices being read from the shared price cache only.
+    Runs in a worker process.
+    """
+    from . import trades_to_pf_series
+    from .yfinutils.yfin_helper import StocksHistory
+    with _portfolio_log(output_dir, name) as portfolio_dir:
+        try:
+            tradebooks, _, _ = xirr_filter_multiple.load_portfolio(folder, cache_dir=os.path.join(cache_dir, name))
+            store = price_store.PriceStore(price_cache_dir)
+            histories = {}
+            for symbol in pd.unique(tradebooks['symbol']):
+                history = store.load(str(symbol))
+                if history is not None:
+                    histories[str(symbol)] = history
+            nav = trades_to_pf_series.createSnapshots(tradebooks, None, StocksHistory(histories))
+            nav.to_csv(os.path.join(portfolio_dir, 'nav.csv'))
+            return True
+        except Exception:
+            logger.exception('Writing the daily value of portfolio %s failed', name)
+            return False
+
+def run_batch(portfolios, output_dir, workers=None, with_prices=False,
+              cache_dir=ingestion_cache.DEFAULT_CACHE_DIR, price_cache_dir=price_store.DEFAULT_CACHE_DIR):
+    """
+    Processes portfolios ({name: folder}, see find_portfolios) on a pool of worker processes.
+    Returns the consolidated results DataFrame, which is also written to output_dir/results.csv.
+
+    workers: number of processes, default the number of CPUs
+    with_prices: also write the daily portfolio value, downloading the price history of all the
+                 symbols once into the shared price cache first
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = list(portfolios)
+    folders = [portfolios[name] for name in names]
+    workers = workers or os.cpu_count() or 1
+    aliases = symbols.shared_aliases()
+    log_level = logging.getLogger('investinganalytics').getEffectiveLevel()
+    logger.info('Processing %d portfolio(s) on %d worker(s)', len(names), workers)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(aliases, log_level)) as executor:
+        outcomes = list(executor.map(process_portfolio, names, folders, [output_dir] * len(names),
+                                     [cache_dir] * len(names)))
+        results = pd.DataFrame([result for result, _ in outcomes])
+
+        if with_prices and len(names):
+            from .yfinutils.yfin_helper import fetch_stocks_history
+            all_symbols = sorted(set().union(*(traded for _, traded in outcomes)))
+            # one download of every symbol, the workers then only read the cache
+            fetch_stocks_history(all_symbols, price_store.PriceStore(price_cache_dir), workers=8)
+            results['nav'] = list(executor.map(write_nav, names, folders, [output_dir] * len(names),
+                                               [cache_dir] * len(names), [price_cache_dir] * len(names)))
+
+    if len(results):
+        results = results.set_index('portfolio')
+    results.to_csv(os.path.join(output_dir, RESULTS_FILE))
+    failed = int((results['status'] != 'ok').sum()) if len(results) else 0
+    logger.info('Done, %d ok, %d failed. Results in %s', len(results) - failed, failed, os.path.join(output_dir, RESULTS_FILE))
+    return results
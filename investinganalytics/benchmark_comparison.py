@@ -0,0 +1,156 @@
+import logging
+import numpy as np
+import pandas as pd
+from . import cashflows
+from . import instrumentation
+from . import xirr_solver
+from .yfinutils.yfin_helper import PriceMatrix
+
+"""
+Comparison of the portfolio with market indices.
+
+Every cashflow of the portfolio is replayed into a benchmark index: money put in (a buy, negative
+cashflow) buys units of the index at the close of that day, money taken out (a sell, a dividend)
+sells units at that close. What the replay holds at the end, valued at the index's close, takes
+the place of the value of the holdings. The XIRR of these cashflows is the return the same money
+would have made in the index (the public market equivalent), the excess return is the XIRR of the
+portfolio minus it.
+
+The replay is done in bulk: the units every cashflow buys are -amount / close on one aligned
+(cashflows x benchmarks) array of closes, the units held are their sums per stream (the portfolio
+and every symbol are streams of their own) and, for the daily relative NAV, their cumulative sum
+over the trading calendar. The XIRR of all the (stream, benchmark) pairs is solved in one batch
+(see xirr_solver), so thousands of symbols against several benchmarks take seconds.
+
+When the portfolio did much better than the index, taking out the same money can sell more units
+than the replay holds: it is then short of the index and its value is negative, as is usual for
+this comparison. A stream with a cashflow before the first close of a benchmark has no result
+against it (NaN). The indices' closes do not include their dividends.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BENCHMARKS = ['NIFTY50']
+
+def replay_units(amounts, codes, n_streams, prices):
+    """
+    Returns the n_streams x n_benchmarks units of every benchmark held after replaying the cashflows
+    (amounts, of stream codes) at prices, the len(amounts) x n_benchmarks closes on their dates.
+    NaN for a stream with a cashflow on a date without close.
+    """
+    units = -amounts[:, np.newaxis] / prices
+    return np.stack([np.bincount(codes, weights=units[:, column], minlength=n_streams)
+                     for column in range(prices.shape[1])], axis=1)
+
+def replay_nav(dates, amounts, benchmark_prices, calendar):
+    """
+    Returns the len(calendar) x n_benchmarks daily values of the replay of one stream of cashflows
+    in every benchmark (a PriceMatrix): the units bought each day, summed cumulatively, times the
+    close. A cashflow on a day missing from calendar counts from the next day of calendar.
+    """
+    units = -amounts[:, np.newaxis] / benchmark_prices.get_close_prices(benchmark_prices.symbols, dates)
+    rows = np.searchsorted(calendar, dates, side='left')
+    in_range = rows < len(calendar)
+    held = np.stack([np.bincount(rows[in_range], weights=units[in_range, column], minlength=len(calendar))
+                     for column in range(units.shape[1])], axis=1)
+    np.cumsum(held, axis=0, out=held)
+    return held * benchmark_prices.get_close_prices(benchmark_prices.symbols, calendar)
+
+@instrumentation.timed('benchmark_comparison')
+def compare(trades, holdings, benchmark_histories, stock_history_database=None, end_date=None):
+    """
+    Compares the portfolio and every symbol with the benchmarks.
+
+    Args:
+        trades: the trades replayed, i.e. the tradebooks (with the dividends if they are counted,
+                see xirr_filter_multiple.add_dividends) without the holdings
+        holdings: the holdings as sell trades (see holdings_reader.getHoldingsAsSellTrades), what
+                  the portfolio is worth at end_date
+        benchmark_histories: { name : price history } of the benchmarks
+        stock_history_database: yfin_helper.StocksHistory of the symbols, to value the portfolio
+                                every day for the relative NAV. None to leave it out.
+        end_date: the date the holdings are valued on, by default the date of the holdings
+
+    Returns a dictionary with:
+        benchmarks: DataFrame indexed by benchmark with the columns portfolio_xirr, benchmark_xirr,
+                    excess_return, portfolio_value and benchmark_value (the replay's value at end_date)
+        stocks: DataFrame indexed by symbol with the columns xirr and, for every benchmark,
+                <benchmark>_xirr and <benchmark>_excess
+        nav: None without stock_history_database, else a DataFrame indexed by date with the
+             portfolio's value, and for every benchmark <benchmark> the replay's value and
+             <benchmark>_relative, the ratio of the two (above 1 when the portfolio is ahead)
+    """
+    names = list(benchmark_histories.keys())
+    benchmark_prices = PriceMatrix.from_histories(benchmark_histories)
+    n_benchmarks = len(names)
+
+    columns = cashflows.cashflow_columns(trades)
+    valid = columns['valid']
+    dates = columns['dates'][valid]
+    amounts = columns['amounts'][valid]
+    holding_columns = cashflows.cashflow_columns(holdings)
+    holding_amounts = holding_columns['amounts'][holding_columns['valid']]
+    if end_date is None:
+        end_date = holding_columns['dates'].max() if len(holdings) else dates.max()
+    end_date = np.datetime64(end_date, 'D')
+
+    # stream 0 is the portfolio, stream 1 + i the symbol i
+    codes, symbols = pd.factorize(np.concatenate([
+        trades['symbol'].to_numpy(dtype=object)[valid],
+        holdings['symbol'].to_numpy(dtype=object)[holding_columns['valid']]]), sort=True)
+    n_streams = len(symbols) + 1
+    trade_codes, holding_codes = codes[:len(dates)], codes[len(dates):]
+    stream_codes = np.concatenate([np.zeros(len(dates), dtype=np.int64), trade_codes + 1])
+    stream_dates = np.concatenate([dates, dates])
+    stream_amounts = np.concatenate([amounts, amounts])
+    final_value = np.bincount(holding_codes + 1, weights=holding_amounts, minlength=n_streams)
+    final_value[0] = holding_amounts.sum()
+
+    # units of every benchmark bought by every cashflow, on one aligned array of closes
+    prices = benchmark_prices.get_close_prices(names, dates)
+    units = replay_units(stream_amounts, stream_codes, n_streams, np.concatenate([prices, prices]))
+    end_prices = benchmark_prices.get_close_prices(names, [end_date])[0]
+    benchmark_value = units * end_prices
+    replayed = np.isfinite(benchmark_value)
+    for name, count in zip(names, (~replayed[1:]).sum(axis=0)):
+        if count:
+            logger.warning('%d symbol(s) have cashflows before the history of %s starts', count, name)
+
+    # XIRR of the portfolio's own cashflows (group k = 0) and of their replay in every benchmark
+    # (group k = 1 + benchmark), all in one batch of groups k * n_streams + stream
+    n_groups = (n_benchmarks + 1) * n_streams
+    terminal = np.concatenate([final_value[:, np.newaxis], np.where(replayed, benchmark_value, 0.0)], axis=1)
+    group_codes = np.concatenate([stream_codes + k * n_streams for k in range(n_benchmarks + 1)]
+                                 + [np.arange(n_groups)])
+    group_dates = np.concatenate([stream_dates] * (n_benchmarks + 1) + [np.full(n_groups, end_date)])
+    group_amounts = np.concatenate([stream_amounts] * (n_benchmarks + 1) + [terminal.T.ravel()])
+    # the streams of a ledger mix buys and sells, they mostly change sign many times: these are
+    # solved by pyxirr directly rather than probed for a single root first
+    rates = xirr_solver.xirr_by_group(group_codes, group_dates, group_amounts, n_groups, scan_roots=False)
+    rates = rates.reshape(n_benchmarks + 1, n_streams).T
+    own_rates = rates[:, 0]
+    benchmark_rates = np.where(replayed, rates[:, 1:], np.nan)
+
+    benchmarks = pd.DataFrame({
+        'portfolio_xirr': own_rates[0],
+        'benchmark_xirr': benchmark_rates[0],
+        'excess_return': own_rates[0] - benchmark_rates[0],
+        'portfolio_value': final_value[0],
+        'benchmark_value': benchmark_value[0]
+    }, index=pd.Index(names, name='benchmark'))
+    stocks = pd.DataFrame({'xirr': own_rates[1:]}, index=pd.Index(symbols, name='symbol'))
+    for column, name in enumerate(names):
+        stocks[f'{name}_xirr'] = benchmark_rates[1:, column]
+        stocks[f'{name}_excess'] = own_rates[1:] - benchmark_rates[1:, column]
+
+    nav = None
+    if stock_history_database is not None:
+        from . import trades_to_pf_series
+        nav = trades_to_pf_series.createSnapshots(trades, None, stock_history_database, end_date)[['value']]
+        calendar = nav.index.to_numpy().astype('datetime64[D]')
+        replay = replay_nav(dates, amounts, benchmark_prices, calendar)
+        for column, name in enumerate(names):
+            nav[name] = replay[:, column]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                nav[f'{name}_relative'] = nav['value'].to_numpy() / replay[:, column]
+    return {'benchmarks': benchmarks, 'stocks': stocks, 'nav': nav}
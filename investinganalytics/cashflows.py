@@ -0,0 +1,165 @@
+import logging
+import numpy as np
+import pandas as pd
+
+"""
+Columnar cashflow engine.
+
+Turns a trades dataframe (symbol, trade_date, trade_type, quantity, price) into flat NumPy
+arrays in a single vectorized pass, so that cashflows can be handed straight to pyxirr
+without walking the trades row by row.
+
+Sign convention is the same as the rest of the program:
+buy  -> negative cashflow (money going out)
+sell -> positive cashflow (money coming in)
+dividend -> positive cashflow of quantity * price (see dividends), no change of quantity
+"""
+
+logger = logging.getLogger(__name__)
+
+def to_datetime64(values):
+    """
+    Converts a column of dates (datetime.date, strings or timestamps) to a datetime64[D] array
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_dtype(values.dtype):
+        # already dates, e.g. the normalized trades
+        return values.to_numpy().astype('datetime64[D]')
+    return pd.to_datetime(values).to_numpy().astype('datetime64[D]')
+
+def cashflow_columns(trades):
+    """
+    Computes the signed cashflow of every trade in one pass.
+
+    Args:
+        trades: A pandas DataFrame containing trade data.
+
+    Returns:
+        A dictionary of NumPy arrays aligned with the rows of trades:
+        dates: datetime64[D] trade dates
+        amounts: float64 signed cashflows (0 for rows that are neither buy, sell nor dividend)
+        quantities: float64 signed quantities (buys positive, sells negative, 0 for dividends)
+        is_buy / is_sell / is_dividend: boolean masks
+        valid: boolean mask of rows that are a buy, a sell or a dividend
+    """
+    trade_type = trades['trade_type']
+    if isinstance(trade_type.dtype, pd.CategoricalDtype):
+        # compared once per category rather than once per row, -1 (missing) picks the appended False
+        categories = trade_type.cat.categories.astype(str).str.lower()
+        codes = trade_type.cat.codes.to_numpy()
+        is_buy = np.append(categories == 'buy', False)[codes]
+        is_sell = np.append(categories == 'sell', False)[codes]
+        is_dividend = np.append(categories == 'dividend', False)[codes]
+    else:
+        trade_type = trade_type.astype(str).str.lower().to_numpy()
+        is_buy = trade_type == 'buy'
+        is_sell = trade_type == 'sell'
+        is_dividend = trade_type == 'dividend'
+    valid = is_buy | is_sell | is_dividend
+
+    skipped = len(valid) - np.count_nonzero(valid)
+    if skipped:
+        logger.warning('Skipping %d row(s) found with trade_type != buy / sell / dividend', skipped)
+
+    quantity = trades['quantity'].to_numpy(dtype=np.float64)
+    price = trades['price'].to_numpy(dtype=np.float64)
+    sign = np.where(is_buy, -1.0, np.where(is_sell, 1.0, 0.0))
+    amounts = quantity * price * sign
+    if is_dividend.any():
+        amounts[is_dividend] = quantity[is_dividend] * price[is_dividend]
+
+    return {
+        'dates': to_datetime64(trades['trade_date']),
+        'amounts': amounts,
+        'quantities': quantity * -sign,
+        'is_buy': is_buy,
+        'is_sell': is_sell,
+        'is_dividend': is_dividend,
+        'valid': valid
+    }
+
+def trades_to_cashflow_arrays(trades):
+    """
+    Returns the cashflows of trades as arrays which can be passed directly to pyxirr as
+    xirr(dates, amounts). Rows which are neither buy, sell nor dividend are dropped.
+    """
+    columns = cashflow_columns(trades)
+    valid = columns['valid']
+    return {
+        'dates': columns['dates'][valid],
+        'amounts': columns['amounts'][valid],
+        'has_one_buy': bool(columns['is_buy'].any()),
+        'has_one_sell': bool(columns['is_sell'].any())
+    }
+
+def summarize_by_symbol(trades, columns=None):
+    """
+    Aggregates the cashflows of all symbols in one vectorized pass.
+
+    Returns a pandas DataFrame indexed by symbol with the following columns:
+    count_buys, count_sells: number of buy / sell trades
+    buy_quantity, sell_quantity: total quantity bought / sold
+    net_quantity: buy_quantity - sell_quantity (0 when every bought share has been sold)
+    profit: sum of all signed cashflows (dividends included)
+    total_acquisitions: sum of the negative cashflows (i.e. money spent on buys)
+    dividends: sum of the dividends received
+
+    columns can be passed in if cashflow_columns has already been computed for trades.
+    """
+    if columns is None:
+        columns = cashflow_columns(trades)
+    is_buy = columns['is_buy']
+    is_sell = columns['is_sell']
+    amounts = columns['amounts']
+    quantity = np.abs(columns['quantities'])
+
+    codes, symbols = pd.factorize(trades['symbol'], sort=True)
+    n = len(symbols)
+
+    def per_symbol(weights):
+        return np.bincount(codes, weights=weights, minlength=n)
+
+    summary = pd.DataFrame({
+        'count_buys': per_symbol(is_buy.astype(np.float64)).astype(np.int64),
+        'count_sells': per_symbol(is_sell.astype(np.float64)).astype(np.int64),
+        'buy_quantity': per_symbol(np.where(is_buy, quantity, 0.0)),
+        'sell_quantity': per_symbol(np.where(is_sell, quantity, 0.0)),
+        'profit': per_symbol(amounts),
+        'total_acquisitions': per_symbol(np.where(amounts < 0, amounts, 0.0)),
+        'dividends': per_symbol(np.where(columns['is_dividend'], amounts, 0.0))
+    }, index=pd.Index(symbols, name='symbol'))
+    summary['net_quantity'] = summary['buy_quantity'] - summary['sell_quantity']
+    return summary
+
+def aggregate_chunks(chunks):
+    """
+    Aggregates trades given as an iterable of dataframes (e.g. tradebooks_reader.iterTrades)
+    without ever holding all of them in memory.
+
+    Returns a dictionary with:
+    summary: same as summarize_by_symbol over all the trades
+    dates, amounts: the portfolio cashflows summed per day, sorted by date. XIRR of these
+                    is the same as XIRR of the individual cashflows.
+    """
+    summaries = []
+    daily = []
+    for chunk in chunks:
+        columns = cashflow_columns(chunk)
+        summaries.append(summarize_by_symbol(chunk, columns))
+        valid = columns['valid']
+        daily.append(pd.Series(columns['amounts'][valid]).groupby(columns['dates'][valid]).sum())
+
+    if not summaries:
+        empty = pd.DataFrame(columns=['symbol', 'trade_date', 'trade_type', 'quantity', 'price'])
+        return {'summary': summarize_by_symbol(empty),
+                'dates': np.array([], dtype='datetime64[D]'), 'amounts': np.array([])}
+
+    # every column but net_quantity is a sum, so chunk summaries add up
+    summary = pd.concat(summaries).groupby(level='symbol', sort=True).sum()
+    summary['net_quantity'] = summary['buy_quantity'] - summary['sell_quantity']
+    daily = pd.concat(daily).groupby(level=0, sort=True).sum()
+    return {
+        'summary': summary,
+        'dates': daily.index.to_numpy().astype('datetime64[D]'),
+        'amounts': daily.to_numpy()
+    }
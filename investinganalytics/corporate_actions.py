@@ -0,0 +1,146 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from . import cashflows
+from . import instrumentation
+
+"""
+Corporate actions engine.
+
+resources/corporate-actions.csv lists actions as
+    date, original-symbol, original-qty, converted-symbol, converted-qty
+meaning that on date, every original-qty shares of original-symbol held became converted-qty shares
+of converted-symbol. This covers splits, bonuses and consolidations (same symbol on both sides)
+and mergers / symbol conversions (different symbols).
+
+An action is applied to the trades of original-symbol made before its date: the symbol is
+converted, the quantity multiplied by converted-qty / original-qty and the price divided by it,
+so the cashflow (quantity * price) of every trade is unchanged. Trades made on or after the date
+are already in the converted terms.
+
+Actions chain: a trade converted by an action is then subject to the later actions of its new
+symbol. The chains are composed on the actions table first (each action is linked to the next
+action of its converted symbol, and the overall ratio and final symbol are accumulated from the
+latest action backwards). The ledger is then joined only once: a sorted as-of join finds the
+first action of every trade, which carries the whole composed conversion. The ledger is never
+rescanned per action.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPORATE_ACTIONS_FILE = os.path.join('resources', 'corporate-actions.csv')
+
+def read_corporate_actions(filename=DEFAULT_CORPORATE_ACTIONS_FILE):
+    """
+    Returns the corporate actions as a DataFrame sorted by date with columns
+    date (datetime64), original_symbol, converted_symbol, ratio (converted-qty / original-qty)
+    """
+    try:
+        data = pd.read_csv(filename)
+    except FileNotFoundError:
+        logger.warning('Corporate actions file not found at %s', filename)
+        data = pd.DataFrame(columns=['date', 'original-symbol', 'original-qty', 'converted-symbol', 'converted-qty'])
+
+    # a 0 original-qty is reported below with the other invalid quantities
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = data['converted-qty'].to_numpy(dtype=np.float64) / data['original-qty'].to_numpy(dtype=np.float64)
+    actions = pd.DataFrame({
+        'date': cashflows.to_datetime64(data['date']).astype('datetime64[s]'),
+        'original_symbol': data['original-symbol'].astype(str).str.strip().to_numpy(dtype=object),
+        'converted_symbol': data['converted-symbol'].astype(str).str.strip().to_numpy(dtype=object),
+        'ratio': ratio
+    })
+    invalid = ~np.isfinite(actions['ratio']) | (actions['ratio'] <= 0)
+    if invalid.any():
+        logger.warning('Skipping corporate actions with invalid quantities:\n%s', data[invalid.to_numpy()])
+        actions = actions[~invalid]
+    # a holding is converted by one action per date: a second action of the same symbol on the same
+    # date (e.g. a demerger written as AAA -> AAA plus AAA -> BBB) cannot be applied
+    duplicated = actions.duplicated(['original_symbol', 'date'], keep='first').to_numpy()
+    if duplicated.any():
+        clashing = actions.duplicated(['original_symbol', 'date'], keep=False).to_numpy()
+        logger.warning('Several corporate actions of the same symbol on the same date, only the first one '
+                       'listed is applied (demergers are not supported):\n%s', data[~invalid.to_numpy()][clashing])
+        actions = actions[~duplicated]
+    return actions.sort_values('date', kind='stable').reset_index(drop=True)
+
+def action_key(symbols, dates):
+    return pd.DataFrame({'symbol': pd.Series(symbols, dtype=object).to_numpy(), 'date': dates})
+
+def next_actions(actions, symbols, dates):
+    """
+    Returns for each (symbol, date) the index (in actions) of the first action of symbol dated
+    strictly after date, -1 if there is none
+    """
+    left = action_key(symbols, dates)
+    left['position'] = np.arange(len(left))
+    left = left.sort_values('date', kind='stable')
+    right = action_key(actions['original_symbol'], actions['date'].to_numpy())
+    right['action'] = np.arange(len(actions))
+    matched = pd.merge_asof(left, right, on='date', by='symbol', direction='forward', allow_exact_matches=False)
+    result = np.full(len(left), -1, dtype=np.int64)
+    found = matched['action'].notna().to_numpy()
+    result[matched['position'].to_numpy()[found]] = matched['action'].to_numpy()[found].astype(np.int64)
+    return result
+
+def compose_actions(actions):
+    """
+    Returns (final_symbol, total_ratio) arrays aligned with actions: the symbol and the ratio a
+    holding ends up with after the action and every later action it is subject to
+    """
+    dates = actions['date'].to_numpy()
+    following = next_actions(actions, actions['converted_symbol'], dates)
+    final_symbol = actions['converted_symbol'].to_numpy(dtype=object).copy()
+    total_ratio = actions['ratio'].to_numpy(dtype=np.float64).copy()
+    # the following action is always dated later, so walking back from the latest action
+    # finds it already composed
+    for i in range(len(actions) - 1, -1, -1):
+        j = following[i]
+        if j >= 0:
+            final_symbol[i] = final_symbol[j]
+            total_ratio[i] *= total_ratio[j]
+    return final_symbol, total_ratio
+
+def source_symbols(actions, symbols):
+    """
+    Returns the symbols whose trades can end up as one of symbols once the actions are applied:
+    symbols themselves and the symbols converted into them (e.g. by a merger)
+    """
+    symbols = set(symbols)
+    if len(actions) == 0:
+        return symbols
+    final_symbol, _ = compose_actions(actions)
+    converted = np.isin(final_symbol, list(symbols))
+    return symbols | set(actions['original_symbol'].to_numpy(dtype=object)[converted])
+
+@instrumentation.timed('apply_corporate_actions')
+def apply_corporate_actions(trades, actions):
+    """
+    Returns trades with the corporate actions applied (see module documentation)
+    """
+    if len(actions) == 0 or len(trades) == 0:
+        return trades
+
+    final_symbol, total_ratio = compose_actions(actions)
+    symbols = trades['symbol'].to_numpy(dtype=object)
+    first_action = next_actions(actions, symbols,
+                                cashflows.to_datetime64(trades['trade_date']).astype('datetime64[s]'))
+    hit = first_action >= 0
+    logger.info('Corporate actions adjusted %d trade(s)', np.count_nonzero(hit))
+    if not hit.any():
+        return trades
+    # to_numpy can return the trades' own symbols (e.g. of a str column), never written to
+    symbols = symbols.copy()
+    symbols[hit] = final_symbol[first_action[hit]]
+    factor = np.ones(len(trades))
+    factor[hit] = total_ratio[first_action[hit]]
+
+    # only the adjusted columns are new, the others stay shared with trades (e.g. memory-mapped)
+    quantity = trades['quantity'].to_numpy(dtype=np.float64) * factor
+    if np.array_equal(quantity, np.trunc(quantity)):
+        quantity = quantity.astype(trades['quantity'].dtype)
+    if isinstance(trades['symbol'].dtype, pd.CategoricalDtype):
+        symbols = pd.Categorical(symbols)
+    return trades.assign(symbol=symbols, quantity=quantity,
+                         price=trades['price'].to_numpy(dtype=np.float64) / factor)
@@ -0,0 +1,105 @@
+import logging
+import numpy as np
+import pandas as pd
+from . import cashflows
+from . import instrumentation
+
+"""
+Dividend cashflows.
+
+The price histories (see price_store.PriceStore.get_history) have a Dividends column: the
+dividend per share paid on every ex-date, split adjusted like the prices. Whoever holds a share at
+the close of the day before an ex-date receives its dividend, so every ex-date pays
+    (quantity held before the ex-date) * (dividend per share)
+The trades are in the terms of the latest corporate actions (see corporate_actions), the same
+terms as the split adjusted dividends.
+
+The quantity held comes from the holdings timeline, the cumulative quantity of every symbol after
+each of its trades. The dividends of all symbols are joined with it in one sorted as-of join, so
+the cost does not depend on how the dividends are spread over symbols and years. Dividends
+received are returned in the normalized trades format with trade_type 'dividend' (the quantity
+held, and the dividend per share as price), which the cashflow engine counts as money coming in
+(see cashflows.cashflow_columns): concatenated with the trades, they are part of the portfolio and
+stock-wise XIRR and profit.
+
+Dividends are dated on their ex-date, the payment date is not in the histories. The dividends of
+symbols merged into another one are not counted, their history is no longer available.
+"""
+
+logger = logging.getLogger(__name__)
+
+DIVIDEND = 'dividend'
+# what is left of a sold out position after adding up fractional quantities
+MIN_QUANTITY = 1e-9
+
+def dividend_table(stock_history_database):
+    """
+    Returns the dividends in the price histories as a DataFrame sorted by ex-date with columns
+    symbol, ex_date (datetime64[s]), dividend (per share)
+
+    stock_history_database: { symbol : history dataframe }, or a yfin_helper.StocksHistory
+    """
+    histories = getattr(stock_history_database, 'stock_history_database', stock_history_database)
+    symbols, dates, amounts = [], [], []
+    for symbol, history in histories.items():
+        if history is None or 'Dividends' not in history:
+            continue
+        dividends = history['Dividends'].to_numpy(dtype=np.float64)
+        paid = np.flatnonzero(dividends > 0)
+        if len(paid) == 0:
+            continue
+        symbols.append(np.full(len(paid), symbol, dtype=object))
+        dates.append(np.asarray(history.index[paid], dtype=object))
+        amounts.append(dividends[paid])
+
+    table = pd.DataFrame({
+        'symbol': np.concatenate(symbols) if symbols else np.array([], dtype=object),
+        # the dates of all symbols converted at once
+        'ex_date': cashflows.to_datetime64(np.concatenate(dates) if dates else []).astype('datetime64[s]'),
+        'dividend': np.concatenate(amounts) if amounts else np.array([], dtype=np.float64)
+    })
+    return table.sort_values('ex_date', kind='stable').reset_index(drop=True)
+
+@instrumentation.timed('dividends')
+def dividend_trades(trades, dividends):
+    """
+    Returns the dividends received on the holdings of trades as normalized trades with trade_type
+    'dividend', the quantity held on the ex-date as quantity and the dividend per share as price.
+    Ex-dates on which nothing was held are left out.
+
+    Args:
+        trades: normalized trades (without the holdings converted to sells)
+        dividends: see dividend_table
+    """
+    received = pd.DataFrame({'symbol': np.array([], dtype=object), 'trade_date': np.array([], dtype='datetime64[s]'),
+                             'trade_type': np.array([], dtype=object), 'quantity': np.array([]), 'price': np.array([])})
+    if len(trades) == 0 or len(dividends) == 0:
+        return received
+
+    # holdings timeline: the quantity of a symbol held after each of its trades
+    columns = cashflows.cashflow_columns(trades)
+    valid = columns['valid']
+    timeline = pd.DataFrame({
+        'symbol': trades['symbol'].to_numpy(dtype=object)[valid],
+        'date': columns['dates'][valid].astype('datetime64[s]'),
+        'held': columns['quantities'][valid]
+    }).sort_values('date', kind='stable')
+    timeline['held'] = timeline.groupby('symbol', sort=False)['held'].cumsum()
+
+    # the last trade strictly before the ex-date: shares bought on the ex-date get no dividend,
+    # shares sold on it still do
+    left = pd.DataFrame({'symbol': dividends['symbol'].to_numpy(dtype=object),
+                         'date': dividends['ex_date'].to_numpy(), 'dividend': dividends['dividend'].to_numpy()})
+    matched = pd.merge_asof(left, timeline, on='date', by='symbol', direction='backward', allow_exact_matches=False)
+    held = matched['held'].to_numpy(dtype=np.float64, na_value=np.nan)
+    paid = held > MIN_QUANTITY
+    instrumentation.count('dividends_received', np.count_nonzero(paid))
+    if not paid.any():
+        return received
+    return pd.DataFrame({
+        'symbol': matched['symbol'].to_numpy(dtype=object)[paid],
+        'trade_date': matched['date'].to_numpy()[paid],
+        'trade_type': np.full(np.count_nonzero(paid), DIVIDEND, dtype=object),
+        'quantity': held[paid],
+        'price': matched['dividend'].to_numpy(dtype=np.float64)[paid]
+    })
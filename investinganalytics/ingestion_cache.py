@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from . import instrumentation
+from . import ledger_store
+
+"""
+Incremental ingestion cache.
+
+Parsing a tradebook (CSV read, alias rewriting, date parsing) is only done once per file content.
+The normalized trades of every file are pickled under the cache directory, and the combined
+ledger of all the files is kept in a memory-mapped columnar store (see ledger_store). On a re-run:
+- a file whose size and mtime have not changed is not even read,
+- a file whose size or mtime changed is hashed, and only parsed again if its content changed,
+- if no file changed, the ledger is mapped straight from the store, without reading it,
+- if files were only added after the ones already in the store (e.g. the tradebook of a new
+  year), only they are appended to the store, otherwise the store is rebuilt.
+
+Files the parsing depends on (e.g. resources/aliases.csv) are hashed as well: when one of them
+changes, every tradebook is parsed again.
+
+A cache holds the tradebooks of one folder: the ledger is the combination of all its files, and
+the pickles of files no longer in the folder are pruned. Every folder gets its own directory
+under the cache root (see folder_cache_dir), so that switching folders keeps both caches.
+"""
+
+DEFAULT_CACHE_DIR = os.path.join('cache', 'tradebooks')
+MANIFEST_FILE = 'manifest.json'
+LEDGER_DIR = 'ledger'
+
+def folder_cache_dir(cache_dir, folder):
+    """
+    The cache directory of the tradebooks of folder under the cache root cache_dir, named after the
+    folder and keyed by its absolute path
+    """
+    path = os.path.abspath(folder)
+    key = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{os.path.basename(path)}-{key}')
+
+def file_hash(filename):
+    """
+    sha256 of the content of filename, '' if the file does not exist
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return ''
+    return digest.hexdigest()
+
+class IngestionCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, dependencies=()):
+        """
+        cache_dir: directory holding the manifest and the pickled trades
+        dependencies: files which, when changed, invalidate every cached file
+        """
+        self.cache_dir = cache_dir
+        self.dependencies = list(dependencies)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self):
+        tmp_path = self._path(MANIFEST_FILE) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+
+    def _save(self, frame, name):
+        tmp_path = self._path(name) + '.tmp'
+        frame.to_pickle(tmp_path)
+        os.replace(tmp_path, self._path(name))
+
+    def dependencies_hash(self):
+        return hashlib.sha256(''.join(file_hash(f) for f in self.dependencies).encode()).hexdigest()
+
+    def _content_hash(self, filename, files):
+        """
+        Content hash of filename, taken from the manifest when its size and mtime are unchanged
+        """
+        stat = os.stat(filename)
+        entry = files.get(os.path.abspath(filename))
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+        sha = file_hash(filename)
+        files[os.path.abspath(filename)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha}
+        return sha
+
+    def load(self, filenames, parse, symbols=None):
+        """
+        Returns the trades of all filenames, one after the other, as a view of the ledger store,
+        parse(filename) being called only for the files which are new or changed since the last run.
+        None if there are no files.
+        symbols: if given, only the trades of these symbols, read through the store's symbol index
+        """
+        dependencies_hash = self.dependencies_hash()
+        if self.manifest.get('dependencies_hash') != dependencies_hash:
+            self.manifest = {'dependencies_hash': dependencies_hash, 'files': {}}
+        files = self.manifest.setdefault('files', {})
+
+        # every cached pickle is named after the content it was parsed from and the dependencies
+        pickles = []
+        for filename in filenames:
+            sha = self._content_hash(filename, files)
+            pickles.append(hashlib.sha256((sha + dependencies_hash).encode()).hexdigest()[:32] + '.pkl')
+        if not pickles:
+            self.manifest['files'] = {}
+            self._write_manifest()
+            return None
+
+        store = ledger_store.LedgerStore(self._path(LEDGER_DIR))
+        stored = self.manifest.get('ledger_files', [])
+        if stored == pickles and self.manifest.get('ledger_rows') == len(store):
+            instrumentation.count('ingestion_cache_hits', len(filenames))
+            self._write_manifest()
+            return store.frame() if symbols is None else store.select(symbols)
+
+        if stored != pickles[:len(stored)] or self.manifest.get('ledger_rows') != len(store):
+            store.clear()
+            stored = []
+        for filename, name in zip(filenames[len(stored):], pickles[len(stored):]):
+            if os.path.exists(self._path(name)):
+                instrumentation.count('ingestion_cache_hits')
+                frame = pd.read_pickle(self._path(name))
+            else:
+                instrumentation.count('ingestion_cache_misses')
+                frame = parse(filename)
+                self._save(frame, name)
+            store.append(frame)
+        self.manifest['ledger_files'] = pickles
+        self.manifest['ledger_rows'] = len(store)
+
+        # forget the files which are gone and their pickles
+        current = {os.path.abspath(filename) for filename in filenames}
+        self.manifest['files'] = {path: entry for path, entry in files.items() if path in current}
+        self._write_manifest()
+        self._prune(set(pickles))
+        return store.frame() if symbols is None else store.select(symbols)
+
+    def _prune(self, keep):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl') and name not in keep:
+                os.remove(self._path(name))
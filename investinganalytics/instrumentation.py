@@ -0,0 +1,186 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+"""
+Lightweight instrumentation of the pipeline: stage timers, counters and peak memory.
+
+The stages of a run are wrapped in stage('name') blocks (or the timed('name') decorator) and
+events are counted with count('name', n). Everything is off until enable() is called: a disabled
+stage() returns a shared no-op context manager and a disabled count() returns at once, so the
+hooks can stay in the hot paths.
+
+When enabled, every stage records its calls and total time, and every stage instance is kept
+as an event for write_chrome_trace() (chrome://tracing, Perfetto or speedscope). With
+enable(memory=True), tracemalloc tracks the peak memory of every stage (NumPy and pandas
+allocations included); tracemalloc slows the run down noticeably, so it is a separate switch.
+A cProfile profile of the run is written by profiled(path), in the pstats format read by
+snakeviz, gprof2dot or pstats itself.
+"""
+
+_enabled = False
+_trace_memory = False
+_lock = threading.Lock()
+_local = threading.local()
+_started = 0.0
+_stages = {}
+_counters = {}
+_events = []
+_null_stage = contextlib.nullcontext()
+
+def enable(memory=False):
+    """
+    Starts recording, forgetting anything recorded before
+    """
+    global _enabled, _trace_memory, _started
+    _stages.clear()
+    _counters.clear()
+    _events.clear()
+    _trace_memory = memory
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+        _local.stack = [_Frame('run')]
+    _started = time.perf_counter()
+    _enabled = True
+
+def disable():
+    global _enabled, _trace_memory
+    _enabled = False
+    if _trace_memory:
+        import tracemalloc
+        tracemalloc.stop()
+        _trace_memory = False
+
+def enabled():
+    return _enabled
+
+def count(name, n=1):
+    """
+    Adds n to the counter name
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+def stage(name):
+    """
+    Context manager timing the stage name
+    """
+    if not _enabled:
+        return _null_stage
+    return _stage(name)
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the stage name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class _Frame:
+    """
+    A stage being run. peak_before: highest memory seen in the stage before tracemalloc's peak was
+    last reset by a nested stage
+    """
+    def __init__(self, name):
+        self.name = name
+        self.peak_before = 0
+
+def _memory_enter(name):
+    import tracemalloc
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = [_Frame('thread')]
+    _, peak = tracemalloc.get_traced_memory()
+    stack[-1].peak_before = max(stack[-1].peak_before, peak)
+    tracemalloc.reset_peak()
+    stack.append(_Frame(name))
+
+def _memory_exit():
+    import tracemalloc
+    stack = _local.stack
+    frame = stack.pop()
+    _, peak = tracemalloc.get_traced_memory()
+    peak = max(peak, frame.peak_before)
+    stack[-1].peak_before = max(stack[-1].peak_before, peak)
+    return peak
+
+@contextlib.contextmanager
+def _stage(name):
+    if _trace_memory:
+        _memory_enter(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        peak = _memory_exit() if _trace_memory else None
+        with _lock:
+            stats = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            if peak is not None:
+                stats['peak_memory'] = max(stats.get('peak_memory', 0), peak)
+            _events.append((name, started - _started, seconds, threading.get_ident()))
+
+def report():
+    """
+    Returns what was recorded: {'stages': {name: {calls, seconds[, peak_memory]}}, 'counters': {...},
+    'peak_memory': bytes (with memory tracking)}
+    """
+    with _lock:
+        result = {'stages': {name: dict(stats) for name, stats in _stages.items()},
+                  'counters': dict(_counters)}
+    if _trace_memory:
+        import tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        result['peak_memory'] = max(peak, _local.stack[0].peak_before) if hasattr(_local, 'stack') else peak
+    return result
+
+def print_report():
+    recorded = report()
+    print('\n----- Instrumentation -----')
+    for name, stats in sorted(recorded['stages'].items(), key=lambda item: -item[1]['seconds']):
+        memory = f"   peak {stats['peak_memory'] / 2 ** 20:8.1f} MiB" if 'peak_memory' in stats else ''
+        print(f"{name:<36} {stats['calls']:6d} call(s) {stats['seconds'] * 1000:10.1f} ms{memory}")
+    for name, value in sorted(recorded['counters'].items()):
+        print(f'{name:<36} {value:>12}')
+    if 'peak_memory' in recorded:
+        print(f"{'peak memory':<36} {recorded['peak_memory'] / 2 ** 20:9.1f} MiB")
+
+def write_chrome_trace(path):
+    """
+    Writes the stages recorded as a Chrome trace (JSON array of complete events)
+    """
+    with _lock:
+        events = list(_events)
+    pid = os.getpid()
+    trace = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': seconds * 1e6, 'pid': pid, 'tid': tid}
+             for name, start, seconds, tid in events]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(trace, f)
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Runs the block under cProfile and writes the profile to path (pstats format)
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
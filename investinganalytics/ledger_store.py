@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+"""
+Append-only columnar store of normalized trades, memory-mapped from disk.
+
+Every column is a flat file of fixed-width values, written with ndarray.tofile:
+    trade_date.bin: datetime64[s], as in the normalized trades
+    symbol.bin: int32 id of the symbol in the store's symbol list
+    trade_type.bin: int8 id of the side in the store's trade type list ('buy', 'sell')
+    quantity.bin: int32 (float64 once a fractional quantity has been appended)
+    price.bin: float64
+and meta.json records the number of rows and the symbol and trade type lists.
+
+The symbol index is kept alongside: symbol_order.bin has the row positions sorted by symbol id
+(rows of a symbol in ledger order) and symbol_offsets.bin the range of every symbol id in it, the
+rows of symbol id i being symbol_order[symbol_offsets[i]:symbol_offsets[i + 1]]. It is rebuilt
+on the first lookup after an append, and select() uses it to read the rows of a few symbols only.
+
+append() writes the new rows at the end of every column file and then replaces meta.json, so
+a reader only ever sees complete rows (rows written after the last meta.json are ignored and
+overwritten by the next append). frame() memory-maps the columns and returns a DataFrame whose
+trade_date, trade_type, quantity and price columns are views of the mapped files: nothing is read
+until it is used, and the operating system can drop the pages again under memory pressure, so
+ledgers larger than memory can be analyzed. The files are mapped copy-on-write, writing to the
+frame never changes the store. Only the symbol codes are copied, to the sorted and narrowest
+codes pandas uses.
+"""
+
+META_FILE = 'meta.json'
+ORDER_FILE = 'symbol_order.bin'
+OFFSETS_FILE = 'symbol_offsets.bin'
+COLUMNS = ['symbol', 'trade_date', 'trade_type', 'quantity', 'price']
+DTYPES = {'symbol': np.int32, 'trade_date': 'datetime64[s]', 'trade_type': np.int8,
+          'quantity': np.int32, 'price': np.float64}
+
+class LedgerStore:
+    def __init__(self, directory):
+        """
+        directory: folder holding the column files, created if needed
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = self._read_meta()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path(META_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'rows': 0, 'symbols': [], 'trade_types': [], 'quantity_dtype': 'int32'}
+
+    def _write_meta(self):
+        tmp_path = self._path(META_FILE) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._path(META_FILE))
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def dtype(self, column):
+        return np.dtype(self.meta['quantity_dtype'] if column == 'quantity' else DTYPES[column])
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self.meta = self._read_meta()
+
+    def _ids(self, values, vocabulary, transform=str):
+        """
+        Ids of the transformed values in vocabulary (a list extended with the values not in it yet)
+        """
+        codes, uniques = pd.factorize(values)
+        uniques = [transform(value) for value in uniques]
+        known = {value: i for i, value in enumerate(vocabulary)}
+        for value in uniques:
+            if value not in known:
+                known[value] = len(vocabulary)
+                vocabulary.append(value)
+        if (codes < 0).any():
+            raise ValueError('cannot store trades with a missing symbol or trade type')
+        return np.array([known[value] for value in uniques], dtype=np.int64)[codes]
+
+    def _widen_quantity(self):
+        rows = len(self)
+        quantity = np.fromfile(self._path('quantity.bin'), dtype=np.int32, count=rows)
+        quantity.astype(np.float64).tofile(self._path('quantity.bin.tmp'))
+        os.replace(self._path('quantity.bin.tmp'), self._path('quantity.bin'))
+        self.meta['quantity_dtype'] = 'float64'
+
+    def append(self, trades):
+        """
+        Appends normalized trades (see tradebooks_reader.normalize), e.g. a tradebook or the chunks
+        of tradebooks_reader.iterTrades
+        """
+        if len(trades) == 0:
+            return
+        quantity = trades['quantity'].to_numpy(dtype=np.float64)
+        if self.meta['quantity_dtype'] == 'int32' and not (
+                np.array_equal(quantity, np.trunc(quantity)) and np.abs(quantity).max() < 2 ** 31):
+            self._widen_quantity()
+        columns = {
+            'symbol': self._ids(trades['symbol'], self.meta['symbols']),
+            'trade_date': trades['trade_date'].to_numpy(),
+            'trade_type': self._ids(trades['trade_type'], self.meta['trade_types'], lambda value: str(value).lower()),
+            'quantity': quantity,
+            'price': trades['price'].to_numpy(dtype=np.float64)
+        }
+        rows = len(self)
+        for column, values in columns.items():
+            dtype = self.dtype(column)
+            with open(self._path(column + '.bin'), 'ab') as f:
+                # drops what an interrupted append may have left after the last complete row
+                f.truncate(rows * dtype.itemsize)
+                np.ascontiguousarray(values.astype(dtype, copy=False)).tofile(f)
+        self.meta['rows'] = rows + len(trades)
+        self._write_meta()
+
+    def columns(self):
+        """
+        Returns {column: memory-mapped array} of the raw columns (symbol and trade_type as ids into
+        self.meta['symbols'] and self.meta['trade_types'])
+        """
+        rows = len(self)
+        if rows == 0:
+            return {column: np.empty(0, dtype=self.dtype(column)) for column in COLUMNS}
+        return {column: np.memmap(self._path(column + '.bin'), dtype=self.dtype(column), mode='c', shape=(rows,))
+                for column in COLUMNS}
+
+    def symbol_index(self):
+        """
+        Returns (order, offsets), the memory-mapped symbol index (see module documentation)
+        """
+        rows = len(self)
+        if self.meta.get('indexed_rows') != rows:
+            ids = self.columns()['symbol']
+            order = np.argsort(ids, kind='stable').astype(np.int64)
+            offsets = np.zeros(len(self.meta['symbols']) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(ids, minlength=len(self.meta['symbols'])), out=offsets[1:])
+            for name, values in [(ORDER_FILE, order), (OFFSETS_FILE, offsets)]:
+                values.tofile(self._path(name + '.tmp'))
+                os.replace(self._path(name + '.tmp'), self._path(name))
+            self.meta['indexed_rows'] = rows
+            self._write_meta()
+        if rows == 0:
+            return np.empty(0, dtype=np.int64), np.zeros(len(self.meta['symbols']) + 1, dtype=np.int64)
+        return (np.memmap(self._path(ORDER_FILE), dtype=np.int64, mode='r', shape=(rows,)),
+                np.memmap(self._path(OFFSETS_FILE), dtype=np.int64, mode='r'))
+
+    def rows_of(self, symbols):
+        """
+        Returns the sorted row positions of the trades of symbols (names not in the store are ignored)
+        """
+        ids = {symbol: i for i, symbol in enumerate(self.meta['symbols'])}
+        wanted = sorted(ids[symbol] for symbol in set(symbols) if symbol in ids)
+        if not wanted:
+            return np.empty(0, dtype=np.int64)
+        order, offsets = self.symbol_index()
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in wanted]))
+
+    def frame(self):
+        """
+        Returns the stored trades as a DataFrame in the normalized trades format, its numeric and date
+        columns being zero-copy views of the mapped files (see module documentation)
+        """
+        return self._frame(self.columns())
+
+    def select(self, symbols):
+        """
+        Returns the trades of symbols only, in ledger order and indexed by their row in the ledger,
+        reading just their rows through the symbol index. Symbols not in the store are ignored.
+        """
+        rows = self.rows_of(symbols)
+        frame = self._frame({column: values[rows] for column, values in self.columns().items()})
+        frame['symbol'] = frame['symbol'].cat.remove_unused_categories()
+        frame.index = rows
+        return frame
+
+    def _frame(self, columns):
+        data = {column: columns[column] for column in ['trade_date', 'quantity', 'price']}
+        for column, vocabulary in [('symbol', self.meta['symbols']), ('trade_type', self.meta['trade_types'])]:
+            categories = np.array(vocabulary, dtype=object)
+            order = np.argsort(categories, kind='stable') if len(categories) else np.empty(0, dtype=np.int64)
+            dtype = pd.CategoricalDtype(categories[order])
+            codes = columns[column]
+            if column == 'symbol' or not np.array_equal(order, np.arange(len(order))):
+                # ids to the codes of the sorted categories, in pandas' narrowest code dtype
+                rank = np.empty(len(order), dtype=np.int64)
+                rank[order] = np.arange(len(order))
+                codes = rank.astype(pd.Categorical([], categories=dtype.categories).codes.dtype)[codes]
+            data[column] = pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+        return pd.DataFrame({column: data[column] for column in COLUMNS}, copy=False)
@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+from . import cashflows
+
+"""
+Lot matching engine.
+
+Sells are matched to the buys of the same symbol lot by lot, giving the realized P&L and the
+holding period of every matched quantity.
+
+FIFO matching is done on the whole ledger at once. Within a symbol, the buys laid end to end
+form a queue of quantity intervals [0, b1), [b1, b1 + b2) ..., and the sells consume the same
+axis from 0 in the order they happen. A sell unit at position x is matched to the buy unit at
+position x, i.e. to the oldest buy not consumed yet. So the matched lots are the intersections
+of the buy intervals with the sell intervals: the queue is the array of cumulative buy
+quantities, its head is a pointer into it, and all pointers move together in one merge of the
+two sorted arrays of interval ends. The ledger is sorted once and everything after is linear.
+
+A sell of more than is held at that time (e.g. the buy is missing from the tradebooks) only
+matches what is held; the rest is reported as unmatched and does not consume later buys.
+Buys and sells of the same day are matched buys first.
+"""
+
+LONG_TERM_DAYS = 365
+MATCH_TOLERANCE = 1e-9
+
+LOT_COLUMNS = ['symbol', 'buy_date', 'sell_date', 'quantity', 'cost_price', 'sell_price',
+               'realized_pnl', 'holding_days', 'term']
+
+def sorted_ledger(trades):
+    """
+    Returns the buys and sells of trades as arrays sorted by symbol, date, buys before sells
+    """
+    columns = cashflows.cashflow_columns(trades)
+    # dividends (see dividends) are not lots
+    valid = columns['is_buy'] | columns['is_sell']
+    codes, symbols = pd.factorize(trades['symbol'].to_numpy(dtype=object)[valid], sort=True)
+    is_buy = columns['is_buy'][valid]
+    dates = columns['dates'][valid]
+    order = np.lexsort((~is_buy, dates, codes))
+    return {
+        'symbols': symbols,
+        'codes': codes[order],
+        'dates': dates[order],
+        'is_buy': is_buy[order],
+        'quantity': np.abs(columns['quantities'][valid][order]),
+        'price': trades['price'].to_numpy(dtype=np.float64)[valid][order]
+    }
+
+def group_running(values, codes):
+    """
+    Cumulative sum of values restarting at every new code (codes sorted)
+    """
+    total = np.cumsum(values)
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    before = np.repeat(total[starts] - values[starts], np.diff(np.append(starts, len(codes))))
+    return total - before
+
+def matchable_sell_quantity(ledger):
+    """
+    Returns the quantity of every sell which is covered by the holding at that time.
+
+    With S the running (buys - sells) of a symbol, the holding is S minus the lowest point S has
+    reached below 0, and every new low is a sell of more than is held.
+    """
+    signed = np.where(ledger['is_buy'], ledger['quantity'], -ledger['quantity'])
+    running = group_running(signed, ledger['codes'])
+    lowest = np.minimum(pd.Series(running).groupby(ledger['codes']).cummin().to_numpy(), 0.0)
+    previous_lowest = np.zeros(len(lowest))
+    previous_lowest[1:] = lowest[:-1]
+    previous_lowest[np.flatnonzero(np.diff(ledger['codes'], prepend=-1))] = 0.0
+    uncovered = previous_lowest - lowest
+    return np.where(ledger['is_buy'], 0.0, ledger['quantity'] - uncovered), uncovered
+
+def linear_scan(weights, terms):
+    """
+    Solves x[k] = weights[k] * x[k - 1] + terms[k] with x[-1] = 0 for every k at once: the pairs
+    (weights, terms) compose associatively, so log2(n) doubling steps of whole-array operations
+    combine every element with all the ones before it
+    """
+    weights = np.array(weights, dtype=np.float64)
+    x = np.array(terms, dtype=np.float64)
+    shift = 1
+    while shift < len(x):
+        # the right hand sides are evaluated before assignment, i.e. from the previous step
+        x[shift:] = x[shift:] + weights[shift:] * x[:-shift]
+        weights[shift:] = weights[shift:] * weights[:-shift]
+        shift *= 2
+    return x
+
+def average_cost_at_sells(ledger, matched):
+    """
+    Returns, for every row, the average cost of the holding just before it (meaningful for sells).
+    Buys move the average, sells take units out at the average and leave it unchanged.
+
+    So the average only changes at buys: with h the quantity held before a buy of q at price p, it
+    becomes w * average + (1 - w) * p, w = h / (h + q). The holding before every row is a running
+    sum, and the averages after every buy are the solution of that linear recurrence (see
+    linear_scan). A symbol's first buy, or a buy after its holding was sold out, has w = 0 and
+    starts afresh.
+    """
+    codes, is_buy, quantity = ledger['codes'], ledger['is_buy'], ledger['quantity']
+    n = len(codes)
+    average = np.zeros(n)
+    if n == 0:
+        return average
+    change = np.where(is_buy, quantity, -matched)
+    held_before = group_running(change, codes) - change
+    held_before[held_before <= MATCH_TOLERANCE] = 0.0
+
+    buy_rows = np.flatnonzero(is_buy)
+    held, bought = held_before[buy_rows], quantity[buy_rows]
+    total = held + bought
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(total > 0, held / total, 1.0)
+    average_after_buy = linear_scan(weights, (1.0 - weights) * ledger['price'][buy_rows])
+
+    # a sell is at the average after the last buy before it, if anything is held
+    last_buy = np.maximum.accumulate(np.where(is_buy, np.arange(n), -1))
+    sells = np.flatnonzero(~is_buy & (held_before > 0) & (last_buy >= 0))
+    average[sells] = average_after_buy[np.searchsorted(buy_rows, last_buy[sells])]
+    return average
+
+def match_lots(trades, method='fifo', long_term_days=LONG_TERM_DAYS, current_prices=None):
+    """
+    Matches the sells of trades to their buys.
+
+    method: 'fifo', or 'average' to take the cost of every sale at the average cost of the holding.
+            Lots and holding periods are FIFO in both cases.
+    long_term_days: lots held longer than this are 'long' term, the others 'short'
+    current_prices: optional symbol -> price mapping to value the open lots
+
+    Returns a dictionary of DataFrames:
+    lots: one row per matched (buy, sell) pair with LOT_COLUMNS
+    open_lots: quantities bought and not sold yet: symbol, buy_date, quantity, cost_price
+               (and market_price, unrealized_pnl when current_prices is given)
+    unmatched_sells: sells of more than was held: symbol, sell_date, quantity, sell_price
+    """
+    if method not in ('fifo', 'average'):
+        raise ValueError(f'Unknown lot matching method: {method}')
+    ledger = sorted_ledger(trades)
+    codes, is_buy, quantity = ledger['codes'], ledger['is_buy'], ledger['quantity']
+    symbols = np.asarray(ledger['symbols'], dtype=object)
+    matched, uncovered = matchable_sell_quantity(ledger)
+
+    buy_rows = np.flatnonzero(is_buy)
+    sell_rows = np.flatnonzero(~is_buy)
+    buy_quantity = quantity[buy_rows]
+    sell_quantity = matched[sell_rows]
+    # what is still held at the end closes every symbol's queue as an 'open' sell, so that each
+    # symbol's sells add up to its buys and all symbols can share one quantity axis
+    n_symbols = len(symbols)
+    open_quantity = (np.bincount(codes[buy_rows], weights=buy_quantity, minlength=n_symbols)
+                     - np.bincount(codes[sell_rows], weights=sell_quantity, minlength=n_symbols))
+    sell_codes = np.concatenate([codes[sell_rows], np.arange(n_symbols)])
+    order = np.argsort(sell_codes, kind='stable')
+    sell_rows = np.concatenate([sell_rows, np.full(n_symbols, -1)])[order]
+    sell_quantity = np.concatenate([sell_quantity, np.maximum(open_quantity, 0.0)])[order]
+
+    buy_ends = np.cumsum(buy_quantity)
+    sell_ends = np.cumsum(sell_quantity)
+    ends = np.union1d(buy_ends, sell_ends)
+    segment = np.diff(ends, prepend=0.0)
+    keep = segment > MATCH_TOLERANCE
+    ends, segment = ends[keep], segment[keep]
+    buy_index = np.minimum(np.searchsorted(buy_ends, ends - segment / 2), len(buy_rows) - 1)
+    sell_index = np.minimum(np.searchsorted(sell_ends, ends - segment / 2), len(sell_rows) - 1)
+    buy_row = buy_rows[buy_index] if len(buy_rows) else np.array([], dtype=np.int64)
+    sell_row = sell_rows[sell_index] if len(sell_rows) else np.array([], dtype=np.int64)
+
+    closed = sell_row >= 0
+    buy_row_closed, sell_row_closed, lot_quantity = buy_row[closed], sell_row[closed], segment[closed]
+    if method == 'average':
+        cost_price = average_cost_at_sells(ledger, matched)[sell_row_closed]
+    else:
+        cost_price = ledger['price'][buy_row_closed]
+    sell_price = ledger['price'][sell_row_closed]
+    holding_days = (ledger['dates'][sell_row_closed] - ledger['dates'][buy_row_closed]).astype(np.int64)
+    lots = pd.DataFrame({
+        'symbol': symbols[codes[sell_row_closed]],
+        'buy_date': ledger['dates'][buy_row_closed],
+        'sell_date': ledger['dates'][sell_row_closed],
+        'quantity': lot_quantity,
+        'cost_price': cost_price,
+        'sell_price': sell_price,
+        'realized_pnl': (sell_price - cost_price) * lot_quantity,
+        'holding_days': holding_days,
+        'term': pd.Categorical(np.where(holding_days > long_term_days, 'long', 'short'),
+                               categories=['short', 'long'])
+    }, columns=LOT_COLUMNS)
+
+    open_buy_rows = buy_row[~closed]
+    open_lots = pd.DataFrame({
+        'symbol': symbols[codes[open_buy_rows]],
+        'buy_date': ledger['dates'][open_buy_rows],
+        'quantity': segment[~closed],
+        'cost_price': ledger['price'][open_buy_rows]
+    })
+    if current_prices is not None:
+        open_lots['market_price'] = open_lots['symbol'].map(pd.Series(current_prices, dtype=np.float64))
+        open_lots['unrealized_pnl'] = (open_lots['market_price'] - open_lots['cost_price']) * open_lots['quantity']
+
+    short = np.flatnonzero(uncovered > MATCH_TOLERANCE)
+    unmatched_sells = pd.DataFrame({
+        'symbol': symbols[codes[short]],
+        'sell_date': ledger['dates'][short],
+        'quantity': uncovered[short],
+        'sell_price': ledger['price'][short]
+    })
+    return {'lots': lots, 'open_lots': open_lots, 'unmatched_sells': unmatched_sells}
+
+def summarize_lots(lots):
+    """
+    Returns the realized P&L per symbol split by term, with the quantity weighted holding days
+    """
+    weighted_days = lots['holding_days'] * lots['quantity']
+    summary = lots.assign(weighted_days=weighted_days).pivot_table(
+        index='symbol', columns='term', values='realized_pnl', aggfunc='sum', fill_value=0.0, observed=False)
+    summary.columns = [f'{term}_term_pnl' for term in summary.columns]
+    grouped = lots.assign(weighted_days=weighted_days).groupby('symbol')
+    summary['average_holding_days'] = grouped['weighted_days'].sum() / grouped['quantity'].sum()
+    return summary
@@ -0,0 +1,228 @@
+import importlib.util
+import json
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+"""
+Results and reports.
+
+The library reports progress and data problems through the logging module (one logger per
+module, messages formatted as 'WARN: ...' like the rest of the program), so the caller decides
+how much is shown: configure_logging(logging.WARNING) is quiet, logging.DEBUG also dumps the
+trades read. Calculations return a PortfolioReport (or a BenchmarkReport for the comparison with
+market indices), which can be printed or written as JSON, CSV or Parquet for downstream use.
+"""
+
+LEVEL_NAMES = {logging.WARNING: 'WARN'}
+REPORT_FORMATS = ['json', 'csv', 'parquet']
+PARQUET_ENGINES = ['pyarrow', 'fastparquet']
+
+class _StdoutHandler(logging.StreamHandler):
+    """
+    Writes to the current sys.stdout, so redirecting stdout (as batch mode does) also redirects logs
+    """
+    def emit(self, record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        record.levelshort = LEVEL_NAMES.get(record.levelno, record.levelname)
+        return super().format(record)
+
+def configure_logging(level=logging.INFO):
+    """
+    Shows the messages of the package at level and above on stdout
+    """
+    logger = logging.getLogger('investinganalytics')
+    if not any(isinstance(handler, _StdoutHandler) for handler in logger.handlers):
+        handler = _StdoutHandler()
+        handler.setFormatter(_Formatter('%(levelshort)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+class PortfolioReport:
+    def __init__(self, portfolio_xirr, stocks, symbols_with_no_sells, symbols_with_no_buys,
+                 realized=None, unrealized_pnl=None):
+        """
+        portfolio_xirr: XIRR of the whole portfolio (None when it cannot be calculated)
+        stocks: DataFrame indexed by symbol with the columns xirr, profit, return_made
+        symbols_with_no_sells / symbols_with_no_buys: symbols whose XIRR is not calculated
+        realized: DataFrame of realized P&L per symbol by holding period (lots.summarize_lots)
+        unrealized_pnl: P&L of the open lots at the holdings' last traded price
+        """
+        self.portfolio_xirr = portfolio_xirr
+        self.stocks = stocks
+        self.symbols_with_no_sells = list(symbols_with_no_sells)
+        self.symbols_with_no_buys = list(symbols_with_no_buys)
+        self.realized = realized
+        self.unrealized_pnl = unrealized_pnl
+
+    def top(self, column, n=10):
+        """
+        Returns (the n largest, the n smallest) stocks by column
+        """
+        values = pd.to_numeric(self.stocks[column], errors='coerce')
+        return (self.stocks.loc[values.nlargest(n).index],
+                self.stocks.loc[values.nsmallest(n).index])
+
+    def summary(self):
+        return {
+            'portfolio_xirr': plain_value(self.portfolio_xirr),
+            'stocks': len(self.stocks),
+            'profit': plain_value(self.stocks['profit'].sum()) if len(self.stocks) else 0.0,
+            'unrealized_pnl': plain_value(self.unrealized_pnl),
+            'symbols_with_no_sells': [str(symbol) for symbol in self.symbols_with_no_sells],
+            'symbols_with_no_buys': [str(symbol) for symbol in self.symbols_with_no_buys]
+        }
+
+    def tables(self):
+        tables = {'stocks': self.stocks}
+        if self.realized is not None:
+            tables['realized'] = self.realized
+        return tables
+
+    def to_dict(self):
+        result = self.summary()
+        result['stock_results'] = records(self.stocks)
+        if self.realized is not None:
+            result['realized'] = records(self.realized)
+        return result
+
+    def print(self, top_n=10):
+        if self.portfolio_xirr is not None:
+            print(f"Portfolio XIRR: {self.portfolio_xirr:.2%}")
+
+        print("XIRR for individual stocks:")
+        with pd.option_context('display.max_rows', None):
+            print(self.stocks)
+
+        if len(self.stocks) > top_n:
+            largest, smallest = self.top('profit', top_n)
+            print(f'\n----- Top {top_n} Absolute Profit trades -----\n')
+            print(largest)
+            print(f'\n----- Top {top_n} Absolute Loss trades -----\n')
+            print(smallest)
+
+            largest, smallest = self.top('return_made', top_n)
+            print(f'\n--- Top {top_n} % returns trades -----\n')
+            print(largest)
+            print(f'\n----- Top {top_n} % loss trades -----\n')
+            print(smallest)
+
+        # Print list of symbols with negative cashflows (if any)
+        if self.symbols_with_no_sells:
+            print("\nsymbols_with_no_sells (XIRR not calculated):")
+            print(", ".join(map(str, self.symbols_with_no_sells)))
+
+        if self.symbols_with_no_buys:
+            print("\nsymbols_with_no_buys (XIRR not calculated):")
+            print(", ".join(map(str, self.symbols_with_no_buys)))
+
+        if self.realized is not None and len(self.realized):
+            print('\n----- Realized P&L (FIFO) by holding period -----\n')
+            print(self.realized)
+        if self.unrealized_pnl is not None:
+            print(f"\nUnrealized P&L of open lots: {self.unrealized_pnl:.2f}")
+
+class BenchmarkReport:
+    def __init__(self, benchmarks, stocks, nav=None):
+        """
+        benchmarks: DataFrame indexed by benchmark with the portfolio and benchmark XIRR and values
+        stocks: DataFrame indexed by symbol with the XIRR and the excess return over every benchmark
+        nav: DataFrame indexed by date of the value of the portfolio and of its replay in every
+             benchmark, with their ratio (see benchmark_comparison.compare), or None
+        """
+        self.benchmarks = benchmarks
+        self.stocks = stocks
+        self.nav = nav
+
+    def summary(self):
+        return {'benchmarks': records(self.benchmarks)}
+
+    def tables(self):
+        tables = {'benchmarks': self.benchmarks, 'stocks': self.stocks}
+        if self.nav is not None:
+            tables['nav'] = self.nav
+        return tables
+
+    def to_dict(self):
+        result = self.summary()
+        result['stock_results'] = records(self.stocks)
+        if self.nav is not None:
+            result['nav'] = records(self.nav.rename(index=lambda day: day.strftime('%Y-%m-%d')))
+        return result
+
+    def print(self, with_tables=True):
+        for name, row in self.benchmarks.iterrows():
+            print(f"{name}: portfolio XIRR {row['portfolio_xirr']:.2%}, same cashflows in {name} "
+                  f"{row['benchmark_xirr']:.2%}, excess return {row['excess_return']:.2%}")
+        if not with_tables:
+            return
+
+        print("\nXIRR for individual stocks against the benchmarks:")
+        with pd.option_context('display.max_rows', None):
+            print(self.stocks)
+
+        if self.nav is not None and len(self.nav):
+            print('\n----- Relative NAV (value of the portfolio / value of the benchmark replay) at year ends -----\n')
+            relative = self.nav[[column for column in self.nav.columns if column.endswith('_relative')]]
+            print(relative.groupby(relative.index.year).last())
+
+def plain_value(value):
+    """
+    Converts NumPy scalars (and NaN) to plain Python values for JSON
+    """
+    if value is None:
+        return None
+    value = value.item() if isinstance(value, np.generic) else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def records(frame):
+    """
+    Returns the rows of frame, index included, as dictionaries of plain values
+    """
+    frame = frame.reset_index()
+    return [{str(key): plain_value(value) for key, value in row.items()} for row in frame.to_dict('records')]
+
+def write_report(report, path, report_format=None):
+    """
+    Writes report to path.
+    json: a single file with the summary and all the tables
+    csv / parquet: path is a directory, with summary.json and one file per table
+                   (see report.tables(), e.g. stocks, realized). Parquet needs pyarrow or fastparquet.
+    report_format defaults to the extension of path, json if it has none.
+    """
+    if report_format is None:
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        report_format = extension if extension in REPORT_FORMATS else 'json'
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f'Unknown report format: {report_format}, should be one of {REPORT_FORMATS}')
+
+    if report_format == 'json':
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report.to_dict(), f, indent=1)
+        return
+
+    if report_format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        raise ImportError('Writing parquet reports needs pyarrow or fastparquet, install one with pip')
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(report.summary(), f, indent=1)
+    for name, table in report.tables().items():
+        table = table.copy()
+        table.index = table.index.astype(str)
+        table = table.infer_objects()
+        if report_format == 'csv':
+            table.to_csv(os.path.join(path, name + '.csv'))
+        else:
+            table.to_parquet(os.path.join(path, name + '.parquet'))
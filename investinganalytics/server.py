@@ -0,0 +1,355 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+from . import cashflows
+from . import corporate_actions
+from . import ingestion_cache
+from . import reporting
+from . import symbols
+from . import xirr_filter_multiple
+from .yfinutils import price_store
+
+"""
+Local analytics server.
+
+Loads a portfolio folder once (the ledger, through the tradebook cache, the alias table and the
+price history found in the price cache) and answers queries about it over HTTP on localhost, or
+over a Unix socket, with JSON responses:
+
+    GET  /health             what is loaded, when, and how long it took
+    GET  /xirr               portfolio XIRR and summary (as in the xirr.py report)
+    GET  /stocks             XIRR, profit and return of every stock (?sort=<column>&top=<n>&ascending=1)
+    GET  /stocks/<symbol>    one stock's results with its trade counts and quantities
+    GET  /trades/<symbol>    trade history of a stock (old names and series suffixes are accepted)
+    GET  /nav                daily value of the portfolio (?start=YYYY-MM-DD&end=YYYY-MM-DD), needs the
+                             price history in the price cache; nothing is downloaded by the server
+    POST /reload             reloads the folder now
+
+Everything a query needs is computed when the folder is loaded, so queries are answered from
+memory. The folder's tradebooks and holdings, resources/aliases.csv and
+resources/corporate-actions.csv are watched (their size and mtime, every poll_seconds); when one
+changes, the folder is loaded again in a worker thread while queries are still answered from the
+previous load, which is then swapped for the new one. A load which fails is logged and the
+previous one is kept.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8737
+DEFAULT_POLL_SECONDS = 1.0
+TRADEBOOK_FILE_PATTERN = 'tradebook-*.csv'
+HOLDINGS_FILE = 'holdings.csv'
+WATCHED_RESOURCES = [symbols.DEFAULT_ALIASES_FILE, corporate_actions.DEFAULT_CORPORATE_ACTIONS_FILE]
+MAX_REQUEST_LINE = 8192
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class PortfolioState:
+    """
+    Everything loaded from a portfolio folder at one point in time, never modified once built
+    """
+    def __init__(self, folder, cache_dir, price_cache_dir, memo=None):
+        started = time.perf_counter()
+        self.tradebooks, self.holdings, self.trades = xirr_filter_multiple.load_portfolio(folder, cache_dir=cache_dir)
+        self.report = xirr_filter_multiple.portfolio_report(self.tradebooks, self.holdings, self.trades, memo=memo)
+        self.summary = cashflows.summarize_by_symbol(self.trades)
+        # row positions of every symbol's trades, for the trade history queries
+        self.symbol_rows = self.trades.reset_index(drop=True).groupby('symbol', observed=True).indices
+        self.nav = self._nav(price_cache_dir)
+        self.loaded_at = time.time()
+        self.load_seconds = time.perf_counter() - started
+
+    def _nav(self, price_cache_dir):
+        from . import trades_to_pf_series
+        from .yfinutils.yfin_helper import StocksHistory
+        if len(self.tradebooks) == 0:
+            return None
+        store = price_store.PriceStore(price_cache_dir)
+        histories = {}
+        for symbol in self.tradebooks['symbol'].unique():
+            history = store.load(str(symbol))
+            if history is not None:
+                histories[str(symbol)] = history
+        if not histories:
+            logger.warning('No price history in %s, /nav is not available', price_cache_dir)
+            return None
+        return trades_to_pf_series.createSnapshots(self.tradebooks, None, StocksHistory(histories))
+
+class AnalyticsService:
+    def __init__(self, folder, cache_dir=ingestion_cache.DEFAULT_CACHE_DIR,
+                 price_cache_dir=price_store.DEFAULT_CACHE_DIR, poll_seconds=DEFAULT_POLL_SECONDS):
+        """
+        folder: portfolio folder, laid out as for xirr.py
+        cache_dir / price_cache_dir: tradebook cache and price cache
+        poll_seconds: how often the watched files are checked for changes
+        """
+        from . import xirr_memo
+        self.folder = folder
+        self.cache_dir = cache_dir
+        self.price_cache_dir = price_cache_dir
+        self.poll_seconds = poll_seconds
+        self.memo = xirr_memo.XirrMemo()
+        self.state = None
+        self.generation = 0
+        self.loaded_fingerprint = None
+        self.last_error = None
+        self._reload_lock = asyncio.Lock()
+
+    def watched_files(self):
+        return (sorted(glob.glob(os.path.join(self.folder, TRADEBOOK_FILE_PATTERN)))
+                + [os.path.join(self.folder, HOLDINGS_FILE)] + WATCHED_RESOURCES)
+
+    def fingerprint(self):
+        """
+        (path, size, mtime) of every watched file which exists
+        """
+        stats = []
+        for path in self.watched_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(stats)
+
+    def load(self):
+        """
+        Loads the folder and swaps the new state in. Returns True on success; on failure the
+        previous state is kept.
+        """
+        fingerprint = self.fingerprint()
+        try:
+            state = PortfolioState(self.folder, self.cache_dir, self.price_cache_dir, self.memo)
+            self.memo.save()
+        except Exception as e:
+            logger.exception('Loading %s failed', self.folder)
+            self.last_error = str(e)
+            self.loaded_fingerprint = fingerprint
+            return False
+        self.state = state
+        self.generation += 1
+        self.loaded_fingerprint = fingerprint
+        self.last_error = None
+        logger.info('Loaded %s: %d trades in %.0f ms', self.folder, len(state.trades), state.load_seconds * 1000)
+        return True
+
+    async def reload(self):
+        async with self._reload_lock:
+            return await asyncio.to_thread(self.load)
+
+    async def watch(self):
+        """
+        Reloads the folder whenever a watched file changes, until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            if self.fingerprint() != self.loaded_fingerprint and not self._reload_lock.locked():
+                logger.info('Files changed in %s, reloading', self.folder)
+                await self.reload()
+
+    def _loaded(self):
+        state = self.state
+        if state is None:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, f'portfolio not loaded: {self.last_error}')
+        return state
+
+    async def handle(self, method, target):
+        """
+        Returns (status, JSON-ready body) of a request
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if method == 'POST' and parts == ['reload']:
+            ok = await self.reload()
+            return HTTPStatus.OK, {'reloaded': ok, 'generation': self.generation, 'error': self.last_error}
+        if method != 'GET':
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f'{method} is not supported on {url.path}')
+
+        if parts == ['health']:
+            return HTTPStatus.OK, self.health()
+        state = self._loaded()
+        if parts == ['xirr']:
+            return HTTPStatus.OK, state.report.summary()
+        if parts == ['stocks']:
+            return HTTPStatus.OK, self.stocks(state, query)
+        if len(parts) == 2 and parts[0] == 'stocks':
+            return HTTPStatus.OK, self.stock(state, parts[1])
+        if len(parts) == 2 and parts[0] == 'trades':
+            return HTTPStatus.OK, self.trade_history(state, parts[1])
+        if parts == ['nav']:
+            return HTTPStatus.OK, self.nav(state, query)
+        raise HttpError(HTTPStatus.NOT_FOUND, f'no such endpoint: {url.path}')
+
+    def health(self):
+        state = self.state
+        return {
+            'folder': self.folder,
+            'loaded': state is not None,
+            'generation': self.generation,
+            'loaded_at': None if state is None else state.loaded_at,
+            'load_seconds': None if state is None else state.load_seconds,
+            'trades': None if state is None else len(state.trades),
+            'nav': state is not None and state.nav is not None,
+            'error': self.last_error
+        }
+
+    def stocks(self, state, query):
+        stocks = state.report.stocks
+        sort = query.get('sort')
+        if sort is not None:
+            if sort not in stocks.columns:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f'sort should be one of {list(stocks.columns)}')
+            stocks = stocks.sort_values(sort, ascending=query.get('ascending') == '1', na_position='last')
+        if 'top' in query:
+            try:
+                stocks = stocks.head(int(query['top']))
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, 'top should be a number')
+        return reporting.records(stocks)
+
+    def _symbol(self, state, name):
+        symbol = xirr_filter_multiple.resolve_symbols([name])[0]
+        if symbol not in state.symbol_rows:
+            raise HttpError(HTTPStatus.NOT_FOUND, f'no trades of {name}')
+        return symbol
+
+    def stock(self, state, name):
+        symbol = self._symbol(state, name)
+        result = {'symbol': symbol}
+        if symbol in state.report.stocks.index:
+            result.update({column: reporting.plain_value(value)
+                           for column, value in state.report.stocks.loc[symbol].items()})
+        result.update({column: reporting.plain_value(value) for column, value in state.summary.loc[symbol].items()})
+        return result
+
+    def trade_history(self, state, name):
+        symbol = self._symbol(state, name)
+        trades = state.trades.iloc[state.symbol_rows[symbol]].sort_values('trade_date', kind='stable')
+        return reporting.records(trades.reset_index(drop=True).set_index('trade_date'))
+
+    def nav(self, state, query):
+        if state.nav is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, 'no price history in the price cache for this portfolio')
+        nav = state.nav
+        try:
+            if 'start' in query:
+                nav = nav[nav.index >= query['start']]
+            if 'end' in query:
+                nav = nav[nav.index <= query['end']]
+        except (TypeError, ValueError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'start and end should be dates (YYYY-MM-DD)')
+        return reporting.records(nav)
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+async def _respond(writer, status, body, keep_alive):
+    payload = json.dumps(body, default=_json_default).encode()
+    head = (f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + payload)
+    await writer.drain()
+
+async def _read_request(reader):
+    """
+    Returns (method, target, keep_alive) of the next request on the connection, None when it is closed
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    if len(line) > MAX_REQUEST_LINE:
+        raise HttpError(HTTPStatus.REQUEST_URI_TOO_LONG, 'request line too long')
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, 'malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    # request bodies are not used, but are read so that the connection can be reused
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, 'malformed Content-Length')
+    if length:
+        await reader.readexactly(length)
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    return method.upper(), target, keep_alive
+
+def connection_handler(service):
+    """
+    Returns the asyncio connection callback serving HTTP/1.1 requests (keep-alive included) with service
+    """
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as e:
+                    await _respond(writer, HTTPStatus(e.status), {'error': str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive = request
+                started = time.perf_counter()
+                try:
+                    status, body = await service.handle(method, target)
+                except HttpError as e:
+                    status, body = HTTPStatus(e.status), {'error': str(e)}
+                except Exception as e:
+                    logger.exception('%s %s failed', method, target)
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+                logger.debug('%s %s %d in %.1f ms', method, target, status.value, (time.perf_counter() - started) * 1000)
+                await _respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handle_connection
+
+async def start(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """
+    Starts serving service over HTTP on host:port (port 0 picks a free port), or on the Unix socket
+    socket_path. Returns the asyncio server; the portfolio must already be loaded (see
+    AnalyticsService.load).
+    """
+    handler = connection_handler(service)
+    if socket_path is not None:
+        return await asyncio.start_unix_server(handler, path=socket_path)
+    return await asyncio.start_server(handler, host, port)
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """
+    Loads the portfolio, then serves it and watches its files until cancelled
+    """
+    await service.reload()
+    server = await start(service, host, port, socket_path)
+    if socket_path is not None:
+        logger.info('Serving %s on unix socket %s', service.folder, socket_path)
+    else:
+        address = server.sockets[0].getsockname()
+        logger.info('Serving %s on http://%s:%d', service.folder, address[0], address[1])
+    watcher = asyncio.create_task(service.watch())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
@@ -0,0 +1,84 @@
+import builtins
+import sys
+import time
+
+"""
+Startup profiling for the command line tools.
+
+Only the standard library is imported here, so the clock starts before the heavy modules
+(pandas, numpy, pyxirr) are loaded. The entry points import those lazily, in the modes that need
+them, and mark the phases of a run with mark(). With ImportProfiler active, the time spent
+importing every package is measured, each module's time being counted without the modules it
+imports itself (like python -X importtime, summed per top-level package).
+
+Startup budget: in xirr mode with the tradebooks already in the ingestion cache, the portfolio
+should be loaded (imports, cached ledger, holdings and corporate actions read) within
+STARTUP_BUDGET_SECONDS of xirr.py starting. Run with --profile-startup to check it.
+"""
+
+STARTUP_BUDGET_SECONDS = 0.75
+PORTFOLIO_LOADED = 'portfolio loaded'
+
+_started = time.perf_counter()
+_marks = []
+
+def mark(phase):
+    """
+    Records the time at which phase ended
+    """
+    _marks.append((phase, time.perf_counter() - _started))
+
+def elapsed(phase):
+    """
+    Returns the seconds from startup to the end of phase, None if it was not marked
+    """
+    return next((seconds for name, seconds in _marks if name == phase), None)
+
+class ImportProfiler:
+    """
+    While active, measures the time spent importing modules, by top-level package
+    """
+    def __init__(self):
+        self.seconds = {}
+        self._nested = [0.0]
+        self._import = None
+
+    def __enter__(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        loaded = len(sys.modules)
+        self._nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            took = time.perf_counter() - started
+            nested = self._nested.pop()
+            self._nested[-1] += took
+            if len(sys.modules) > loaded:
+                if level:
+                    name = (globals or {}).get('__package__') or name
+                package = name.partition('.')[0]
+                self.seconds[package] = self.seconds.get(package, 0.0) + took - nested
+
+def print_profile(profiler=None, budget=STARTUP_BUDGET_SECONDS, top=10):
+    """
+    Prints the import time of the top packages and the phases marked so far
+    """
+    print('\n----- Startup profile -----')
+    if profiler is not None:
+        print(f'Imports: {sum(profiler.seconds.values()) * 1000:.1f} ms')
+        for package, seconds in sorted(profiler.seconds.items(), key=lambda item: -item[1])[:top]:
+            print(f'    {package:<24} {seconds * 1000:8.1f} ms')
+    for phase, seconds in _marks:
+        print(f'{phase:<28} {seconds * 1000:8.1f} ms since start')
+    loaded = elapsed(PORTFOLIO_LOADED)
+    if loaded is not None and budget is not None:
+        status = 'within' if loaded <= budget else 'OVER'
+        print(f'Startup {loaded * 1000:.1f} ms, {status} the budget of {budget * 1000:.0f} ms')
@@ -0,0 +1,110 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from . import alias_reader
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+"""
+Symbol normalization shared by the readers.
+
+Broker symbols carry series suffixes (AEL-BE) and old names of renamed companies. Normalizing a
+symbol means trimming the suffix and then following resources/aliases.csv to the current name.
+Aliases are resolved transitively (A -> B, B -> C maps A to C), and the work is done once per
+distinct symbol rather than once per row: the column is factorized, the unique symbols are
+mapped, and the codes are used to take the mapped values back to every row.
+"""
+
+DEFAULT_ALIASES_FILE = os.path.join('resources', 'aliases.csv')
+
+# aliases file path -> (mtime_ns, resolved aliases)
+_aliases_cache = {}
+
+def trim_hyphen_suffix(text):
+    return text.split('-')[0]  # Split on hyphen and return the first part (AEL)
+
+def resolve_aliases(aliases):
+    """
+    Resolves chains of aliases so that every old name maps directly to its final name.
+    Names which are part of a cycle (A -> B -> A) are reported and left unchanged.
+    """
+    resolved = {}
+    for start in aliases:
+        chain = [start]
+        seen = {start}
+        name = start
+        while name in aliases and aliases[name] != name:
+            name = aliases[name]
+            if name in seen:
+                logger.error('alias cycle, these symbols are not renamed: %s', ' -> '.join(chain + [name]))
+                name = None
+                break
+            seen.add(name)
+            chain.append(name)
+        if name is not None and name != start:
+            resolved[start] = name
+    return resolved
+
+def load_aliases(filename=DEFAULT_ALIASES_FILE):
+    """
+    Returns the resolved aliases of filename. The file is read again only when it changes.
+    """
+    try:
+        mtime_ns = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+    cached = _aliases_cache.get(filename)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, resolve_aliases(alias_reader.getAliases(filename)))
+        _aliases_cache[filename] = cached
+    return cached[1]
+
+def shared_aliases(filename=DEFAULT_ALIASES_FILE):
+    """
+    Returns the loaded aliases of filename in a form which can be sent to worker processes,
+    so that they use the same alias table without reading and resolving it again
+    (see use_shared_aliases)
+    """
+    load_aliases(filename)
+    return filename, _aliases_cache[filename]
+
+def use_shared_aliases(shared):
+    filename, cached = shared
+    _aliases_cache[filename] = cached
+
+@instrumentation.timed('normalize_symbols')
+def normalize_symbols(symbols, aliases=None):
+    """
+    Trims the suffix and applies aliases to a column of symbols, in one pass over its unique values.
+    Returns a Series aligned with symbols; categorical if symbols is categorical.
+
+    aliases: resolved aliases (see resolve_aliases), default is load_aliases()
+    """
+    if aliases is None:
+        aliases = load_aliases()
+    symbols = pd.Series(symbols)
+    categorical = isinstance(symbols.dtype, pd.CategoricalDtype)
+    if categorical:
+        codes, uniques = symbols.cat.codes.to_numpy(), symbols.cat.categories
+    else:
+        codes, uniques = pd.factorize(symbols)
+
+    trimmed = pd.Series(uniques, dtype=object).str.split('-', n=1).str[0]
+    renamed = trimmed.map(aliases)
+    if logger.isEnabledFor(logging.DEBUG):
+        for oldname, newname in zip(trimmed[renamed.notna()], renamed[renamed.notna()]):
+            logger.debug('Replacing %s with %s', oldname, newname)
+    mapped = renamed.fillna(trimmed).to_numpy(dtype=object)
+
+    if categorical:
+        # several old names can map to the same symbol, so the categories are rebuilt
+        new_codes, categories = pd.factorize(mapped)
+        # code -1 (missing symbol) picks the appended -1
+        codes = np.append(new_codes, -1)[codes]
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=symbols.index, name=symbols.name)
+    values = np.full(len(codes), np.nan, dtype=object)
+    present = codes >= 0
+    values[present] = mapped[codes[present]]
+    return pd.Series(values, index=symbols.index, name=symbols.name).astype(symbols.dtype)
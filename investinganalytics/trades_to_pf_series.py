@@ -1,62 +1,111 @@
+import logging
+import numpy as np
 import pandas as pd
-from datetime import datetime, date, timedelta
-def createSnapshots(trades, snapshots, stock_history_database):
+from datetime import date
+from . import cashflows
+
+logger = logging.getLogger(__name__)
+
+def createSnapshots(trades, snapshots, stock_history_database, end_date=None):
     """
     For each date the market is open, the portfolio changes due to stock price movements
     We can calculate:
     1. Portfolio value on close of that day (need stock close price)
     2. Average P/E of the pf (need P/E)
     3. Any cash generated (via sell transactions)
-    4. 
-
-    So a pandas dataframe can be returned 
-    with Index = Date
-    Columns = Value, Cashflow out, P/E
-    
-    The snapshot structure is as follows:
-    # type: pandas dataframe
-     {
-        'date': [2024-01-01, .....],
-        'totalValue': [],
-        'AveragePE': [],
-        any other consolidated metrics
-        #TODO holdings: []
-    }
+    4.
+
+    So a pandas dataframe is returned
+    with Index = Date (every trading day from the first trade to end_date, default today)
+    Columns:
+        value: value of the holdings at the close of that day
+        net_cashflow: sum of that day's cashflows (buys negative, sells positive, as in xirr)
+        invested_capital: money put in so far net of sale proceeds, i.e. -cumsum(net_cashflow)
+    #TODO: Average P/E and other consolidated metrics
+
+    Args:
+        trades: trades dataframe (symbol, trade_date, trade_type, quantity, price)
+        snapshots: trades_to_snapshots.Snapshots of the same trades, or None to build the holdings
+                   directly from trades
+        stock_history_database: yfin_helper.StocksHistory with the price history of the symbols
 
-    Holdings will have:
-        {Stock, quantity, close price}
+    Everything is computed in bulk: the holdings on every day come from one cumulative sum over a
+    (days x symbols) matrix of quantity changes, and are valued by one product with the price matrix.
     """
-    portfolio_history = {}
-    start_date = trades['trade_date'].min()
-    print('Start date: ', start_date)
-    
-    current_date = start_date
+    price_matrix = stock_history_database.price_matrix()
+    start_date = np.datetime64(trades['trade_date'].min(), 'D')
+    end_date = np.datetime64(end_date if end_date is not None else date.today(), 'D')
 
-    # we will take start_date - 1 as the portfolio inception date
-    portfolio_inception_date = start_date - timedelta(days=1)
-    portfolio_history[portfolio_inception_date] = {
-        'value': 0
-        # can add other stuff like p/e here
-    }
-    interval = 1
-    while (current_date <= date.today()):
-        portfolio_history[portfolio_inception_date] = get_pf_data(current_date)
-        current_date += timedelta(days=interval)
+    in_period = (price_matrix.dates >= start_date) & (price_matrix.dates <= end_date)
+    calendar = price_matrix.dates[in_period]
+
+    if snapshots is not None:
+        holdings = holdings_from_snapshots(snapshots, calendar, price_matrix.symbols)
+    else:
+        holdings = holdings_from_trades(trades, calendar, price_matrix.symbols)
+
+    value = np.einsum('ij,ij->i', price_matrix.filled_closes[in_period], holdings)
 
-    return portfolio_history
+    cashflow_columns = cashflows.cashflow_columns(trades)
+    rows = np.searchsorted(calendar, cashflow_columns['dates'], side='left')
+    in_range = cashflow_columns['valid'] & (rows < len(calendar))
+    net_cashflow = np.bincount(rows[in_range], weights=cashflow_columns['amounts'][in_range],
+                               minlength=len(calendar))
+
+    return pd.DataFrame({
+        'value': value,
+        'net_cashflow': net_cashflow,
+        'invested_capital': -np.cumsum(net_cashflow)
+    }, index=pd.Index(calendar, name='date'))
+
+def holdings_from_trades(trades, calendar, symbols):
+    """
+    Returns the len(calendar) x len(symbols) matrix of quantities held at the close of each day.
+    A trade on a non-trading day is counted on the next trading day, trades after the last day of
+    calendar are ignored.
+    """
+    columns = cashflows.cashflow_columns(trades)
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    symbol_columns = trades['symbol'].map(symbol_index).to_numpy(dtype=np.float64, na_value=np.nan)
+
+    unpriced = trades['symbol'][np.isnan(symbol_columns)].unique()
+    if len(unpriced):
+        logger.warning('No price history, these symbols are not valued: %s', ', '.join(map(str, unpriced)))
+
+    rows = np.searchsorted(calendar, columns['dates'], side='left')
+    keep = columns['valid'] & ~np.isnan(symbol_columns) & (rows < len(calendar))
+    holdings = np.zeros((len(calendar), len(symbols)))
+    np.add.at(holdings, (rows[keep], symbol_columns[keep].astype(np.int64)), columns['quantities'][keep])
+    return np.cumsum(holdings, axis=0, out=holdings)
+
+def holdings_from_snapshots(snapshots, calendar, symbols):
+    """
+    Same as holdings_from_trades, with the quantities taken from a Snapshots ledger
+    """
+    ledger_holdings = snapshots.holdings_matrix(calendar)
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    target = np.array([symbol_index.get(symbol, -1) for symbol in snapshots.ledger.symbol_table.symbols],
+                      dtype=np.int64)
+    if (target < 0).any():
+        unpriced = [symbol for symbol, column in zip(snapshots.ledger.symbol_table.symbols, target) if column < 0]
+        logger.warning('No price history, these symbols are not valued: %s', ', '.join(map(str, unpriced)))
+    holdings = np.zeros((len(calendar), len(symbols)))
+    holdings[:, target[target >= 0]] = ledger_holdings[:, target >= 0]
+    return holdings
 
 def get_pf_data(snapshots, stock_history_database, curr_date):
-    print('Creating portfolio snapshot for date:', curr_date)
-    ## get all rows where trade_date > last_snapshot_date but <= current_date , TODO:
-    ## for now constructing from start_date each time
+    """
+    Value of the portfolio on a single date, from the snapshot in force on that date
+    """
     snapshot_on_curr_date = snapshots.get_closest_previous_snapshot(curr_date)
-    curr_value = snapshot_to_current_value(snapshot_on_curr_date, stock_history_database)
+    curr_value = snapshot_to_current_value(snapshot_on_curr_date, stock_history_database, curr_date)
     return {
         'value': curr_value
     }
 
 def snapshot_to_current_value(snapshot, stock_history_database, curr_date):
-    ToDo
-    #totalValue = 0
-    #for symbol, quantity in snapshot:
-    #    totalValue += stock_history_database[symbol][curr_date].closePrice * quantity
\ No newline at end of file
+    holdings = snapshot.holdings()
+    if not holdings:
+        return 0.0
+    prices = stock_history_database.get_close_prices(list(holdings.keys()), [curr_date])[0]
+    return float(np.nansum(prices * np.fromiter(holdings.values(), dtype=np.float64)))
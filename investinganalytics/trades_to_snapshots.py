@@ -1,101 +1,270 @@
+import logging
+import numpy as np
 import pandas as pd
 import os
 from .zerodha import holdings_reader
+from . import cashflows
+
+logger = logging.getLogger(__name__)
+
+class SymbolTable:
+    """
+    Interns symbols to integer ids (0, 1, 2 ...) in the order they are first seen
+    """
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.ids = {}
+        for symbol in symbols:
+            self.intern(symbol)
+
+    def intern(self, symbol):
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.ids[symbol] = symbol_id
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def copy(self):
+        table = SymbolTable()
+        table.symbols = list(self.symbols)
+        table.ids = dict(self.ids)
+        return table
+
+class PositionLedger:
+    """
+    Compact history of the holdings of a portfolio.
+
+    Every trade date is stored as a delta: the symbol ids traded on that date and the net change
+    in their quantity. All deltas live in two flat arrays (delta_ids, delta_quantities), the deltas
+    of dates[i] being the slice delta_offsets[i]:delta_offsets[i + 1].
+    Every checkpoint_interval dates, the full quantities vector is kept as a checkpoint, so the
+    holdings on any date are rebuilt from the closest checkpoint plus at most checkpoint_interval
+    deltas. Memory is O(trades + dates / checkpoint_interval * symbols) instead of
+    O(dates * symbols).
+    The symbol table is shared with the snapshots of the ledger, the ledger's vectors keep the
+    n_symbols it had when the ledger was built (see Snapshot.update).
+    """
+    def __init__(self, symbol_table, dates, delta_offsets, delta_ids, delta_quantities, checkpoint_interval=64):
+        self.symbol_table = symbol_table
+        self.n_symbols = len(symbol_table)
+        self.dates = dates
+        self.delta_offsets = delta_offsets
+        self.delta_ids = delta_ids
+        self.delta_quantities = delta_quantities
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = self._build_checkpoints()
+
+    @classmethod
+    def from_trades(cls, trades, checkpoint_interval=64):
+        """
+        Builds the ledger from a trades dataframe in a single vectorized pass
+        """
+        columns = cashflows.cashflow_columns(trades)
+        valid = columns['valid']
+        codes, symbols = pd.factorize(trades['symbol'].to_numpy()[valid])
+        dates = columns['dates'][valid]
+        quantities = columns['quantities'][valid]
+
+        # net quantity traded per (date, symbol)
+        order = np.lexsort((codes, dates))
+        dates, codes, quantities = dates[order], codes[order], quantities[order]
+        new_entry = np.ones(len(dates), dtype=bool)
+        new_entry[1:] = (dates[1:] != dates[:-1]) | (codes[1:] != codes[:-1])
+        entry_starts = np.flatnonzero(new_entry)
+        delta_quantities = np.add.reduceat(quantities, entry_starts) if len(entry_starts) else quantities
+        delta_ids = codes[entry_starts].astype(np.int32)
+        entry_dates = dates[entry_starts]
+
+        new_date = np.ones(len(entry_dates), dtype=bool)
+        new_date[1:] = entry_dates[1:] != entry_dates[:-1]
+        delta_offsets = np.append(np.flatnonzero(new_date), len(entry_dates))
+
+        return cls(SymbolTable(symbols), entry_dates[new_date], delta_offsets,
+                   delta_ids, delta_quantities, checkpoint_interval)
+
+    def _build_checkpoints(self):
+        """
+        checkpoints[k] holds the quantities after the trades of dates[k * checkpoint_interval]
+        """
+        n_symbols = self.n_symbols
+        checkpoints = []
+        quantities = np.zeros(n_symbols)
+        applied = 0
+        for position in range(0, len(self.dates), self.checkpoint_interval):
+            end = self.delta_offsets[position + 1]
+            quantities = quantities + np.bincount(self.delta_ids[applied:end],
+                                                  weights=self.delta_quantities[applied:end],
+                                                  minlength=n_symbols)
+            applied = end
+            checkpoints.append(quantities)
+        return checkpoints
+
+    def quantities_at(self, position):
+        """
+        Returns the quantities vector (indexed by symbol id) after the trades of dates[position]
+        """
+        checkpoint = position // self.checkpoint_interval
+        start = self.delta_offsets[checkpoint * self.checkpoint_interval + 1]
+        end = self.delta_offsets[position + 1]
+        return self.checkpoints[checkpoint] + np.bincount(self.delta_ids[start:end],
+                                                          weights=self.delta_quantities[start:end],
+                                                          minlength=self.n_symbols)
+
+    def negative_symbols(self):
+        """
+        Returns the symbols whose quantity goes below 0 on some date
+        """
+        running = pd.Series(self.delta_quantities).groupby(self.delta_ids).cumsum().to_numpy()
+        negative_ids = np.unique(self.delta_ids[running < 0])
+        return [self.symbol_table.symbols[i] for i in negative_ids]
+
+    def snapshot_at(self, position):
+        return Snapshot(self.symbol_table, self.quantities_at(position))
 
 class Snapshots:
-    def __init__(self):
-        self.snapshots = {}
+    def __init__(self, ledger, cashflow_in, cashflow_out):
+        """
+        ledger: PositionLedger of the portfolio
+        cashflow_in / cashflow_out: arrays with the money spent on buys / received from sells
+                                    on each of the ledger's trade dates
+
+        Lookups go through the ledger's sorted datetime64[D] array of trade dates, so finding the
+        snapshot in force on any date is a binary search.
+        """
+        self.ledger = ledger
+        self.cashflow_in = cashflow_in
+        self.cashflow_out = cashflow_out
+
+    def get(self, some_date):
+        """
+        Returns the snapshot and cashflows of a trade date, raises KeyError for other dates
+        """
+        position = self.asof(some_date)
+        if position < 0 or self.ledger.dates[position] != np.datetime64(some_date, 'D'):
+            raise KeyError(some_date)
+        return {
+            'snapshot': self.ledger.snapshot_at(position),
+            'cashflow_in': self.cashflow_in[position],
+            'cashflow_out': self.cashflow_out[position]
+        }
+
+    def asof(self, dates):
+        """
+        Returns the position (in the ledger's trade dates) of the last trade date on or before each
+        of dates, -1 for dates before the first trade. dates can be a single date or an array of
+        dates, in which case all of them are resolved in one vectorized call.
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        return np.searchsorted(self.ledger.dates, dates, side='right') - 1
 
-    def add(self, some_date, value):
-        self.snapshots[some_date] = value
-    
     def get_closest_previous_snapshot(self, some_date):
-        # TODO: need to convert this to pandas dataframe to efficiently support this operation
-        return self.snapshots[some_date]['snapshot']
+        """
+        Returns the snapshot in force on some_date, i.e. the one of the last trade date on or before
+        it. Before the first trade the portfolio is empty.
+        """
+        position = self.asof(some_date)
+        if position < 0:
+            return Snapshot(self.ledger.symbol_table, np.zeros(self.ledger.n_symbols))
+        return self.ledger.snapshot_at(position)
+
+    def holdings_matrix(self, dates):
+        """
+        Returns the quantities held on each of dates (sorted ascending) as a
+        len(dates) x ledger.n_symbols matrix, columns being indexed by symbol id.
+        Every delta is added on the first requested date on or after its trade date, and a
+        cumulative sum down the dates carries the positions forward.
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        ledger = self.ledger
+        matrix = np.zeros((len(dates), ledger.n_symbols))
+        if len(dates) == 0:
+            return matrix
+        delta_dates = np.repeat(ledger.dates, np.diff(ledger.delta_offsets))
+        rows = np.searchsorted(dates, delta_dates, side='left')
+        in_range = rows < len(dates)
+        np.add.at(matrix, (rows[in_range], ledger.delta_ids[in_range]), ledger.delta_quantities[in_range])
+        return np.cumsum(matrix, axis=0, out=matrix)
 
 # need to distinguish Snapshot with  a holding, need to think of a good domain model
 class Snapshot:
-    def __init__(self):
-        self.df = pd.DataFrame(index=pd.Index([], name='symbol', dtype=str), columns=['quantity'])
-    
+    """
+    Holdings on a given date: a quantities vector indexed by the ids of a SymbolTable.
+    The table is shared with the ledger (and the other snapshots) until the snapshot adds a symbol
+    of its own, which is then added to a copy of it.
+    """
+    def __init__(self, symbol_table=None, quantities=None):
+        self.owns_table = symbol_table is None
+        self.symbol_table = symbol_table if symbol_table is not None else SymbolTable()
+        if quantities is None:
+            quantities = np.zeros(len(self.symbol_table))
+        self.quantities = quantities
+
     def update(self, symbol, quantity):
-        if symbol in self.df.index:
-            self.df.loc[symbol, 'quantity'] += quantity  # Direct DataFrame update
-        else:
-            self.df.loc[symbol, 'quantity'] = quantity
-    
-        if self.df.loc[symbol, 'quantity'] == 0:
-            self.remove(symbol)
-        elif self.df.loc[symbol, 'quantity'] < 0:
-            print('ERROR: quantity has become negative which is not possible')
+        if symbol not in self.symbol_table.ids and not self.owns_table:
+            self.symbol_table = self.symbol_table.copy()
+            self.owns_table = True
+        symbol_id = self.symbol_table.intern(symbol)
+        if symbol_id >= len(self.quantities):
+            self.quantities = np.pad(self.quantities, (0, len(self.symbol_table) - len(self.quantities)))
+        self.quantities[symbol_id] += quantity
+
+        if self.quantities[symbol_id] < 0:
+            logger.error('quantity of %s has become negative which is not possible', symbol)
 
     def remove(self, symbol):
-        self.df.drop(symbol, inplace=True)
-    
+        symbol_id = self.symbol_table.ids.get(symbol)
+        if symbol_id is not None and symbol_id < len(self.quantities):
+            self.quantities[symbol_id] = 0
+
     def copy(self):
-        # Create a new empty snapshot
-        new_snapshot = Snapshot()
-        new_snapshot.df = self.df.copy()
-        return new_snapshot
-    
+        # both share the table from now on
+        self.owns_table = False
+        return Snapshot(self.symbol_table, self.quantities.copy())
+
+    def holdings(self):
+        """
+        Returns a dictionary of symbol: quantity for the symbols currently held
+        """
+        held = np.flatnonzero(self.quantities)
+        return {self.symbol_table.symbols[i]: self.quantities[i] for i in held}
+
+    @property
+    def df(self):
+        held = self.holdings()
+        return pd.DataFrame({'quantity': list(held.values())},
+                            index=pd.Index(list(held.keys()), name='symbol', dtype=str))
+
     def print(self):
         print('------  snapshot is ---------')
-        pd.options.display.max_rows = None
-        print(self.df.sort_index())
-            
-    def get_or_create_row(self, symbol):
-        print('here')
-        if symbol in self.df.index:
-            return self.df.loc[symbol]  # Return existing row
-        else:
-            new_row = pd.Series({'quantity': 0}, name=symbol)
-            self.df.loc[symbol] = new_row
-            return self.df.loc[symbol] # Return the newly created row
+        with pd.option_context('display.max_rows', None):
+            print(self.df.sort_index())
 
 def convert(trades):
     """
-    Format of Snapshot data
+    Converts trades to Snapshots: the holdings and the cashflows of the portfolio on every trade date
     """
-    snapshots = Snapshots()
-    start_date = trades['trade_date'].min()
-    print('The portfolio started on date: ', start_date)
-
-    # Sort the trades, as we will apply the trades over a previous snapshot (to avoid complete recalcultion)
-    trades = trades.sort_values('trade_date')
-    previous_snapshot = Snapshot()
-
-    # Iterate through the groups (which will be in sorted date order)
-    for trade_date, day_trades in trades.groupby('trade_date'):
-        print(f"For Trade Date: {trade_date}")
-        print(day_trades)
-        current_snapshot = apply_trades(previous_snapshot.copy(), day_trades)
-        current_snapshot.print()
-        previous_snapshot = current_snapshot
-        snapshots.add(trade_date, {
-            'snapshot': current_snapshot,
-            'cashflow_in': cashflows_in(trades),
-            'cashflow_out': cashflows_out(trades)
-        })
-    
-    return snapshots
-
-def apply_trades(snapshot, trades):
-    for index, trade in trades.iterrows():
-        apply_trade(snapshot, trade)
-    
-    return snapshot
-
-def apply_trade(snapshot, trade):
-    symbol = trade['symbol']
-    print('@prak - for symbol - ', symbol)
-    if trade['trade_type'] == 'buy':
-        snapshot.update(symbol, trade['quantity'])
-    elif trade['trade_type'] == 'sell':
-        quantity = trade['quantity'] * -1
-        snapshot.update(symbol, quantity)
-    else:
-        print('WARN: trade_type found except buy or sell')
-        
+    start_date = pd.Timestamp(trades['trade_date'].min()).date()
+    logger.info('The portfolio started on date: %s', start_date)
+
+    ledger = PositionLedger.from_trades(trades)
+
+    # money spent (cashflow_in) and received (cashflow_out) on each trade date
+    columns = cashflows.cashflow_columns(trades)
+    positions = np.searchsorted(ledger.dates, columns['dates'])
+    amounts = columns['amounts']
+    n_dates = len(ledger.dates)
+    cashflow_in = np.bincount(positions, weights=np.where(columns['is_buy'], -amounts, 0.0), minlength=n_dates)
+    cashflow_out = np.bincount(positions, weights=np.where(columns['is_sell'], amounts, 0.0), minlength=n_dates)
+
+    for symbol in ledger.negative_symbols():
+        logger.error('quantity of %s has become negative which is not possible', symbol)
+
+    return Snapshots(ledger, cashflow_in[:n_dates], cashflow_out[:n_dates])
+
 def cashflows_in(trades):
     buy_trades = trades[trades['trade_type'] == 'buy']
     if not buy_trades.empty:
@@ -109,8 +278,8 @@ def cashflows_out(trades):
         return (sell_trades['quantity'] * sell_trades['price']).sum()
     else:
         return 0.0
-    
+
 if __name__ == "__main__":  # This ensures the code only runs when the script is executed directly
-    holdings = "holdings.csv"  
+    holdings = "holdings.csv"
     holdings = holdings_reader.getHoldingsAsSellTrades(os.path.join('prakash', 'holdings.csv'))
-    print(convert(holdings))
\ No newline at end of file
+    print(convert(holdings))
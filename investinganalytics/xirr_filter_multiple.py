@@ -1,9 +1,15 @@
+import logging
+import numpy as np
 import pandas as pd
 from pyxirr import xirr
 from datetime import datetime
-from tabulate import tabulate
-import sys
-from . import trades_to_snapshots
+from . import cashflows
+from . import ingestion_cache
+from . import instrumentation
+from . import corporate_actions
+from . import reporting
+from . import startup
+from .symbols import normalize_symbols
 from .zerodha import tradebooks_reader
 from .zerodha import holdings_reader
 import os
@@ -26,36 +32,28 @@ TODOS: 1. In a future version of this program, we would be able to fetch price f
 holdings.csv
 2. holdings.csv should not need quantity which can be calculated from tradebook. However it is useful to detect
 discrepancies due to things like buybacks, gifting of shares, symbol changes, rights etc
+
+The calculations are also available as a library: analyze(folder_name) returns a
+reporting.PortfolioReport, which can be printed or written as JSON / CSV / Parquet.
+Modules only some modes need (lot matching, as-of series, batched solver) are imported when used.
 """
-def trades_to_cashflows(trades):
-    cashflows = []
-    count_buys = 0
-    count_buys_plus_sells = 0
-    for index, trade in trades.iterrows():
-        count_buys_plus_sells += 1
-        # Consider only buy (negative) and sell (positive) transactions
-        if not trade['trade_type'].lower() in ['buy', 'sell']:
-            print('WARN: Skipping row found with trade_type != buy / sell')
-            continue
-        
-        # Adjust cashflow for quantity and price
-        cashflow = trade['quantity'] * trade['price']
-        if trade['trade_type'].lower() == 'buy':
-            count_buys += 1;
-            cashflow = cashflow * -1
 
-        cashflows.append((trade['trade_date'], cashflow))
-        # Check for at least one sell transaction
+logger = logging.getLogger(__name__)
 
-    if len(trades.index) != len(cashflows):
-        print('DEBUG: Mismatch in entries in trades and cashflows')
+def trades_to_cashflows(trades):
+    """
+    Converts trades to cashflows using the columnar cashflow engine.
+
+    Returns a dictionary with:
+    dates: datetime64[D] NumPy array
+    amounts: float64 NumPy array (buys negative, sells positive)
+    has_one_buy, has_one_sell: whether the trades contain at least one buy / sell
 
-    return {
-        'cashflows': cashflows,
-        'has_one_buy': count_buys > 0,
-        'has_one_sell': (count_buys_plus_sells - count_buys) > 0
-    }
+    dates and amounts can be passed directly to pyxirr as xirr(dates, amounts)
+    """
+    return cashflows.trades_to_cashflow_arrays(trades)
 
+@instrumentation.timed('portfolio_xirr')
 def calculate_xirr(trades, presentValue = None):
     """
     This program calculates XIRR.
@@ -68,174 +66,410 @@ def calculate_xirr(trades, presentValue = None):
         A dictionary containing XIRR for the stock or portfolio and a list of symbols with negative cashflows.
     """
     if not trades['trade_type'].str.contains('sell').any():
-        print('WARN: No SELL trades found')
+        logger.warning('No SELL trades found')
         return {'xirr': None}
 
-    cashflows = trades_to_cashflows(trades)['cashflows']
+    res = trades_to_cashflows(trades)
+    dates = res['dates']
+    amounts = res['amounts']
 
     if presentValue:
-        cashflows.append((datetime.now().strftime("%Y-%m-%d"), presentValue))
-    xirr_results = xirr(cashflows)
+        dates = np.append(dates, np.datetime64(datetime.now().date(), 'D'))
+        amounts = np.append(amounts, presentValue)
+    xirr_results = xirr(dates, amounts)
 
     return {'xirr': xirr_results}
 
-def validate_quantity(symbol, symbol_trades):
-    #print(group_data)
-    buy_quantity = 0
-    sell_quantity = 0
-    for index, trade in symbol_trades.iterrows():
-        if trade['trade_type'].lower() == "buy":
-            buy_quantity = buy_quantity + trade['quantity']
-        else:
-            sell_quantity = sell_quantity + trade['quantity']
+def calculate_xirr_series(trades, stock_history_database, asof_dates=None):
+    """
+    XIRR of the portfolio and of each stock as of every one of asof_dates (default: every month-end
+    of the last 10 years), valuing the holdings of each date at that date's close.
+
+    Args:
+        trades: A pandas DataFrame containing trade data (without holdings converted to sells).
+        stock_history_database: yfin_helper.StocksHistory of the stocks traded.
+
+    Returns:
+        A pandas DataFrame indexed by date, with a 'portfolio' column and one column per stock.
+    """
+    from . import xirr_series
+    return xirr_series.asof_xirr_series(trades, stock_history_database, asof_dates)
+
+def validate_quantity(symbol, symbol_summary):
+    """
+    Reports (at INFO level) if the quantity bought for a symbol does not match the quantity sold.
+    symbol_summary is a row of cashflows.summarize_by_symbol
+    Returns True if the quantities match.
+    """
+    buy_quantity = symbol_summary['buy_quantity']
+    sell_quantity = symbol_summary['sell_quantity']
     if buy_quantity != sell_quantity:
-        print(f"For symbol: {symbol}, buy quantity ({buy_quantity}) !=  sell quantity ({sell_quantity})")
+        logger.info('For symbol: %s, buy quantity (%g) !=  sell quantity (%g)', symbol, buy_quantity, sell_quantity)
+        return False
+    return True
 
 
-def calculate_xirr_stock(trades, mode, target_stock):
+@instrumentation.timed('calculate_xirr_stock')
+def calculate_xirr_stock(trades, mode, target_stock, batched=False, memo=None):
     """
     Calculates XIRR for a single stock or the entire portfolio.
 
     Args:
         data: A pandas DataFrame containing trade data.
+        target_stock: in trade_history mode, the symbol (or list of symbols) to report
+        batched: if True (and not in trade_history mode), the XIRR of all symbols is solved together
+                 by xirr_solver instead of calling pyxirr once per symbol. The rates agree with
+                 pyxirr's to within 1e-9 (its own tolerance) rather than bit for bit, the symbols
+                 without XIRR and the no buys / no sells lists are the same.
+        memo: an xirr_memo.XirrMemo, the XIRR of the symbols whose cashflows did not change since
+              it was last saved is taken from it (and the others are solved in a batch, as with
+              batched)
 
     Returns:
         A dictionary containing XIRR for the stock or portfolio and a list of symbols with negative cashflows.
+        In trade_history mode, trade_history is { symbol : its trades sorted by date } for the
+        symbols reported (empty in the other modes).
     """
     symbols_with_no_buys = []
     symbols_with_no_sells = []
+    trade_history = {}
 
     if trades['trade_type'].str.contains("sell").any():
-        # Group data by symbol and calculate XIRR for each
-        grouped_trades = trades.groupby('symbol')
+        # Signed cashflows and per-symbol aggregates are computed once for all the trades
+        columns = cashflows.cashflow_columns(trades)
+        with instrumentation.stage('summarize_by_symbol'):
+            summary = cashflows.summarize_by_symbol(trades, columns)
+        instrumentation.count('symbols', len(summary))
+        dates = columns['dates']
+        amounts = columns['amounts']
+        valid = columns['valid']
+        # row positions of each symbol in the cashflow arrays
+        symbol_rows = trades.groupby('symbol', sort=True).indices
+
+        batched_rates = None
+        if (batched or memo is not None) and mode != 'trade_history':
+            batched_rates = batched_symbol_xirr(trades, columns, summary, memo)
+
         xirr_results = {}
-        for symbol, symbol_trades in grouped_trades:
+        mismatched = 0
+        if mode == 'trade_history':
+            targets = [target_stock] if isinstance(target_stock, str) else list(target_stock)
+            missing = [symbol for symbol in targets if symbol not in summary.index]
+            if missing:
+                logger.warning('No trades found for: %s', ', '.join(missing))
+            summary = summary[summary.index.isin(targets)]
+        for position, (symbol, symbol_summary) in enumerate(zip(summary.index, summary.to_dict('records'))):
             if mode == 'trade_history':
-                if target_stock == symbol:
-                    print("Calculating for :" + symbol)
-                    print(symbol_trades.sort_values(by='trade_date', ascending=True))
-                else:
-                    continue
-
-            res = trades_to_cashflows(symbol_trades)
-            symbol_cashflows = res['cashflows']
-            
-            profit = 0
-            total_acquisitions = 0
-            for cashflow in symbol_cashflows:
-                profit += cashflow[1]
-                if cashflow[1] < 0:
-                    total_acquisitions = total_acquisitions + cashflow[1]
-
-            validate_quantity(symbol, symbol_trades)
+                trade_history[symbol] = trades.iloc[symbol_rows[symbol]].sort_values(by='trade_date', ascending=True)
+
+            profit = symbol_summary['profit']
+            total_acquisitions = symbol_summary['total_acquisitions']
+
+            mismatched += not validate_quantity(symbol, symbol_summary)
             xirr_val = None
-            if not res['has_one_buy']:
+            if symbol_summary['count_buys'] == 0:
                 symbols_with_no_buys.append(symbol)
-            elif not res['has_one_sell']:
+            elif symbol_summary['count_sells'] == 0:
                 symbols_with_no_sells.append(symbol)
+            elif batched_rates is not None:
+                rate = batched_rates[position]
+                xirr_val = None if np.isnan(rate) else float(rate)
             else:
-                xirr_val = xirr(symbol_cashflows)
+                rows = symbol_rows[symbol]
+                rows = rows[valid[rows]]
+                # same (symbol, date) order as the batched solver, so both give identical results
+                rows = rows[np.argsort(dates[rows], kind='stable')]
+                xirr_val = xirr(dates[rows], amounts[rows])
 
             percent_return = 0
             if total_acquisitions != 0:
                 percent_return = round((profit / (-1 * total_acquisitions)) * 100, 2)
             xirr_results[symbol] = {'xirr': xirr_val, 'profit': profit, 'return_made': percent_return}
+        if mismatched:
+            logger.warning('%d symbol(s) with buy quantity != sell quantity', mismatched)
     else:
-        print('ERROR: There are 0 sell trades in the data')
+        logger.error('There are 0 sell trades in the data')
         # No buy transactions, so no negative cashflows
         xirr_results = None
-    return {'xirr': xirr_results, 'symbols_with_no_sells': symbols_with_no_sells, 'symbols_with_no_buys':symbols_with_no_buys}
+    return {'xirr': xirr_results, 'symbols_with_no_sells': symbols_with_no_sells, 'symbols_with_no_buys':symbols_with_no_buys,
+            'trade_history': trade_history}
 
-# Apply function to trim strings
-def trim_hyphen_suffix(text):
-    return text.split('-')[0]  # Split on hyphen and return the first part (AEL)
+def stocks_frame(xirr_results):
+    """
+    Returns the per stock results of calculate_xirr_stock as a DataFrame indexed by symbol,
+    with the columns xirr (NaN where not calculated), profit, return_made
+    """
+    stocks = pd.DataFrame.from_dict(xirr_results or {}, orient='index',
+                                    columns=['xirr', 'profit', 'return_made'])
+    stocks['xirr'] = pd.to_numeric(stocks['xirr'], errors='coerce')
+    stocks.index.name = 'symbol'
+    return stocks
+
+def batched_symbol_xirr(trades, columns, summary, memo=None):
+    """
+    Solves the XIRR of every symbol having at least one buy and one sell in a single batch.
+    Returns an array aligned with the rows of summary (NaN where XIRR is not calculated)
+    memo: if given (an xirr_memo.XirrMemo), only the symbols whose cashflows are not in it are solved
+    """
+    codes, symbols = pd.factorize(trades['symbol'], sort=True)
+    solvable = ((summary['count_buys'] > 0) & (summary['count_sells'] > 0)).to_numpy()
+    rows = columns['valid'] & solvable[codes]
+    if memo is not None:
+        from . import xirr_memo
+        return xirr_memo.xirr_by_group(memo, codes[rows], columns['dates'][rows], columns['amounts'][rows],
+                                       [str(symbol) for symbol in symbols])
+    from . import xirr_solver
+    return xirr_solver.xirr_by_group(codes[rows], columns['dates'][rows], columns['amounts'][rows], len(symbols))
 
 def process_corporate_actions(filename):
-    corporate_actions_data = readFromFileSystem(filename)
-    print(corporate_actions_data)
+    corporate_actions_data = corporate_actions.read_corporate_actions(filename)
+    logger.debug('Corporate actions:\n%s', corporate_actions_data)
     return corporate_actions_data
 
 def readFromFileSystem(filename):
-    print('Reading file: ' + filename)
+    logger.info('Reading file: %s', filename)
     return pd.read_csv(filename)
 
 #TODO
 def print2Precision(num):
     return 1
 
-def my_main(folder_name, mode, target_stock):
-    verbose = True
-    print("INFO: Tradebook directory specified as: ", folder_name)
-    print("INFO: Operating in mode: ", mode)
+def resolve_symbols(names):
+    """
+    Returns the symbols names refer to, as they are in the normalized trades: upper case, without
+    series suffix and with old names of renamed companies replaced (see symbols.normalize_symbols)
+    """
+    names = pd.Series([str(name).strip().upper() for name in names], dtype=object)
+    return list(dict.fromkeys(normalize_symbols(names)))
+
+@instrumentation.timed('load_portfolio')
+def load_portfolio(folder_name, verbose=False, cache_dir=ingestion_cache.DEFAULT_CACHE_DIR, symbols=None):
+    """
+    Reads the tradebooks and holdings of a portfolio folder, with the corporate actions applied.
+    Returns (tradebooks, holdings, trades), trades being the tradebooks followed by the holdings
+    converted to sells.
+    symbols: if given (see resolve_symbols), only the trades and holdings of these symbols. With the
+             tradebooks cached, only their rows of the ledger are read (see ledger_store).
+    """
     tradebook_file_pattern = "tradebook-*.csv"
     holdings_file = 'holdings.csv'
     corporate_actions_file = 'resources/corporate-actions.csv'
 
     # Read data from all CSV files
-    tradebooks = tradebooks_reader.getTrades(folder_name, tradebook_file_pattern, verbose)
-    holdings = holdings_reader.getHoldingsAsSellTrades(os.path.join(folder_name, holdings_file), verbose)
     corporateActionsData = process_corporate_actions(corporate_actions_file)
+    # trades converted into the symbols by corporate actions are read too
+    sources = None if symbols is None else corporate_actions.source_symbols(corporateActionsData, symbols)
+    tradebooks = tradebooks_reader.getTrades(folder_name, tradebook_file_pattern, verbose, cache_dir=cache_dir,
+                                             selected_symbols=sources)
+    holdings = holdings_reader.getHoldingsAsSellTrades(os.path.join(folder_name, holdings_file), verbose)
 
-    #print(trades_to_snapshots.convert(holdings))
-    #return
-
-    # Calculate XIRR
-    #currentValueOfPortfolio = 8071742
-    #pfResults_withPresentValue = calculate_xirr(tradebookData.copy(), currentValueOfPortfolio)
-    #print(f"Portfolio XIRR (on basis of present value): {pfResults_withPresentValue['xirr']:.2%}")
+    # splits, bonuses and mergers, so that old trades are in the terms of the current holdings
+    tradebooks = corporate_actions.apply_corporate_actions(tradebooks, corporateActionsData)
+    if symbols is not None:
+        tradebooks = tradebooks[tradebooks['symbol'].isin(symbols)]
+        holdings = holdings[holdings['symbol'].isin(symbols)]
 
-    ## merge holdings data with trade data
-    trades = pd.concat([tradebooks, holdings])
+    ## merge holdings data with trade data, in one copy keeping the symbols categorical
+    trades = tradebooks_reader.concat_trades([tradebooks, holdings])
     if len(tradebooks) + len(holdings) != len(trades):
-        print("ERROR: merging of holdings data with tradebook data resulted in mismatch of rows")
-
-    # Download information about all portfolio stocks from yahoo finance APIs
-    all_unique_symbols = trades['symbol'].unique()
-    #stock_history_database = getStocksHistory(all_unique_symbols)
-    
-    #createSnapshots(merged_data, stock_history_database)
-
-    stock_wise_results = calculate_xirr_stock(trades.copy(), mode, target_stock)
+        logger.error('merging of holdings data with tradebook data resulted in mismatch of rows')
+    return tradebooks, holdings, trades
 
-    if (mode == 'xirr'):
-        pfResults = calculate_xirr(trades.copy())
-        print(f"Portfolio XIRR: {pfResults['xirr']:.2%}")
+def add_dividends(tradebooks, trades, stock_history_database):
+    """
+    Returns trades followed by the dividends received on the holdings of tradebooks (see
+    dividends.dividend_trades), which then count in the portfolio and stock-wise XIRR.
+    stock_history_database: { symbol : history dataframe } or yfin_helper.StocksHistory, whose
+                            Dividends columns give the dividends
+    """
+    from . import dividends
+    received = dividends.dividend_trades(tradebooks, dividends.dividend_table(stock_history_database))
+    logger.info('Dividends received on %d ex-date(s): %.2f', len(received),
+                float((received['quantity'] * received['price']).sum()))
+    if len(received) == 0:
+        return trades
+    return tradebooks_reader.concat_trades([trades, received])
+
+def stale_histories(stock_history_database, tradebooks, holdings):
+    """
+    Returns the symbols whose history ends before the last day they were held (the date of the
+    holdings for the symbols still held, else their last trade) with trading days in between:
+    the dividends of these days are missing from it.
+    stock_history_database: { symbol : history dataframe }
+    """
+    held = pd.DataFrame({
+        'symbol': np.concatenate([tradebooks['symbol'].to_numpy(dtype=object),
+                                  holdings['symbol'].to_numpy(dtype=object)]),
+        'date': np.concatenate([cashflows.to_datetime64(tradebooks['trade_date']),
+                                cashflows.to_datetime64(holdings['trade_date'])])
+    })
+    held_until = held.groupby('symbol', sort=False)['date'].max()
+    symbols = [symbol for symbol in stock_history_database if symbol in held_until.index]
+    if not symbols:
+        return []
+    last_bars = cashflows.to_datetime64([max(stock_history_database[symbol].index) for symbol in symbols])
+    held_until = held_until.loc[symbols].to_numpy().astype('datetime64[D]')
+    missing_days = np.busday_count(last_bars + 1, held_until + 1)
+    return [symbol for symbol, days in zip(symbols, missing_days) if days > 0]
+
+def cached_price_history(tradebooks, holdings):
+    """
+    Returns the price history (with the dividends) of the symbols of tradebooks, from the price
+    cache: only the symbols not cached yet, and those whose cached history ends before the last day
+    they were held (see stale_histories), are downloaded. When that fails (e.g. offline) the cached
+    history is used as it is, with a warning, the dividends after it are then not counted.
+    """
+    from .yfinutils import yfin_helper
+    symbols = [str(symbol) for symbol in tradebooks['symbol'].unique()]
+    history = yfin_helper.fetch_stocks_history(symbols, refresh=False, workers=8)
+    stale = stale_histories(history.stock_history_database, tradebooks, holdings)
+    if stale:
+        logger.info('Updating the price history of %d symbol(s) held after their last cached day', len(stale))
+        refreshed = yfin_helper.fetch_stocks_history(stale, refresh=True, workers=8)
+        history.stock_history_database.update(refreshed.stock_history_database)
+        stale = stale_histories({symbol: history.stock_history_database[symbol] for symbol in stale},
+                                tradebooks, holdings)
+        if stale:
+            logger.warning('The price history of %d symbol(s) ends before the last day they were held, their '
+                           'later prices and dividends are not used: %s', len(stale), ', '.join(stale))
+    return history
+
+def compare_with_benchmarks(trades, holdings, benchmarks=None, stock_history_database=None,
+                            price_cache_dir=None):
+    """
+    Compares the XIRR of the portfolio and of every stock with the same cashflows invested in market
+    indices, see benchmark_comparison.compare for trades, holdings and stock_history_database.
+    benchmarks: names of the indices (see price_store.INDEX_TICKERS) or of histories saved in the
+                price cache, default benchmark_comparison.DEFAULT_BENCHMARKS
+    Returns a reporting.BenchmarkReport
+    """
+    from . import benchmark_comparison
+    from .yfinutils import price_store
+    store = price_store.PriceStore() if price_cache_dir is None else price_store.PriceStore(price_cache_dir)
+    histories = {}
+    for name in benchmarks or benchmark_comparison.DEFAULT_BENCHMARKS:
+        history = store.get_index_history(name)
+        if history is None:
+            logger.error('No price history for the benchmark %s, it is skipped', name)
+            continue
+        histories[name] = history
+    if not histories:
+        raise ValueError('No price history found for any of the benchmarks')
+    comparison = benchmark_comparison.compare(trades, holdings, histories, stock_history_database)
+    return reporting.BenchmarkReport(comparison['benchmarks'], comparison['stocks'], comparison['nav'])
+
+@instrumentation.timed('lot_matching')
+def lot_pnl(tradebooks, holdings):
+    """
+    Returns (realized P&L of the tradebooks' FIFO lots per symbol and holding period, unrealized P&L
+    of what is still held valued at the holdings' last traded price). Either is None when there is
+    nothing to report.
+    """
+    from . import lots
+    current_prices = holdings.groupby('symbol')['price'].last()
+    lot_results = lots.match_lots(tradebooks, current_prices=current_prices)
+    realized = None if lot_results['lots'].empty else lots.summarize_lots(lot_results['lots'])
+    open_lots = lot_results['open_lots']
+    unrealized_pnl = None
+    if 'unrealized_pnl' in open_lots and not open_lots.empty:
+        unrealized_pnl = float(open_lots['unrealized_pnl'].sum())
+    return realized, unrealized_pnl
+
+def portfolio_report(tradebooks, holdings, trades, with_lots=True, memo=None):
+    """
+    Computes the XIRR of the portfolio and of every stock (plus, with_lots, the realized and
+    unrealized P&L) of a portfolio read by load_portfolio.
+    memo: an xirr_memo.XirrMemo for the stock-wise XIRR (see calculate_xirr_stock)
+    Returns a reporting.PortfolioReport
+    """
+    stock_wise_results = calculate_xirr_stock(trades, 'xirr', None, memo=memo)
+    portfolio_xirr = calculate_xirr(trades)['xirr'] if stock_wise_results['xirr'] is not None else None
+    realized, unrealized_pnl = lot_pnl(tradebooks, holdings) if with_lots else (None, None)
+    return reporting.PortfolioReport(portfolio_xirr, stocks_frame(stock_wise_results['xirr']),
+                                     stock_wise_results['symbols_with_no_sells'],
+                                     stock_wise_results['symbols_with_no_buys'],
+                                     realized, unrealized_pnl)
+
+def analyze(folder_name, with_lots=True, cache_dir=ingestion_cache.DEFAULT_CACHE_DIR, memo=None,
+            dividend_history=None):
+    """
+    Library entry point: reads the portfolio in folder_name (see load_portfolio) and returns its
+    reporting.PortfolioReport. Nothing is printed, progress and data problems are logged.
+    memo: an xirr_memo.XirrMemo reused across calls (it is not saved here, see XirrMemo.save)
+    dividend_history: if given, the price histories whose dividends are added to the cashflows
+                      (see add_dividends)
+    """
+    tradebooks, holdings, trades = load_portfolio(folder_name, verbose=True, cache_dir=cache_dir)
+    if dividend_history is not None:
+        trades = add_dividends(tradebooks, trades, dividend_history)
+    return portfolio_report(tradebooks, holdings, trades, with_lots, memo)
 
-        if stock_wise_results['xirr'] is None:
+def my_main(folder_name, mode, target_stock, output=None, report_format=None, quiet=False, dividends=False,
+            xirr_cache=False):
+    """
+    target_stock: in trade_history mode, the symbol or list of symbols (old names and series
+                  suffixes are accepted, see resolve_symbols). In benchmark mode, the list of
+                  benchmarks (see compare_with_benchmarks)
+    output: if given, the report is also written there (see reporting.write_report)
+    quiet: only print the portfolio XIRR (and the benchmarks'), no per stock tables
+    dividends: also count the dividends received, from the price history (see add_dividends)
+    xirr_cache: take the stock-wise XIRR of the stocks whose cashflows did not change from the
+                XIRR memo (see xirr_memo), and save it
+    """
+    logger.info('Tradebook directory specified as: %s', folder_name)
+    logger.info('Operating in mode: %s', mode)
+
+    symbols = None
+    if mode == 'trade_history':
+        # only the rows of the symbols asked for are read
+        symbols = resolve_symbols([target_stock] if isinstance(target_stock, str) else target_stock)
+        target_stock = symbols
+    tradebooks, holdings, trades = load_portfolio(folder_name, verbose=True, symbols=symbols)
+    startup.mark(startup.PORTFOLIO_LOADED)
+    price_history = cached_price_history(tradebooks, holdings) if dividends or mode == 'benchmark' else None
+    if dividends and mode != 'benchmark':
+        trades = add_dividends(tradebooks, trades, price_history)
+
+    if mode == 'xirr':
+        memo = None
+        if xirr_cache:
+            from . import xirr_memo
+            memo = xirr_memo.XirrMemo()
+        with instrumentation.stage('calculations'):
+            report = portfolio_report(tradebooks, holdings, trades, memo=memo)
+        if memo is not None:
+            memo.save()
+        if report.portfolio_xirr is None:
             # This should not be possible as we consider present value of holdings as sell txn
             print("No sell transactions found in any of the CSV files.")
-            sys.exit(0)
-
-    # Print XIRR for each stock (if available)
-    print("XIRR for individual stocks:")
-    df = pd.DataFrame(stock_wise_results['xirr'])
-    # transposed index (key as first column)
-    df = df.T
-    # Set options to display all rows and columns without truncation
-    pd.set_option('display.max_rows', None)
-
-    # Print the DataFrame with
-    print(df)
-
-    if df.size > 10:
-        # Sort the DataFrame by 'Age' in ascending order (optional, specify descending order with ascending=False)
-        sorted_df = df.sort_values(by='profit')
-        print('\n----- Top 10 Absolute Profit trades -----\n')
-        print(sorted_df.tail(10))
-        print('\n----- Top 10 Absolute Loss trades -----\n')
-        print(sorted_df.head(10))
-
-        sorted_df = df.sort_values(by='return_made')
-        print('\n--- Top 10 % returns trades -----\n')
-        print(sorted_df.tail(10))
-        print('\n----- Top 10 % loss trades -----\n')
-        print(sorted_df.head(10))
-
-    # Print list of symbols with negative cashflows (if any)
-    if stock_wise_results['symbols_with_no_sells']:
-        print("\nsymbols_with_no_sells (XIRR not calculated):")
-        print(", ".join(stock_wise_results['symbols_with_no_sells']))
-
-    if stock_wise_results['symbols_with_no_buys']:
-        print("\nsymbols_with_no_buys (XIRR not calculated):")
-        print(", ".join(stock_wise_results['symbols_with_no_buys']))
\ No newline at end of file
+            return
+    elif mode == 'benchmark':
+        # the tradebooks' cashflows (and dividends) are replayed, the holdings are the final value
+        replayed = add_dividends(tradebooks, tradebooks, price_history) if dividends else tradebooks
+        try:
+            report = compare_with_benchmarks(replayed, holdings, target_stock, price_history)
+        except ValueError as e:
+            print(f'FATAL: {e}')
+            return
+    else:
+        stock_wise_results = calculate_xirr_stock(trades, mode, target_stock)
+        if not quiet:
+            for symbol, symbol_trades in stock_wise_results['trade_history'].items():
+                print("Calculating for :" + symbol)
+                print(symbol_trades)
+        report = reporting.PortfolioReport(None, stocks_frame(stock_wise_results['xirr']),
+                                           stock_wise_results['symbols_with_no_sells'],
+                                           stock_wise_results['symbols_with_no_buys'])
+
+    if output:
+        with instrumentation.stage('write_report'):
+            reporting.write_report(report, output, report_format)
+        logger.info('Report written to %s', output)
+    if quiet:
+        if mode == 'benchmark':
+            report.print(with_tables=False)
+        elif report.portfolio_xirr is not None:
+            print(f"Portfolio XIRR: {report.portfolio_xirr:.2%}")
+    else:
+        report.print()
+    startup.mark('report done')
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+import numpy as np
+from . import instrumentation
+from . import xirr_solver
+
+"""
+Persistent memo of per-symbol XIRR.
+
+The XIRR of a symbol only depends on its cashflows, and from one run to the next most symbols'
+cashflows do not change: usually only the symbols in holdings.csv do, as their final "sell at LTP"
+cashflow moves with the price and the day. Every stream of cashflows (a symbol's dates and amounts,
+sorted by date) is fingerprinted with a hash of its arrays, and its XIRR is kept in the memo under
+that key. On a re-run only the symbols whose fingerprint is not in the memo are solved, in one
+batch, each one starting from the last rate found for the same symbol (a warm start, which does
+not change the root found, see xirr_solver.batched_xirr's guess_is_hint).
+
+The memo is a JSON file, bounded to max_entries fingerprints: the least recently used ones are
+evicted when it is saved. It is only written when rates were added, a run which only read from it
+leaves the file (and the order of use recorded in it) as it was. Profit and return_made are not memoized, they are sums computed for all
+symbols at once (see cashflows.summarize_by_symbol).
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMO_FILE = os.path.join('cache', 'xirr', 'memo.json')
+DEFAULT_MAX_ENTRIES = 20_000
+MEMO_VERSION = 1
+
+def stream_keys(dates, amounts, offsets):
+    """
+    Fingerprints of the streams of cashflows dates[offsets[i]:offsets[i + 1]] (datetime64[D]) and
+    amounts (float64), each stream being in date order
+    """
+    # every stream is hashed from slices of two flat buffers, without an array per stream
+    date_bytes = memoryview(np.ascontiguousarray(dates, dtype='datetime64[D]').view(np.int64)).cast('B')
+    amount_bytes = memoryview(np.ascontiguousarray(amounts, dtype=np.float64)).cast('B')
+    offsets = (np.asarray(offsets, dtype=np.int64) * 8).tolist()
+    keys = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        digest = hashlib.blake2b(date_bytes[start:end], digest_size=16)
+        digest.update(amount_bytes[start:end])
+        keys.append(digest.hexdigest())
+    return keys
+
+def stream_key(dates, amounts):
+    """
+    Fingerprint of a stream of cashflows: dates (datetime64[D]) and amounts (float64), in date order
+    """
+    return stream_keys(dates, amounts, [0, len(dates)])[0]
+
+class XirrMemo:
+    def __init__(self, filename=DEFAULT_MEMO_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        filename: JSON file the memo is read from and saved to, None to keep it in memory only
+        max_entries: number of fingerprints kept, the least recently used are evicted on save()
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.rates = OrderedDict()
+        self.guesses = OrderedDict()
+        self.changed = False
+        if filename is not None:
+            self._read()
+
+    def _read(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get('version') != MEMO_VERSION:
+            return
+        # stored least recently used first
+        self.rates = OrderedDict((key, np.nan if rate is None else rate) for key, rate in data['rates'])
+        self.guesses = OrderedDict((symbol, rate) for symbol, rate in data['guesses'])
+
+    def __len__(self):
+        return len(self.rates)
+
+    def get(self, key):
+        """
+        Returns the memoized rate of key (NaN if XIRR could not be calculated), None if it is unknown
+        """
+        rate = self.rates.get(key)
+        if rate is not None:
+            # the order of use alone does not make the memo worth writing again
+            self.rates.move_to_end(key)
+        return rate
+
+    def put(self, key, rate, symbol=None):
+        self.rates[key] = float(rate)
+        self.rates.move_to_end(key)
+        if symbol is not None and np.isfinite(rate):
+            self.guesses[symbol] = float(rate)
+            self.guesses.move_to_end(symbol)
+        self.changed = True
+
+    def guess(self, symbol):
+        """
+        Returns the last rate found for symbol, NaN if there is none
+        """
+        return self.guesses.get(symbol, np.nan)
+
+    def save(self):
+        """
+        Evicts the least recently used entries beyond max_entries and writes the memo, if rates
+        were added since it was read
+        """
+        for table in (self.rates, self.guesses):
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+        if self.filename is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        data = {
+            'version': MEMO_VERSION,
+            'rates': [[key, None if np.isnan(rate) else rate] for key, rate in self.rates.items()],
+            'guesses': [[symbol, rate] for symbol, rate in self.guesses.items()]
+        }
+        tmp_path = self.filename + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.filename)
+        self.changed = False
+
+def xirr_by_group(memo, codes, dates, amounts, names):
+    """
+    Same as xirr_solver.xirr_by_group, the XIRR of groups whose cashflows are in memo being taken
+    from it. The other groups are solved together, warm-started from memo.guess(names[group]),
+    and added to memo.
+
+    Args:
+        codes: int array mapping every cashflow to its group (0 .. len(names) - 1)
+        dates, amounts: cashflow arrays aligned with codes (any order)
+        names: symbol of every group
+    """
+    n_groups = len(names)
+    dates = np.asarray(dates).astype('datetime64[D]')
+    order = np.lexsort((dates, codes))
+    offsets = xirr_solver.group_offsets(np.asarray(codes)[order], n_groups)
+    dates = dates[order]
+    amounts = np.asarray(amounts, dtype=np.float64)[order]
+
+    rates = np.full(n_groups, np.nan)
+    missing, keys = [], []
+    groups = np.flatnonzero(np.diff(offsets) > 0)
+    all_keys = stream_keys(dates, amounts, offsets)
+    for group in groups:
+        key = all_keys[group]
+        rate = memo.get(key)
+        if rate is None:
+            missing.append(group)
+            keys.append(key)
+        else:
+            rates[group] = rate
+    instrumentation.count('xirr_memo_hits', len(groups) - len(missing))
+    instrumentation.count('xirr_memo_misses', len(missing))
+    logger.debug('XIRR memo: %d symbol(s) to solve', len(missing))
+    if not missing:
+        return rates
+
+    missing = np.array(missing, dtype=np.int64)
+    rows = np.concatenate([np.arange(offsets[group], offsets[group + 1]) for group in missing])
+    missing_offsets = np.zeros(len(missing) + 1, dtype=np.int64)
+    np.cumsum(offsets[missing + 1] - offsets[missing], out=missing_offsets[1:])
+    guesses = np.array([memo.guess(names[group]) for group in missing], dtype=np.float64)
+    solved = xirr_solver.batched_xirr(dates[rows], amounts[rows], missing_offsets, guess=guesses,
+                                      guess_is_hint=True)
+    for group, key, rate in zip(missing, keys, solved):
+        rates[group] = rate
+        memo.put(key, rate, names[group])
+    return rates
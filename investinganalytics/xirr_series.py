@@ -0,0 +1,127 @@
+import logging
+import numpy as np
+import pandas as pd
+from datetime import date
+from . import cashflows
+from . import xirr_solver
+
+"""
+As-of XIRR series.
+
+XIRR of the portfolio and of every symbol as of a list of dates (e.g. every month-end), as if
+the holdings of that date were sold at that date's close.
+
+The cashflows are sorted once by (symbol, date), and the portfolio's cashflows are summed per
+day once. The stream of a symbol as of a date is then a prefix of its sorted cashflows plus a
+terminal value. The prefix ends of every period come from one counting pass over the ledger,
+so no period filters or re-sorts the ledger. All the streams of a period are solved together by
+xirr_solver, Newton's method starting from each stream's rate of the previous period: month to
+month the rates move little, so most streams converge in a few iterations. The previous rate
+is only a hint, a stream with several roots gets the same root as calculate_xirr would give.
+
+Terminal values are the holdings on the date valued at the last close on or before it, taken
+from the price history (yfin_helper.StocksHistory, served from the local price cache).
+"""
+
+logger = logging.getLogger(__name__)
+
+PORTFOLIO = 'portfolio'
+DEFAULT_YEARS = 10
+
+def month_ends(years=DEFAULT_YEARS, end_date=None):
+    """
+    Returns the month-ends of the last years years up to end_date (default today), as datetime64[D]
+    """
+    end_date = pd.Timestamp(end_date if end_date is not None else date.today())
+    start_date = end_date - pd.DateOffset(years=years)
+    return pd.date_range(start_date, end_date, freq='ME').to_numpy().astype('datetime64[D]')
+
+def prefix_streams(dates, amounts, starts, ends, terminal_date, terminal_values):
+    """
+    Lays out, stream after stream, the prefix dates[starts[i]:ends[i]] of every stream followed by
+    its terminal value (skipped when 0, or when the prefix is empty).
+    Returns (dates, amounts, offsets) for xirr_solver.batched_xirr
+    """
+    n_prefix = ends - starts
+    has_terminal = (n_prefix > 0) & (terminal_values != 0)
+    lengths = n_prefix + has_terminal
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    stream = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(offsets[-1]) - offsets[:-1][stream]
+    is_terminal = position >= n_prefix[stream]
+    source = np.where(is_terminal, 0, starts[stream] + position)
+    out_dates = np.where(is_terminal, terminal_date, dates[source]) if len(dates) else dates[:0]
+    out_amounts = np.where(is_terminal, terminal_values[stream], amounts[source]) if len(amounts) else amounts[:0]
+    return out_dates, out_amounts, offsets
+
+def asof_xirr_series(trades, stock_history_database, asof_dates=None):
+    """
+    Returns a DataFrame indexed by the as-of dates with one column for the portfolio and one per
+    symbol, holding the XIRR as of that date (NaN when it cannot be calculated, e.g. before the
+    first trade, or when a symbol held has no price).
+
+    Args:
+        trades: trades dataframe (symbol, trade_date, trade_type, quantity, price), without the
+                holdings converted to sells
+        stock_history_database: yfin_helper.StocksHistory of the symbols
+        asof_dates: dates of the series, default every month-end of the last 10 years
+    """
+    if asof_dates is None:
+        asof_dates = month_ends()
+    asof_dates = np.sort(np.asarray(asof_dates, dtype='datetime64[D]'))
+
+    columns = cashflows.cashflow_columns(trades)
+    valid = columns['valid']
+    codes, symbols = pd.factorize(trades['symbol'].to_numpy(dtype=object)[valid], sort=True)
+    n_symbols = len(symbols)
+    dates = columns['dates'][valid]
+    amounts = columns['amounts'][valid]
+    quantities = columns['quantities'][valid]
+
+    # per symbol cashflows sorted by date, followed by the portfolio's daily cashflows
+    order = np.lexsort((dates, codes))
+    days, day_index = np.unique(dates, return_inverse=True)
+    daily_amounts = np.bincount(day_index, weights=amounts, minlength=len(days))
+    all_dates = np.concatenate((dates[order], days))
+    all_amounts = np.concatenate((amounts[order], daily_amounts))
+    starts = np.append(np.searchsorted(codes[order], np.arange(n_symbols)), len(order))
+
+    # rows counts as of every as-of date: cashflows and holdings of a trade count from the first
+    # as-of date on or after it
+    rows = np.searchsorted(asof_dates, dates, side='left')
+    in_range = rows < len(asof_dates)
+    counts = np.zeros((len(asof_dates), n_symbols), dtype=np.int64)
+    np.add.at(counts, (rows[in_range], codes[in_range]), 1)
+    prefix_ends = np.empty((len(asof_dates), n_symbols + 1), dtype=np.int64)
+    prefix_ends[:, :n_symbols] = starts[:n_symbols] + np.cumsum(counts, axis=0)
+    prefix_ends[:, n_symbols] = len(order) + np.searchsorted(days, asof_dates, side='right')
+
+    holdings = np.zeros((len(asof_dates), n_symbols))
+    np.add.at(holdings, (rows[in_range], codes[in_range]), quantities[in_range])
+    np.cumsum(holdings, axis=0, out=holdings)
+    prices = stock_history_database.get_close_prices(list(symbols), asof_dates)
+    terminal_values = holdings * prices
+    # holding nothing needs no price
+    terminal_values[holdings == 0] = 0.0
+    unpriced = np.isnan(terminal_values)
+    if unpriced.any():
+        logger.warning('No price history, XIRR not calculated while holding: %s',
+                       ', '.join(map(str, np.asarray(symbols)[unpriced.any(axis=0)])))
+    # as in the portfolio value series, unpriced holdings count as 0 in the portfolio
+    portfolio_values = np.nansum(terminal_values, axis=1)
+
+    rates = np.full((len(asof_dates), n_symbols + 1), np.nan)
+    guess = None
+    for k, asof_date in enumerate(asof_dates):
+        terminal = np.append(np.nan_to_num(terminal_values[k], nan=0.0), portfolio_values[k])
+        stream_dates, stream_amounts, offsets = prefix_streams(
+            all_dates, all_amounts, starts, prefix_ends[k], asof_date, terminal)
+        rates[k] = xirr_solver.batched_xirr(stream_dates, stream_amounts, offsets, guess,
+                                              guess_is_hint=True, scan_roots=False)
+        rates[k, :n_symbols][unpriced[k]] = np.nan
+        # warm start of the next period
+        guess = rates[k]
+
+    # the portfolio stream is the last one, its column goes first
+    rates = np.roll(rates, 1, axis=1)
+    return pd.DataFrame(rates, index=pd.Index(asof_dates, name='date'), columns=[PORTFOLIO] + list(symbols))
@@ -0,0 +1,341 @@
+import numpy as np
+from pyxirr import xirr, InvalidPaymentsError
+from . import instrumentation
+
+"""
+Batched XIRR solver.
+
+Solves XIRR for many independent cashflow streams (e.g. one per symbol) together.
+All streams live in one date array and one amount array; stream i occupies the contiguous
+slice offsets[i]:offsets[i + 1], sorted by date. Every iteration evaluates the XNPV of all
+streams at once with np.add.reduceat, so the per-stream Python overhead is gone.
+
+Roots are found with:
+- without a guess, Brent's method on the bracket [-0.999999999999999, 100]
+- with a guess, Newton's method starting from the guess
+A stream can have several roots, and then the root picked depends on the algorithm. So a batched
+root is only accepted when the stream has a single root in the bracket (its cashflows change sign
+once, or else its XNPV changes sign once over a grid of rates spanning the bracket). Streams which are not settled this way (several roots,
+no convergence, ill-conditioned sums) are handed to pyxirr one by one, which keeps the roots chosen
+the same as calling pyxirr once per stream. The batched roots are not bit for bit those of pyxirr:
+both solvers stop within their tolerance of the root, the rates agree to within 1e-9.
+"""
+
+DAYS_IN_YEAR = 365.0
+BRACKET_LOW = -0.999999999999999
+BRACKET_HIGH = 100.0
+BRENT_MAX_ITERATIONS = 100
+BRENT_XTOL = 2e-12
+BRENT_RTOL = 4 * np.finfo(np.float64).eps
+NEWTON_MAX_ITERATIONS = 50
+NEWTON_MAX_ERROR = 1e-9
+# largest absolute NPV at which a rate is accepted as the root
+NPV_TOLERANCE = 1e-3
+# relative rounding error assumed for the sum of discounted cashflows
+ROUNDING_MARGIN = 1e-12
+# rates at which the XNPV is probed to detect streams with several roots
+ROOT_SCAN_GRID = np.concatenate((
+    BRACKET_LOW + np.geomspace(1e-12, 0.9, 32),
+    np.geomspace(0.1, 1 + BRACKET_HIGH, 96) - 1
+))
+
+def group_offsets(sorted_codes, n_groups):
+    """
+    Returns the offsets array (length n_groups + 1) for group codes which are already sorted
+    """
+    counts = np.bincount(sorted_codes, minlength=n_groups)
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+class _Streams:
+    """
+    XNPV of all the streams, evaluated in one pass over the cashflow arrays
+    """
+    def __init__(self, dates, amounts, starts, lengths):
+        self.dates = dates
+        self.amounts = amounts
+        self.starts = starts
+        self.lengths = lengths
+        self.stream_ids = np.repeat(np.arange(len(starts)), lengths)
+        # days / years elapsed since the first cashflow of the stream
+        self.days = (dates - dates[starts][self.stream_ids]).astype(np.int64)
+        self.years = self.days / DAYS_IN_YEAR
+
+    def subset(self, selected):
+        """
+        Returns the streams at the positions selected, packed into new contiguous arrays
+        """
+        lengths = self.lengths[selected]
+        starts = np.zeros(len(selected), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        rows = np.arange(lengths.sum()) + np.repeat(self.starts[selected] - starts, lengths)
+        return _Streams(self.dates[rows], self.amounts[rows], starts, lengths)
+
+    def discounted(self, rate):
+        return self.amounts / (1.0 + rate[self.stream_ids]) ** self.years
+
+    def npv(self, rate):
+        return np.add.reduceat(self.discounted(rate), self.starts)
+
+    def npv_at(self, rate):
+        """
+        XNPV of every stream at one common rate. The discount factor only depends on the number
+        of days, so it is computed once per distinct day instead of once per cashflow.
+        """
+        first_day = self.days.min()
+        day_range = np.arange(first_day, self.days.max() + 1)
+        discount = (1.0 + rate) ** -(day_range / DAYS_IN_YEAR)
+        return np.add.reduceat(self.amounts * discount[self.days - first_day], self.starts)
+
+    def npv_and_derivative(self, rate):
+        discounted = self.discounted(rate)
+        derivative = -self.years * discounted / (1.0 + rate[self.stream_ids])
+        return np.add.reduceat(discounted, self.starts), np.add.reduceat(derivative, self.starts)
+
+    def rounding_error(self, rate):
+        return np.add.reduceat(np.abs(self.discounted(rate)), self.starts) * ROUNDING_MARGIN
+
+    def sign_changes(self):
+        """
+        Number of sign changes in the cashflows of each stream, after adding up the cashflows
+        falling on the same date. By Descartes' rule of signs it bounds the number of roots.
+        """
+        n = len(self.starts)
+        new_day = np.ones(len(self.amounts), dtype=bool)
+        new_day[1:] = (self.dates[1:] != self.dates[:-1]) | (self.stream_ids[1:] != self.stream_ids[:-1])
+        day_starts = np.flatnonzero(new_day)
+        day_amounts = np.add.reduceat(self.amounts, day_starts)
+        day_streams = self.stream_ids[day_starts]
+
+        nonzero = day_amounts != 0
+        signs = np.sign(day_amounts[nonzero])
+        day_streams = day_streams[nonzero]
+        changes = (signs[1:] != signs[:-1]) & (day_streams[1:] == day_streams[:-1])
+        return np.bincount(day_streams[1:][changes], minlength=n)
+
+def _single_root(streams):
+    """
+    Returns a mask of the streams which have a single root in the bracket. Streams with one sign
+    change in their cashflows are certain to, the others are probed over ROOT_SCAN_GRID.
+    """
+    n = len(streams.starts)
+    sign_changes = streams.sign_changes()
+    single_root = sign_changes == 1
+    uncertain = np.flatnonzero(sign_changes > 1)
+    if len(uncertain) == 0:
+        return single_root
+
+    probed = streams.subset(uncertain)
+    crossings = np.zeros(len(uncertain), dtype=np.int64)
+    previous = None
+    for rate in ROOT_SCAN_GRID:
+        sign = np.sign(probed.npv_at(rate))
+        if previous is not None:
+            crossings += sign != previous
+        previous = sign
+    single_root[uncertain] = crossings == 1
+    return single_root
+
+def _brent(streams, n):
+    """
+    Brent's method (as in scipy's brentq) run for all streams in lockstep.
+    Returns the roots, NaN for the streams which were not bracketed by [BRACKET_LOW, BRACKET_HIGH]
+    """
+    result = np.full(n, np.nan)
+    xpre = np.full(n, BRACKET_LOW)
+    xcur = np.full(n, BRACKET_HIGH)
+    fpre = streams.npv(xpre)
+    fcur = streams.npv(xcur)
+    xblk = np.zeros(n)
+    fblk = np.zeros(n)
+    spre = np.zeros(n)
+    scur = np.zeros(n)
+
+    result[fpre == 0] = BRACKET_LOW
+    result[(fpre != 0) & (fcur == 0)] = BRACKET_HIGH
+    bracketed = np.isfinite(fpre) & np.isfinite(fcur) & (np.signbit(fpre) != np.signbit(fcur))
+    active = bracketed & (fpre != 0) & (fcur != 0)
+
+    for _ in range(BRENT_MAX_ITERATIONS):
+        if not active.any():
+            break
+        instrumentation.count('solver_brent_iterations')
+        flip = active & (fpre != 0) & (fcur != 0) & (np.signbit(fpre) != np.signbit(fcur))
+        xblk = np.where(flip, xpre, xblk)
+        fblk = np.where(flip, fpre, fblk)
+        spre = np.where(flip, xcur - xpre, spre)
+        scur = np.where(flip, xcur - xpre, scur)
+
+        swap = active & (np.abs(fblk) < np.abs(fcur))
+        xpre, xcur, xblk = np.where(swap, xcur, xpre), np.where(swap, xblk, xcur), np.where(swap, xcur, xblk)
+        fpre, fcur, fblk = np.where(swap, fcur, fpre), np.where(swap, fblk, fcur), np.where(swap, fcur, fblk)
+
+        delta = (BRENT_XTOL + BRENT_RTOL * np.abs(xcur)) / 2
+        sbis = (xblk - xcur) / 2
+        finished = active & ((fcur == 0) | (np.abs(sbis) < delta))
+        result[finished] = xcur[finished]
+        active &= ~finished
+
+        # inverse quadratic (or linear) interpolation, rejected in favour of bisection when it
+        # does not shrink the bracket fast enough (NaN steps always fall back to bisection)
+        interpolated = -fcur * (xcur - xpre) / (fcur - fpre)
+        dpre = (fpre - fcur) / (xpre - xcur)
+        dblk = (fblk - fcur) / (xblk - xcur)
+        extrapolated = -fcur * (fblk * dblk - fpre * dpre) / (dblk * dpre * (fblk - fpre))
+        stry = np.where(xpre == xblk, interpolated, extrapolated)
+        accept = ((np.abs(spre) > delta) & (np.abs(fcur) < np.abs(fpre))
+                  & (2 * np.abs(stry) < np.minimum(np.abs(spre), 3 * np.abs(sbis) - delta)))
+        spre = np.where(active, np.where(accept, scur, sbis), spre)
+        scur = np.where(active, np.where(accept, stry, sbis), scur)
+
+        xpre = np.where(active, xcur, xpre)
+        fpre = np.where(active, fcur, fpre)
+        step = np.where(np.abs(scur) > delta, scur, np.where(sbis > 0, delta, -delta))
+        xcur = np.where(active, xcur + step, xcur)
+        fcur = np.where(active, streams.npv(xcur), fcur)
+
+    return result
+
+def _newton(streams, guesses):
+    """
+    Newton's method run for all streams in lockstep, starting from guesses.
+    Returns the roots, NaN for the streams on which it did not converge
+    """
+    rate = guesses.copy()
+    result = np.full(len(rate), np.nan)
+    done = ~np.isfinite(rate)
+
+    for _ in range(NEWTON_MAX_ITERATIONS):
+        if done.all():
+            break
+        instrumentation.count('solver_newton_iterations')
+        npv, derivative = streams.npv_and_derivative(rate)
+        found = ~done & (np.abs(npv) < NEWTON_MAX_ERROR)
+        result[found] = rate[found]
+        done |= found
+
+        step = npv / derivative
+        small_step = ~done & (np.abs(step) < NEWTON_MAX_ERROR)
+        result[small_step] = rate[small_step] - step[small_step]
+        done |= small_step
+
+        rate = np.where(done, rate, rate - step)
+        # the rate has left the domain of XNPV (below -100%), Newton has failed
+        done |= ~np.isfinite(rate) | (rate <= -1.0)
+
+    return result
+
+def _solve(streams, guesses, guess_is_hint):
+    """
+    Solves streams in the batch, NaN for the streams which have to be handed to pyxirr
+    """
+    with_guess = np.isfinite(guesses)
+    solved = np.where(with_guess, _newton(streams, guesses), np.nan)
+    if guess_is_hint:
+        solved[(solved < BRACKET_LOW) | (solved > BRACKET_HIGH)] = np.nan
+        unsolved = np.flatnonzero(np.isnan(solved))
+        if len(unsolved):
+            solved[unsolved] = _brent(streams.subset(unsolved), len(unsolved))
+    elif not with_guess.all():
+        solved = np.where(with_guess, solved, _brent(streams, len(guesses)))
+
+    # A rate is only accepted if it is a root by a margin larger than the rounding error of
+    # the sum, ill-conditioned streams (huge discounted terms cancelling out) are left to pyxirr
+    candidate = np.where(np.isfinite(solved), solved, 0.0)
+    margin = np.abs(streams.npv(candidate)) + streams.rounding_error(candidate)
+    solved[~(margin < NPV_TOLERANCE)] = np.nan
+    solved[~_single_root(streams)] = np.nan
+    return solved
+
+@instrumentation.timed('batched_xirr')
+def batched_xirr(dates, amounts, offsets, guess=None, guess_is_hint=False, scan_roots=True):
+    """
+    Solves XIRR for every stream together.
+
+    Args:
+        dates: datetime64[D] array, sorted by date within each stream
+        amounts: float64 array of signed cashflows
+        offsets: int array of length n_streams + 1, stream i is dates[offsets[i]:offsets[i + 1]]
+        guess: None, or the initial rate for Newton's method: a scalar or an array with one entry
+               per stream (NaN entries mean no guess for that stream)
+        guess_is_hint: if True the guess only speeds up the solve, and the results are those of
+                       pyxirr without a guess: Newton's roots are kept only when inside the bracket,
+                       the other streams are solved by Brent's method, and pyxirr gets no guess
+        scan_roots: if False, streams whose cashflows change sign more than once are not probed
+                    for a single root but handed to pyxirr directly, which is faster when most
+                    streams are like that
+
+    Returns:
+        float64 array with the XIRR of each stream, NaN where XIRR could not be calculated
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_streams = len(offsets) - 1
+    rates = np.full(n_streams, np.nan)
+    if n_streams <= 0:
+        return rates
+
+    lengths = np.diff(offsets)
+    solvable = np.flatnonzero(lengths > 0)
+    starts = offsets[solvable]
+    ends = offsets[solvable + 1]
+    dates = np.asarray(dates).astype('datetime64[D]')
+    amounts = np.asarray(amounts, dtype=np.float64)
+    streams = _Streams(dates, amounts, starts, lengths[solvable])
+
+    if guess is None:
+        guesses = np.full(len(solvable), np.nan)
+    else:
+        guesses = np.broadcast_to(np.asarray(guess, dtype=np.float64), (n_streams,))[solvable]
+    with_guess = np.isfinite(guesses)
+
+    with np.errstate(all='ignore'):
+        if scan_roots:
+            solved = _solve(streams, guesses, guess_is_hint)
+            unsolved = np.flatnonzero(np.isnan(solved))
+        else:
+            sign_changes = streams.sign_changes()
+            batch = np.flatnonzero(sign_changes == 1)
+            solved = np.full(len(solvable), np.nan)
+            solved[batch] = _solve(streams.subset(batch), guesses[batch], guess_is_hint)
+            # cashflows of a single sign have no root, pyxirr would fail on them too
+            unsolved = np.flatnonzero(np.isnan(solved) & (sign_changes > 0))
+
+    # Everything which could not be settled in the batch is solved by pyxirr
+    instrumentation.count('solver_streams', len(solvable))
+    instrumentation.count('solver_pyxirr_fallbacks', len(unsolved))
+    for i in unsolved:
+        stream_guess = guesses[i] if with_guess[i] and not guess_is_hint else None
+        stream_amounts = amounts[starts[i]:ends[i]]
+        try:
+            value = xirr(dates[starts[i]:ends[i]], stream_amounts, guess=stream_guess)
+        except InvalidPaymentsError:
+            # cashflows of a single sign have no XIRR, any other invalid stream (e.g. NaN amounts)
+            # fails as it does when pyxirr is called once per stream
+            if not np.isfinite(stream_amounts).all() or ((stream_amounts > 0).any() and (stream_amounts < 0).any()):
+                raise
+            value = None
+        solved[i] = np.nan if value is None else value
+
+    rates[solvable] = solved
+    return rates
+
+def xirr_by_group(codes, dates, amounts, n_groups, guess=None, scan_roots=True):
+    """
+    Sorts the cashflows once by (group, date) and solves XIRR for all groups together.
+
+    Args:
+        codes: int array mapping every cashflow to its group (0 .. n_groups - 1)
+        dates, amounts: cashflow arrays aligned with codes (any order)
+        guess: None, or a scalar or per-group array of initial rates (see batched_xirr)
+        scan_roots: see batched_xirr
+
+    Returns:
+        float64 array of length n_groups, NaN for groups without a solution (or without cashflows)
+    """
+    dates = np.asarray(dates).astype('datetime64[D]')
+    order = np.lexsort((dates, codes))
+    sorted_codes = np.asarray(codes)[order]
+    offsets = group_offsets(sorted_codes, n_groups)
+    return batched_xirr(dates[order], np.asarray(amounts, dtype=np.float64)[order], offsets, guess,
+                        scan_roots=scan_roots)
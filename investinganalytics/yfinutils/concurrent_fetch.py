@@ -0,0 +1,170 @@
+import copy
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import price_store
+from .yfin_helper import StocksHistory
+
+"""
+Concurrent price history fetching.
+
+Symbols are fetched on a bounded thread pool. Every request to the provider first takes a token
+from a token bucket, so the pool never exceeds the allowed request rate no matter how many
+workers it has. Failed fetches are retried with exponential backoff, and a symbol taking longer
+than the per-symbol timeout is reported as failed. A worker stuck in a request cannot be
+interrupted, so symbols still waiting for a worker are failed too once the whole fetch runs past
+the time every symbol would have had: timeout x (number of symbols / workers, rounded up).
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 5.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+DEFAULT_TIMEOUT_SECONDS = 60.0
+
+class TokenBucket:
+    """
+    Allows rate tokens per second on average, with bursts of up to capacity tokens
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+class RateLimitedProvider:
+    """
+    Wraps a price provider so that every request waits for a token of the bucket
+    """
+    def __init__(self, provider, bucket):
+        self.provider = provider
+        self.bucket = bucket
+        self.unavailable = None
+
+    def history(self, yfinance_symbol, start=None):
+        if self.unavailable is not None:
+            raise self.unavailable
+        self.bucket.acquire()
+        try:
+            return self.provider.history(yfinance_symbol, start=start)
+        except ImportError as e:
+            # the provider cannot run at all (e.g. yfinance is not installed): the next requests
+            # fail at once instead of waiting for their token
+            self.unavailable = e
+            raise
+
+def print_progress(done, total, symbol, ok):
+    status = 'done' if ok else 'FAILED'
+    logger.info('[%d/%d] %s %s', done, total, symbol, status)
+
+def fetch_with_retries(store, symbol, refresh, retries, backoff_seconds, retry_missing=False):
+    """
+    Fetches the history of symbol, retrying with exponential backoff when the provider raises or
+    finds nothing (a failed download looks the same as an unlisted symbol). A symbol a recent
+    lookup found on no exchange is not fetched again unless retry_missing.
+    """
+    if store.known_missing(symbol) and not retry_missing:
+        return None
+    for attempt in range(retries + 1):
+        delay = backoff_seconds * (2 ** attempt)
+        try:
+            history = store.get_history(symbol, refresh=refresh, retry_missing=True)
+        except ImportError:
+            # the provider cannot run at all (e.g. yfinance is not installed), retrying will not help
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning('fetching %s failed (%s), retrying in %.1fs', symbol, e, delay)
+        else:
+            if (history is not None and not history.empty) or attempt == retries:
+                return history
+            logger.warning('no history found for %s, retrying in %.1fs', symbol, delay)
+        time.sleep(delay)
+
+def fetch_stocks_history_concurrent(symbols, store=None, refresh=True, workers=DEFAULT_WORKERS,
+                                    requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                                    retries=DEFAULT_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                                    timeout_seconds=DEFAULT_TIMEOUT_SECONDS, progress=print_progress,
+                                    retry_missing=False):
+    """
+    Same as yfin_helper.fetch_stocks_history, with the symbols fetched on a pool of workers.
+
+    Returns a StocksHistory, whose failed_symbols is a dictionary of symbol: reason for the symbols
+    which could not be fetched (not listed, error after all retries, or timed out, including the
+    symbols still waiting for a worker when the fetch runs past its overall deadline).
+    progress(done, total, symbol, ok) is called as every symbol finishes, pass None to disable it.
+    retry_missing: see price_store.PriceStore.get_history
+    """
+    if store is None:
+        store = price_store.PriceStore()
+    symbols = list(symbols)
+    # shares the cache (and its lock) with store, only the provider is wrapped
+    limited_store = copy.copy(store)
+    limited_store.provider = RateLimitedProvider(store.provider, TokenBucket(requests_per_second))
+
+    stock_history_database = {}
+    failed_symbols = {}
+    started = {}
+
+    def task(symbol):
+        started[symbol] = time.monotonic()
+        return fetch_with_retries(limited_store, symbol, refresh, retries, backoff_seconds, retry_missing)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    deadline = time.monotonic() + timeout_seconds * math.ceil(len(symbols) / workers)
+    try:
+        pending = {executor.submit(task, symbol): symbol for symbol in symbols}
+        done_count = 0
+        while pending:
+            finished, _ = wait(pending, timeout=min(1.0, timeout_seconds), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in list(pending):
+                symbol = pending[future]
+                if future in finished:
+                    try:
+                        history = future.result()
+                        if history is None:
+                            failed_symbols[symbol] = 'not found on NSE or BSE'
+                        else:
+                            stock_history_database[symbol] = history
+                    except Exception as e:
+                        failed_symbols[symbol] = f'error: {e}'
+                elif symbol in started and now - started[symbol] > timeout_seconds:
+                    # the worker cannot be interrupted, its result will just be ignored
+                    future.cancel()
+                    failed_symbols[symbol] = f'timed out after {timeout_seconds}s'
+                elif symbol not in started and now > deadline:
+                    # the workers are all stuck, this symbol would never start
+                    future.cancel()
+                    failed_symbols[symbol] = 'timed out waiting for a worker'
+                else:
+                    continue
+                del pending[future]
+                done_count += 1
+                if progress is not None:
+                    progress(done_count, len(symbols), symbol, symbol in stock_history_database)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return StocksHistory(stock_history_database, failed_symbols)
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, timedelta
+import pandas as pd
+from .. import instrumentation
+
+"""
+Local on-disk store of daily price history.
+
+Every symbol's history is kept in its own pickled DataFrame under the cache directory
+(pandas pickles need no extra dependency and load fast). suffixes.json remembers the
+exchange suffix (.NS / .BO) each symbol resolved to, so the exchange lookup happens once,
+and on later runs only the bars after the last cached date are fetched.
+
+A lookup finding the symbol on no exchange is not conclusive: the provider answers None both for
+an unknown symbol and when a download fails or is throttled. missing.json keeps the date of such
+a lookup, and the symbol is only looked up again MISSING_RETRY_DAYS later (or with retry_missing).
+
+Downloads go through a provider, any object with a method
+    history(yfinance_symbol, start=None) -> DataFrame indexed by date, or None when not found
+which lets tests run fully offline against a fake provider.
+
+Market indices (used as benchmarks) are not listed on an exchange: get_index_history fetches them
+by their yahoo finance ticker (see INDEX_TICKERS) and caches them under their name.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join('cache', 'prices')
+EXCHANGE_SUFFIXES = ['.NS', '.BO']
+SUFFIXES_FILE = 'suffixes.json'
+MISSING_FILE = 'missing.json'
+# days before a symbol found on no exchange is looked up again
+MISSING_RETRY_DAYS = 7
+# yahoo finance tickers of the indices which can be named directly
+INDEX_TICKERS = {
+    'NIFTY50': '^NSEI',
+    'NIFTYNEXT50': '^NSMIDCP',
+    'NIFTY500': '^CRSLDX',
+    'NIFTYBANK': '^NSEBANK',
+    'SENSEX': '^BSESN'
+}
+
+class YFinanceProvider:
+    """
+    Fetches daily history from yahoo finance
+    """
+    def history(self, yfinance_symbol, start=None):
+        import yfinance as yf
+        ticker = yf.Ticker(yfinance_symbol)
+        if start is None:
+            hist = ticker.history(period="max", interval='1d')
+        else:
+            hist = ticker.history(start=start.isoformat(), interval='1d')
+        if hist is None or hist.empty:
+            return None
+        # Convert timestamps to dates
+        hist.index = hist.index.date
+        return hist
+
+class PriceStore:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, provider=None):
+        self.cache_dir = cache_dir
+        self.provider = provider if provider is not None else YFinanceProvider()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.suffixes = self._read_suffixes()
+        self.missing = self._read_json(MISSING_FILE)
+        # symbols can be fetched from several threads, suffixes.json is shared between them
+        self.lock = threading.Lock()
+
+    def _history_path(self, symbol):
+        return os.path.join(self.cache_dir, symbol + '.pkl')
+
+    def _read_json(self, name):
+        try:
+            with open(os.path.join(self.cache_dir, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_json(self, name, content):
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _read_suffixes(self):
+        suffixes = self._read_json(SUFFIXES_FILE)
+        # earlier versions recorded symbols found on no exchange as None, for good: they are
+        # looked up again
+        return {symbol: suffix for symbol, suffix in suffixes.items() if suffix is not None}
+
+    def known_missing(self, symbol):
+        """
+        True if symbol was found on no exchange less than MISSING_RETRY_DAYS ago
+        """
+        checked = self.missing.get(symbol)
+        return checked is not None and date.today() - date.fromisoformat(checked) < timedelta(days=MISSING_RETRY_DAYS)
+
+    def load(self, symbol):
+        """
+        Returns the cached history of symbol, None if it has never been fetched
+        """
+        try:
+            return pd.read_pickle(self._history_path(symbol))
+        except FileNotFoundError:
+            return None
+
+    def save(self, symbol, history):
+        tmp_path = self._history_path(symbol) + '.tmp'
+        history.to_pickle(tmp_path)
+        os.replace(tmp_path, self._history_path(symbol))
+
+    def resolve(self, symbol):
+        """
+        Finds the exchange on which symbol is listed, trying NSE before BSE.
+        Returns (suffix, full history), or (None, None) when it is listed on neither.
+        """
+        for suffix in EXCHANGE_SUFFIXES:
+            instrumentation.count('network_requests')
+            history = self.provider.history(symbol + suffix)
+            if history is not None and not history.empty:
+                return suffix, history
+            logger.info('%s not found with suffix %s', symbol, suffix)
+        return None, None
+
+    @instrumentation.timed('price_history')
+    def get_history(self, symbol, refresh=True, retry_missing=False):
+        """
+        Returns the daily history of symbol (DataFrame indexed by date), or None if it is not
+        listed on any exchange.
+
+        refresh: fetch the bars after the last cached date
+        retry_missing: look the symbol up again even if a recent lookup found no exchange
+        """
+        history = self.load(symbol)
+        instrumentation.count('price_cache_misses' if history is None else 'price_cache_hits')
+        suffix = self.suffixes.get(symbol)
+
+        if history is None or suffix is None:
+            if self.known_missing(symbol) and not retry_missing:
+                return None
+            suffix, history = self.resolve(symbol)
+            with self.lock:
+                if suffix is None:
+                    self.missing[symbol] = date.today().isoformat()
+                else:
+                    self.suffixes[symbol] = suffix
+                    self.missing.pop(symbol, None)
+                    self._write_json(SUFFIXES_FILE, self.suffixes)
+                self._write_json(MISSING_FILE, self.missing)
+            if history is not None:
+                self.save(symbol, history)
+            return history
+
+        if refresh:
+            history = self.refresh(symbol, suffix, history)
+        return history
+
+    @instrumentation.timed('price_history')
+    def get_index_history(self, name, refresh=True):
+        """
+        Returns the daily history of a market index, None if it is not found.
+        name: a key of INDEX_TICKERS (e.g. NIFTY50), or a yahoo finance ticker (e.g. ^NSEI). An index
+              cached under another name (e.g. a custom benchmark saved with save()) is used as is.
+        """
+        history = self.load(name)
+        instrumentation.count('price_cache_misses' if history is None else 'price_cache_hits')
+        ticker = INDEX_TICKERS.get(name, name if name.startswith('^') else None)
+        if ticker is None:
+            if history is None:
+                logger.warning('%s is not in the price cache and is not a known index', name)
+            return history
+        if history is None:
+            instrumentation.count('network_requests')
+            try:
+                history = self.provider.history(ticker)
+            except Exception as e:
+                logger.warning('Could not download the history of the index %s (%s): %s', name, ticker, e)
+                return None
+            if history is None or history.empty:
+                logger.warning('No history found for the index %s (%s)', name, ticker)
+                return None
+            self.save(name, history)
+            return history
+        if refresh:
+            try:
+                history = self.refresh(name, '', history, ticker)
+            except Exception as e:
+                # an index is only a reference, its cached history is still usable
+                logger.warning('Could not update the history of %s, using the cached one: %s', name, e)
+        return history
+
+    def refresh(self, symbol, suffix, history, ticker=None):
+        """
+        Appends the bars after the last cached date to the history of symbol
+        ticker: the yahoo finance ticker, default symbol + suffix
+        """
+        last_date = max(history.index)
+        if last_date >= date.today():
+            return history
+        instrumentation.count('network_requests')
+        new_bars = self.provider.history(ticker or symbol + suffix, start=last_date + timedelta(days=1))
+        if new_bars is None or new_bars.empty:
+            return history
+        new_bars = new_bars[new_bars.index > last_date]
+        if new_bars.empty:
+            return history
+        history = pd.concat([history, new_bars])
+        self.save(symbol, history)
+        return history
@@ -1,87 +1,138 @@
-import yfinance as yf
+import logging
+import numpy as np
 import pandas as pd
-import traceback 
 from datetime import date
+from .. import instrumentation
+from . import price_store
+
+logger = logging.getLogger(__name__)
+
+class PriceMatrix:
+    """
+    Close prices of all symbols aligned on one trading calendar.
+
+    dates: sorted datetime64[D] array, the union of the trading days of all symbols
+    symbols: list of symbols, symbol_index maps a symbol to its column
+    closes: len(dates) x len(symbols) array, forward-filled over the days a symbol did not trade
+            (holidays, suspensions). NaN before a symbol's first close.
+    """
+    def __init__(self, dates, symbols, closes):
+        self.dates = dates
+        self.symbols = list(symbols)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.closes = closes
+        # missing prices count as 0 in valuations
+        self.filled_closes = np.nan_to_num(closes, nan=0.0)
+
+    @classmethod
+    def from_histories(cls, stock_history_database, dtype=np.float64):
+        symbols = list(stock_history_database.keys())
+        if not symbols:
+            return cls(np.array([], dtype='datetime64[D]'), [], np.zeros((0, 0), dtype=dtype))
+        closes = pd.DataFrame({symbol: history['Close'] for symbol, history in stock_history_database.items()})
+        closes.index = pd.to_datetime(closes.index)
+        closes = closes.sort_index().ffill()
+        return cls(closes.index.to_numpy().astype('datetime64[D]'), symbols, closes.to_numpy(dtype=dtype))
+
+    def date_rows(self, dates):
+        """
+        Rows of the calendar in force on each of dates (the last trading day on or before it),
+        -1 for dates before the calendar starts
+        """
+        return np.searchsorted(self.dates, np.asarray(dates, dtype='datetime64[D]'), side='right') - 1
+
+    def get_close_prices(self, symbols, dates):
+        """
+        Returns the len(dates) x len(symbols) matrix of close prices, each being the last close on
+        or before the date. NaN for unknown symbols and dates before a symbol's first close.
+        """
+        rows = self.date_rows(dates)
+        columns = np.array([self.symbol_index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+        prices = self.closes[np.maximum(rows, 0)][:, np.maximum(columns, 0)]
+        prices[rows < 0, :] = np.nan
+        prices[:, columns < 0] = np.nan
+        return prices
+
+    def value(self, quantities):
+        """
+        Value of the portfolio on the calendar dates.
+        quantities: a vector of quantities per symbol (same holdings on every date), or a
+                    len(dates) x len(symbols) matrix of the quantities held on each date
+        Returns a vector with the value on each date
+        """
+        quantities = np.asarray(quantities, dtype=self.filled_closes.dtype)
+        if quantities.ndim == 1:
+            return self.filled_closes @ quantities
+        return np.einsum('ij,ij->i', self.filled_closes, quantities)
 
 class StocksHistory:
-    def __init__(self, stock_history_database):
+    def __init__(self, stock_history_database, failed_symbols=None):
+        """
+        stock_history_database: { symbol : history dataframe }
+        failed_symbols: { symbol : reason } for the symbols whose history could not be fetched
+        """
         self.stock_history_database = stock_history_database
+        self.failed_symbols = failed_symbols if failed_symbols is not None else {}
+        self._price_matrix = None
+
+    def price_matrix(self):
+        """
+        Returns the PriceMatrix of all the symbols, built on first use
+        """
+        if self._price_matrix is None:
+            self._price_matrix = PriceMatrix.from_histories(self.stock_history_database)
+        return self._price_matrix
+
+    def get_close_prices(self, symbols, dates):
+        return self.price_matrix().get_close_prices(symbols, dates)
+
+    def value(self, quantities):
+        return self.price_matrix().value(quantities)
 
     def get_close_price(self, symbol, date_str):
-        iso_date = date.fromisoformat(date_str)
-        try:
-            stock_history = self.stock_history_database[symbol]
-            price = stock_history.loc[iso_date, 'Close']
-            print(f'price is {price}')
-            return price
-        except Exception as e:
-            print(f"ERROR: An exception occurred: {e}")
-            print(traceback.format_exc())
-            return None
-
-def fetch_stocks_history(symbols):
+        """
+        Returns the close price of symbol on date_str (ISO format string or date), or the last close
+        before it on holidays. None when there is no price.
+        """
+        if isinstance(date_str, str):
+            date_str = date.fromisoformat(date_str)
+        price = self.get_close_prices([symbol], [date_str])[0, 0]
+        return None if np.isnan(price) else price
+
+@instrumentation.timed('fetch_stocks_history')
+def fetch_stocks_history(symbols, store=None, refresh=True, workers=1, retry_missing=False):
     """
     { symbol : history dataframe }
+
+    History is served from the local price store (see price_store.PriceStore), only the bars
+    after the last cached date are downloaded. A store with a fake provider can be passed in to
+    run offline.
+    With workers > 1 the symbols are fetched concurrently (see concurrent_fetch).
+    retry_missing: look up again the symbols a recent lookup found on no exchange (see
+                   price_store.PriceStore.get_history)
     """
+    if store is None:
+        store = price_store.PriceStore()
+    logger.info('Stock universe of portfolio: %s', symbols)
+    if workers > 1:
+        from . import concurrent_fetch
+        return concurrent_fetch.fetch_stocks_history_concurrent(symbols, store, refresh, workers=workers,
+                                                                retry_missing=retry_missing)
+
     stock_history_database = {}
-    print('Stock universe of portfolio: ', symbols)
+    failed_symbols = {}
     for symbol in symbols:
-        symbol_data = fetch_symbol_data(symbol, ".NS")
-        if not symbol_data:
-            print('Retrying: Find the stock on BSE...')
-            symbol_data = fetch_symbol_data(symbol, ".BO")
-
-        if not symbol_data:
-            print('Data not found on BSE as well, this stock will be skipped')
+        symbol_history = store.get_history(symbol, refresh=refresh, retry_missing=retry_missing)
+        if symbol_history is None:
+            logger.warning('Data for %s not found on NSE or BSE, this stock will be skipped', symbol)
+            failed_symbols[symbol] = 'not found on NSE or BSE'
             continue
-        
-        symbol_history = get_history(symbol_data)        
         stock_history_database[symbol] = symbol_history
 
-    return StocksHistory(stock_history_database)
-
-def fetch_symbol_data(symbol, suffix):
-    """
-    This method returns historical data of a stock as a Pandas DataFrame
-    Format:
-    Date (index), OHLC, Volume, Dividends, Stock Splits
-
-    The index of the dataframe is 'Date' as opposed to row numbers.
-    Type of date is : 2002-08-12 00:00:00+05:30
-    """
-    yfinance_symbol = symbol + suffix
-    ticker = yf.Ticker(yfinance_symbol)
-    if not 'currentPrice' in ticker.info:
-        return None
-        
-    # Print basic information about the Ticker object
-    #print("Ticker Symbol:", ticker.ticker)  # "RELIANCE.NS"
-    #print(ticker.info)
-    #print(ticker.dividends)
-    #print(ticker.splits)
-    #print(ticker.actions)
-    #print('Historical data: ')
-    #hist = ticker.history(period="max", interval='1d')
-    #print(hist)
-    
-    return ticker
-
-def get_history(ticker):
-    """
-    This method returns historical data of a stock as a Pandas DataFrame
-    Format:
-    Date (index), OHLC, Volume, Dividends, Stock Splits
-
-    The index of the dataframe is 'Date' as opposed to row numbers.
-    Type of date is : 2002-08-12
-    """
-    hist = ticker.history(period="max", interval='1d')
-    # Convert timestamps to dates
-    hist.index = hist.index.date
-    return hist
+    return StocksHistory(stock_history_database, failed_symbols)
 
 # Example usage:
 if __name__ == "__main__":
     s = fetch_stocks_history(['TCS'])
-    print (f'close price is {s.get_close_price('TCS', '2002-08-12')}')
+    print (f"close price is {s.get_close_price('TCS', '2002-08-12')}")
     
\ No newline at end of file
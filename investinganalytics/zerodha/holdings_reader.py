@@ -1,20 +1,20 @@
+import logging
 import pandas as pd
-from .. import alias_reader
+from .. import instrumentation
+from .. import symbols
 import os
 from datetime import datetime
 
-# Apply function to trim strings
-def trim_hyphen_suffix(text):
-    return text.split('-')[0]  # Split on hyphen and return the first part (AEL)
-
-def row_transformations(data):
-    data['symbol'] = data['symbol'].apply(trim_hyphen_suffix)
-    for oldname, newname in alias_reader.getAliases('resources/aliases.csv').items():
-        print('DEBUG: Replacing ', oldname, ' with ', newname)
-        data['symbol'] = data['symbol'].replace(oldname, newname)
+logger = logging.getLogger(__name__)
 
+def row_transformations(data, aliases=None):
+    """
+    Trims and aliases the symbols (see symbols.normalize_symbols)
+    """
+    data['symbol'] = symbols.normalize_symbols(data['symbol'], aliases)
     return data
 
+@instrumentation.timed('read_holdings')
 def getHoldingsAsSellTrades(filename, verbose=False):
     """
     Converts holdings to Sell trades
@@ -23,10 +23,10 @@ def getHoldingsAsSellTrades(filename, verbose=False):
     quantity: type integer
     price: price at which the transaction is done
     trade_type: a string with value = sell
-    trade_date: <class 'datetime.date'>
+    trade_date: datetime64 at day resolution, as in the tradebooks
     """
     # TODO: ideally holdings to sell transactions transformation should be done by a util
-    print('INFO: Reading file: ', filename)
+    logger.info('Reading file: %s', filename)
     holdings = pd.read_csv(filename)
     # Rename columns in holdings file of zerodha to the format of tradebooks
     holdings.rename(columns = {'Instrument':'symbol', 'Qty.': 'quantity', 'LTP':'price'}, inplace = True)
@@ -37,11 +37,10 @@ def getHoldingsAsSellTrades(filename, verbose=False):
     holdings = holdings[columns_to_keep]
 
     # Assume that all holding are being realized today, so insert columns of trade_type and trade_date
-    holdings['trade_date'] = datetime.now().strftime("%Y-%m-%d")
-    holdings['trade_date'] = pd.to_datetime(holdings['trade_date']).dt.date
+    holdings['trade_date'] = pd.Timestamp(datetime.now().date()).as_unit('s')
     holdings['trade_type'] = 'sell'
+    instrumentation.count('holdings_rows', len(holdings))
     if verbose:
-        print('------- Converted Holdings Data ------')
-        print(holdings)
+        logger.debug('------- Converted Holdings Data ------\n%s', holdings)
         
     return holdings
\ No newline at end of file
@@ -1,44 +1,131 @@
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import glob
+import logging
 import os
-from .. import alias_reader
+from .. import ingestion_cache
+from .. import instrumentation
+from .. import symbols
 
-# Apply function to trim strings
-def trim_hyphen_suffix(text):
-    return text.split('-')[0]  # Split on hyphen and return the first part (AEL)
+logger = logging.getLogger(__name__)
 
-def row_transformations(data):
-    data['symbol'] = data['symbol'].apply(trim_hyphen_suffix)
-    for oldname, newname in alias_reader.getAliases('resources/aliases.csv').items():
-        print('DEBUG: Replacing ', oldname, ' with ', newname)
-        data['symbol'] = data['symbol'].replace(oldname, newname)
+ALIASES_FILE = symbols.DEFAULT_ALIASES_FILE
+COLUMNS_TO_KEEP = ['symbol', 'trade_date', 'trade_type', 'quantity', 'price']
+# only the needed columns are read, dates are parsed after reading
+READ_DTYPES = {'symbol': 'category', 'trade_date': str, 'trade_type': 'category', 'quantity': np.float64, 'price': np.float64}
+CATEGORICAL_COLUMNS = ['symbol', 'trade_type']
+DEFAULT_CHUNKSIZE = 1_000_000
 
+def row_transformations(data, aliases=None):
+    """
+    Trims and aliases the symbols (see symbols.normalize_symbols)
+    """
+    data['symbol'] = symbols.normalize_symbols(data['symbol'], aliases)
+    return data
+
+def normalize(data, aliases=None):
+    """
+    Converts raw tradebook columns to the compact trades format:
+    symbol: categorical (trimmed and aliased)
+    trade_date: datetime64 at day resolution
+    trade_type: categorical
+    quantity: int32 (kept as float64 if a quantity is fractional)
+    price: float64
+    """
+    data = row_transformations(data, aliases)
+    data['symbol'] = data['symbol'].astype('category')
+    data['trade_type'] = data['trade_type'].astype('category')
+    data['trade_date'] = pd.to_datetime(data['trade_date']).dt.normalize().astype('datetime64[s]')
+    quantity = data['quantity'].to_numpy()
+    if np.array_equal(quantity, np.trunc(quantity)) and np.abs(quantity).max(initial=0) < 2 ** 31:
+        data['quantity'] = quantity.astype(np.int32)
+    else:
+        logger.warning('fractional quantities found, quantity is kept as float64')
     return data
 
-def getTrades(dir, filename_pattern, verbose=False):
+@instrumentation.timed('parse_tradebook')
+def readTradebook(filename, aliases=None):
+    """
+    Reads and normalizes a single tradebook, reading only the relevant columns
+    """
+    logger.info('Reading file: %s', filename)
+    data = pd.read_csv(filename, usecols=COLUMNS_TO_KEEP, dtype=READ_DTYPES)
+    return normalize(data[COLUMNS_TO_KEEP], aliases)
+
+def concat_trades(frames):
+    """
+    Concatenates normalized trades in one go, keeping symbol and trade_type categorical with sorted
+    categories (a plain pd.concat of categoricals with different categories falls back to object)
+    """
+    frames = list(frames)
+    if not frames:
+        return None
+    columns = {}
+    for column in COLUMNS_TO_KEEP:
+        if column in CATEGORICAL_COLUMNS:
+            columns[column] = union_categoricals([frame[column].astype('category') for frame in frames],
+                                                 sort_categories=True)
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    index = np.concatenate([frame.index.to_numpy() for frame in frames])
+    return pd.DataFrame(columns, index=index)
+
+def iterTrades(dir, filename_pattern, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streaming version of getTrades: yields the trades of all files in normalized chunks of at most
+    chunksize rows, so ledgers which do not fit in memory can be aggregated chunk by chunk
+    (see cashflows.aggregate_chunks).
+    """
+    filenames = sorted(glob.glob(os.path.join(dir, filename_pattern)))
+    aliases = symbols.load_aliases(ALIASES_FILE) if filenames else {}
+    for filename in filenames:
+        logger.info('Reading file: %s', filename)
+        with pd.read_csv(filename, usecols=COLUMNS_TO_KEEP, dtype=READ_DTYPES, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield normalize(chunk[COLUMNS_TO_KEEP], aliases)
+
+@instrumentation.timed('read_tradebooks')
+def getTrades(dir, filename_pattern, verbose=False, cache_dir=None, selected_symbols=None):
     """
     Read and process all files
     TODO: ignore non-csv
     Returns a pandas dataframe containing the following columns:
     symbol: The stock symbol such as INFY
-    trade_date: Date on which trade occured <class 'datetime.date'>
+    trade_date: Date on which trade occured, datetime64 at day resolution
     trade_type: 'buy' or 'sell'
     quantity: number of stocks that were part of the trade
     price: price at which trade occurred
+    symbol and trade_type are categorical, quantity is int32 (see normalize)
+
+    cache_dir: if given, the normalized trades of every file are cached under it, in the directory
+               of dir (see ingestion_cache.folder_cache_dir), and only the files which are new or
+               changed since the last run are parsed again.
+               The cache is invalidated when resources/aliases.csv changes. The trades returned
+               are then memory-mapped from the cache's ledger store (see ledger_store).
+    selected_symbols: if given, only the trades of these (normalized) symbols are returned. With
+                      cache_dir, only their rows are read, through the symbol index of the ledger store.
     """
-    trades = pd.DataFrame()
-    for filename in glob.glob(os.path.join(dir, filename_pattern)):
-        print('Reading file: ' + filename)
-        data = pd.read_csv(filename)
-        trades = pd.concat([trades, data])
-
-    trades = row_transformations(trades)
-    # keep only relevant columns
-    columns_to_keep = ['symbol', 'trade_date', 'trade_type', 'quantity', 'price']
-    trades = trades[columns_to_keep]
-    trades['trade_date'] = pd.to_datetime(trades['trade_date']).dt.date
+    filenames = sorted(glob.glob(os.path.join(dir, filename_pattern)))
+
+    def parse(filename):
+        # load_aliases only reads the aliases file once, and only if some file needs to be parsed
+        return readTradebook(filename, symbols.load_aliases(ALIASES_FILE))
+
+    if cache_dir is not None:
+        cache = ingestion_cache.IngestionCache(ingestion_cache.folder_cache_dir(cache_dir, dir),
+                                               dependencies=[ALIASES_FILE])
+        trades = cache.load(filenames, parse, selected_symbols)
+    else:
+        trades = concat_trades(parse(filename) for filename in filenames)
+        if trades is not None and selected_symbols is not None:
+            trades = trades[trades['symbol'].isin(selected_symbols)]
+    if trades is None:
+        trades = pd.DataFrame(columns=COLUMNS_TO_KEEP)
+    instrumentation.count('tradebook_files', len(filenames))
+    instrumentation.count('tradebook_rows', len(trades))
+
     if verbose:
-        print('------- Trades Data ------')
-        print(trades)
+        logger.debug('------- Trades Data ------\n%s', trades)
 
-    return trades
\ No newline at end of file
+    return trades
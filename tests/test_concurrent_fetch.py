@@ -0,0 +1,84 @@
+import threading
+import time
+from datetime import date
+import pandas as pd
+from investinganalytics.yfinutils import price_store
+from investinganalytics.yfinutils.concurrent_fetch import fetch_stocks_history_concurrent
+
+"""
+The concurrent fetcher against local stub providers injecting latency, blocking or failing.
+"""
+
+def one_bar():
+    return pd.DataFrame({'Close': [100.0], 'Dividends': [0.0]}, index=[date(2024, 1, 1)])
+
+class LatencyProvider:
+    """
+    Answers every NSE request after delay seconds, or blocks until released when delay is None.
+    The first empty_answers requests of every symbol find nothing, as a throttled download does,
+    and the unlisted symbols are never found.
+    """
+    def __init__(self, delay, empty_answers=0, unlisted=()):
+        self.delay = delay
+        self.empty_answers = empty_answers
+        self.unlisted = set(unlisted)
+        self.released = threading.Event()
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def history(self, yfinance_symbol, start=None):
+        if self.delay is None:
+            self.released.wait()
+        else:
+            time.sleep(self.delay)
+        symbol, _, suffix = yfinance_symbol.rpartition('.')
+        if suffix != 'NS':
+            return None
+        with self.lock:
+            self.requests[symbol] = self.requests.get(symbol, 0) + 1
+            if symbol in self.unlisted or self.requests[symbol] <= self.empty_answers:
+                return None
+        return one_bar()
+
+def fetch(tmp_path, provider, symbols, **kwargs):
+    store = price_store.PriceStore(str(tmp_path), provider)
+    kwargs.setdefault('requests_per_second', 1000.0)
+    kwargs.setdefault('backoff_seconds', 0.01)
+    return fetch_stocks_history_concurrent(symbols, store, progress=None, **kwargs)
+
+def test_slow_provider_within_timeout(tmp_path):
+    result = fetch(tmp_path, LatencyProvider(0.05), ['A', 'B', 'C'], workers=2, timeout_seconds=5.0)
+    assert sorted(result.stock_history_database) == ['A', 'B', 'C']
+    assert result.failed_symbols == {}
+
+def test_stuck_workers_do_not_hang_queued_symbols(tmp_path):
+    provider = LatencyProvider(None)
+    try:
+        began = time.monotonic()
+        result = fetch(tmp_path, provider, ['A', 'B'], workers=1, timeout_seconds=0.5)
+        elapsed = time.monotonic() - began
+    finally:
+        provider.released.set()
+    assert result.stock_history_database == {}
+    assert sorted(result.failed_symbols) == ['A', 'B']
+    assert result.failed_symbols['B'] == 'timed out waiting for a worker'
+    assert elapsed < 5.0
+
+def test_empty_answers_are_retried(tmp_path):
+    provider = LatencyProvider(0.01, empty_answers=2)
+    result = fetch(tmp_path, provider, ['A', 'B'], workers=2, retries=3)
+    assert sorted(result.stock_history_database) == ['A', 'B']
+    assert provider.requests == {'A': 3, 'B': 3}
+
+def test_recently_missing_symbols_are_not_looked_up_again(tmp_path):
+    provider = LatencyProvider(0.0, unlisted=['X'])
+    result = fetch(tmp_path, provider, ['X'], workers=2, retries=2)
+    assert result.failed_symbols == {'X': 'not found on NSE or BSE'}
+    assert provider.requests == {'X': 3}
+
+    result = fetch(tmp_path, provider, ['X'], workers=2, retries=2)
+    assert result.failed_symbols == {'X': 'not found on NSE or BSE'}
+    assert provider.requests == {'X': 3}
+
+    fetch(tmp_path, provider, ['X'], workers=2, retries=2, retry_missing=True)
+    assert provider.requests == {'X': 6}
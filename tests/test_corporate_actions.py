@@ -0,0 +1,96 @@
+import logging
+import numpy as np
+import pandas as pd
+from investinganalytics import corporate_actions
+
+"""
+Corporate actions against a naive reference applying the actions one by one, in date order.
+"""
+
+ACTIONS_CSV = """date,original-symbol,original-qty,converted-symbol,converted-qty
+2020-01-01,AAA,1,AAA,2
+2021-01-01,AAA,3,BBB,1
+2022-01-01,BBB,1,CCC,1
+2022-06-01,DDD,2,DDD,3
+"""
+
+def read_actions(tmp_path, content=ACTIONS_CSV):
+    filename = tmp_path / 'corporate-actions.csv'
+    filename.write_text(content)
+    return corporate_actions.read_corporate_actions(str(filename))
+
+def trades_frame(rows):
+    return pd.DataFrame({
+        'symbol': [row[0] for row in rows],
+        'trade_date': pd.to_datetime([row[1] for row in rows]),
+        'trade_type': 'buy',
+        'quantity': [row[2] for row in rows],
+        'price': [row[3] for row in rows]
+    })
+
+def reference(trades, actions):
+    """
+    Every trade goes through the actions after its date one at a time
+    """
+    rows = []
+    for trade in trades.itertuples():
+        symbol, quantity, price = trade.symbol, float(trade.quantity), float(trade.price)
+        for action in actions.itertuples():
+            if action.date > trade.trade_date and action.original_symbol == symbol:
+                symbol = action.converted_symbol
+                quantity *= action.ratio
+                price /= action.ratio
+        rows.append((symbol, quantity, price))
+    return rows
+
+def test_split_then_merger_chain(tmp_path):
+    actions = read_actions(tmp_path)
+    trades = trades_frame([
+        ('AAA', '2019-06-01', 6, 300.0),   # split, merger and rename
+        ('AAA', '2020-01-01', 6, 150.0),   # on the split's date: already split
+        ('BBB', '2021-06-01', 2, 500.0),   # rename only
+        ('CCC', '2022-06-01', 1, 600.0),   # nothing
+        ('DDD', '2022-01-01', 4, 90.0)     # unrelated consolidation
+    ])
+    adjusted = corporate_actions.apply_corporate_actions(trades, actions)
+    assert list(adjusted['symbol']) == ['CCC', 'CCC', 'CCC', 'CCC', 'DDD']
+    assert list(adjusted['quantity']) == [4, 2, 2, 1, 6]
+    assert np.allclose(adjusted['price'], [450.0, 450.0, 500.0, 600.0, 60.0])
+    # the cashflows do not change
+    assert np.allclose(adjusted['quantity'] * adjusted['price'], trades['quantity'] * trades['price'])
+    # trades untouched
+    assert list(trades['symbol']) == ['AAA', 'AAA', 'BBB', 'CCC', 'DDD']
+
+def test_fractional_quantities(tmp_path):
+    actions = read_actions(tmp_path)
+    trades = trades_frame([('AAA', '2020-06-01', 5, 100.0), ('DDD', '2022-01-01', 3, 90.0)])
+    adjusted = corporate_actions.apply_corporate_actions(trades, actions)
+    assert adjusted['quantity'].dtype == np.float64
+    assert np.allclose(adjusted['quantity'], [5 / 3, 4.5])
+    assert np.allclose(adjusted['price'], [300.0, 60.0])
+
+def test_random_trades_match_reference(tmp_path):
+    actions = read_actions(tmp_path)
+    rng = np.random.default_rng(3)
+    n = 500
+    trades = pd.DataFrame({
+        'symbol': rng.choice(['AAA', 'BBB', 'CCC', 'DDD', 'EEE'], n),
+        'trade_date': np.datetime64('2018-01-01') + rng.integers(0, 6 * 365, n).astype('timedelta64[D]'),
+        'trade_type': 'buy',
+        'quantity': rng.integers(1, 50, n),
+        'price': rng.uniform(10, 1000, n)
+    }).astype({'trade_date': 'datetime64[s]'})
+    adjusted = corporate_actions.apply_corporate_actions(trades, actions)
+    expected = reference(trades, actions)
+    assert list(adjusted['symbol']) == [row[0] for row in expected]
+    assert np.allclose(adjusted['quantity'], [row[1] for row in expected])
+    assert np.allclose(adjusted['price'], [row[2] for row in expected])
+
+def test_invalid_and_duplicate_actions_are_reported(tmp_path, caplog):
+    content = ACTIONS_CSV + "2023-01-01,EEE,0,EEE,1\n2023-01-01,FFF,1,FFF,1\n2023-01-01,FFF,1,GGG,2\n"
+    with caplog.at_level(logging.WARNING):
+        actions = read_actions(tmp_path, content)
+    assert 'invalid quantities' in caplog.text
+    assert 'same date' in caplog.text
+    assert list(actions['original_symbol']) == ['AAA', 'AAA', 'BBB', 'DDD', 'FFF']
+    assert actions['converted_symbol'].iloc[-1] == 'FFF'
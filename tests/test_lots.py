@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from investinganalytics import lots
+
+"""
+Lot matching against small scalar reference implementations.
+"""
+
+def random_trades(n=3000, n_symbols=40, seed=5):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'symbol': np.array([f'S{i:02d}' for i in range(n_symbols)], dtype=object)[rng.integers(0, n_symbols, n)],
+        # few dates, so that many buys and sells fall on the same day
+        'trade_date': np.datetime64('2020-01-01') + rng.integers(0, 200, n).astype('timedelta64[D]'),
+        'trade_type': np.where(rng.random(n) < 0.5, 'buy', 'sell').astype(object),
+        'quantity': rng.integers(1, 60, n),
+        'price': rng.uniform(10, 1000, n)
+    })
+
+def reference_average_cost(ledger, matched):
+    """
+    The average cost before every row, one row at a time
+    """
+    average = np.zeros(len(ledger['codes']))
+    held = cost = 0.0
+    code = None
+    for i in range(len(average)):
+        if ledger['codes'][i] != code:
+            code = ledger['codes'][i]
+            held = cost = 0.0
+        if ledger['is_buy'][i]:
+            held += ledger['quantity'][i]
+            cost += ledger['quantity'][i] * ledger['price'][i]
+        elif held > 0:
+            average[i] = cost / held
+            held -= matched[i]
+            cost -= matched[i] * average[i]
+            if held <= lots.MATCH_TOLERANCE:
+                held = cost = 0.0
+    return average
+
+def test_average_cost_matches_reference():
+    ledger = lots.sorted_ledger(random_trades())
+    matched, _ = lots.matchable_sell_quantity(ledger)
+    expected = reference_average_cost(ledger, matched)
+    average = lots.average_cost_at_sells(ledger, matched)
+    assert np.count_nonzero(expected) > 100
+    assert np.allclose(average, expected, rtol=1e-12, atol=0.0)
+
+def test_linear_scan():
+    rng = np.random.default_rng(0)
+    weights, terms = rng.random(1000), rng.normal(size=1000)
+    weights[::97] = 0.0
+    expected = np.zeros(1000)
+    x = 0.0
+    for k in range(1000):
+        x = weights[k] * x + terms[k]
+        expected[k] = x
+    assert np.allclose(lots.linear_scan(weights, terms), expected, rtol=1e-12, atol=1e-12)
+
+def reference_fifo(trades):
+    """
+    FIFO with a queue of open buys per symbol: (lots, open lots, unmatched sells) as sorted tuples
+    """
+    from collections import deque
+    ordered = trades.assign(sells_last=trades['trade_type'] == 'sell').sort_values(
+        ['symbol', 'trade_date', 'sells_last'], kind='stable')
+    matched_lots, open_lots, unmatched = [], [], []
+    for symbol, group in ordered.groupby('symbol', sort=True):
+        queue = deque()
+        for trade in group.itertuples():
+            if trade.trade_type == 'buy':
+                queue.append([trade.trade_date, float(trade.quantity), trade.price])
+                continue
+            left = float(trade.quantity)
+            while left > lots.MATCH_TOLERANCE and queue:
+                buy = queue[0]
+                quantity = min(left, buy[1])
+                matched_lots.append((symbol, buy[0], trade.trade_date, quantity, buy[2], trade.price))
+                buy[1] -= quantity
+                left -= quantity
+                if buy[1] <= lots.MATCH_TOLERANCE:
+                    queue.popleft()
+            if left > lots.MATCH_TOLERANCE:
+                unmatched.append((symbol, trade.trade_date, left, trade.price))
+        open_lots.extend((symbol, buy[0], buy[1], buy[2]) for buy in queue)
+    return sorted(matched_lots), sorted(open_lots), sorted(unmatched)
+
+def normalized(row):
+    """
+    A row with its dates at day resolution and its numbers rounded, to compare as tuples
+    """
+    return tuple(round(float(value), 6) if isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+                 else np.datetime64(value, 'D') if isinstance(value, (pd.Timestamp, np.datetime64)) else value
+                 for value in row)
+
+def as_tuples(frame, columns):
+    return sorted(normalized(row) for row in frame[columns].itertuples(index=False))
+
+def assert_matches_reference(trades):
+    result = lots.match_lots(trades)
+    expected_lots, expected_open, expected_unmatched = reference_fifo(trades)
+    assert as_tuples(result['lots'], ['symbol', 'buy_date', 'sell_date', 'quantity', 'cost_price', 'sell_price']) \
+        == sorted(normalized(row) for row in expected_lots)
+    assert as_tuples(result['open_lots'], ['symbol', 'buy_date', 'quantity', 'cost_price']) \
+        == sorted(normalized(row) for row in expected_open)
+    assert as_tuples(result['unmatched_sells'], ['symbol', 'sell_date', 'quantity', 'sell_price']) \
+        == sorted(normalized(row) for row in expected_unmatched)
+
+def test_fifo_same_date_and_oversold():
+    trades = pd.DataFrame({
+        'symbol': ['AAA', 'AAA', 'AAA', 'AAA', 'BBB', 'BBB', 'BBB'],
+        'trade_date': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-02-01', '2020-03-01',
+                                      '2020-01-01', '2020-01-05', '2020-02-01']),
+        # the sell of 2020-02-01 is listed before the buy of the same day, buys are matched first
+        'trade_type': ['buy', 'sell', 'buy', 'sell', 'sell', 'buy', 'sell'],
+        'quantity': [10, 15, 10, 3, 4, 6, 2],
+        'price': [100.0, 120.0, 110.0, 130.0, 50.0, 55.0, 60.0]
+    })
+    result = lots.match_lots(trades)
+    assert as_tuples(result['lots'], ['symbol', 'quantity', 'cost_price', 'sell_price']) == [
+        ('AAA', 3.0, 110.0, 130.0), ('AAA', 5.0, 110.0, 120.0), ('AAA', 10.0, 100.0, 120.0),
+        ('BBB', 2.0, 55.0, 60.0)]
+    # the oversold BBB sell does not consume the later buy
+    assert as_tuples(result['unmatched_sells'], ['symbol', 'quantity']) == [('BBB', 4.0)]
+    assert as_tuples(result['open_lots'], ['symbol', 'quantity', 'cost_price']) == [
+        ('AAA', 2.0, 110.0), ('BBB', 4.0, 55.0)]
+    assert_matches_reference(trades)
+
+def test_fifo_matches_reference_on_random_trades():
+    assert_matches_reference(random_trades())
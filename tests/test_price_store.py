@@ -0,0 +1,116 @@
+import json
+import os
+from datetime import date, timedelta
+import pandas as pd
+from investinganalytics.yfinutils import price_store
+
+"""
+PriceStore against a fake provider, fully offline.
+"""
+
+def bars(first_day, n_days):
+    days = [first_day + timedelta(days=i) for i in range(n_days)]
+    return pd.DataFrame({'Close': [100.0 + i for i in range(n_days)], 'Dividends': 0.0}, index=days)
+
+class FakeProvider:
+    """
+    Serves the histories of yahoo finance symbols from a dictionary and records every request
+    """
+    def __init__(self, histories):
+        self.histories = histories
+        self.requests = []
+
+    def history(self, yfinance_symbol, start=None):
+        self.requests.append((yfinance_symbol, start))
+        history = self.histories.get(yfinance_symbol)
+        if history is None:
+            return None
+        if start is not None:
+            history = history[[day >= start for day in history.index]]
+        return history if not history.empty else None
+
+def read_json(tmp_path, name):
+    with open(os.path.join(tmp_path, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def test_exchange_suffix_is_remembered(tmp_path):
+    history = bars(date(2024, 1, 1), 10)
+    provider = FakeProvider({'AAA.BO': history})
+    store = price_store.PriceStore(str(tmp_path), provider)
+    assert store.get_history('AAA', refresh=False).equals(history)
+    assert provider.requests == [('AAA.NS', None), ('AAA.BO', None)]
+    assert read_json(tmp_path, price_store.SUFFIXES_FILE) == {'AAA': '.BO'}
+
+    # served from the cache, no exchange lookup
+    provider.requests.clear()
+    assert price_store.PriceStore(str(tmp_path), provider).get_history('AAA', refresh=False).equals(history)
+    assert provider.requests == []
+
+def test_missing_symbols_are_looked_up_again_later(tmp_path):
+    provider = FakeProvider({})
+    store = price_store.PriceStore(str(tmp_path), provider)
+    assert store.get_history('GONE') is None
+    assert read_json(tmp_path, price_store.MISSING_FILE) == {'GONE': date.today().isoformat()}
+    assert price_store.SUFFIXES_FILE not in os.listdir(tmp_path)
+
+    # a recent lookup is trusted ...
+    provider.requests.clear()
+    store = price_store.PriceStore(str(tmp_path), provider)
+    assert store.get_history('GONE') is None
+    assert provider.requests == []
+    # ... unless asked to look again
+    assert store.get_history('GONE', retry_missing=True) is None
+    assert len(provider.requests) == 2
+
+    # after MISSING_RETRY_DAYS the symbol is looked up again, and found this time
+    checked = date.today() - timedelta(days=price_store.MISSING_RETRY_DAYS)
+    with open(os.path.join(tmp_path, price_store.MISSING_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'GONE': checked.isoformat()}, f)
+    provider.histories['GONE.NS'] = bars(date(2024, 1, 1), 5)
+    store = price_store.PriceStore(str(tmp_path), provider)
+    assert len(store.get_history('GONE', refresh=False)) == 5
+    assert read_json(tmp_path, price_store.MISSING_FILE) == {}
+    assert read_json(tmp_path, price_store.SUFFIXES_FILE) == {'GONE': '.NS'}
+
+def test_symbols_recorded_missing_by_earlier_versions_are_looked_up(tmp_path):
+    with open(os.path.join(tmp_path, price_store.SUFFIXES_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'OLD': None}, f)
+    provider = FakeProvider({'OLD.NS': bars(date(2024, 1, 1), 3)})
+    assert len(price_store.PriceStore(str(tmp_path), provider).get_history('OLD', refresh=False)) == 3
+
+def test_refresh_only_fetches_the_new_bars(tmp_path):
+    first_day = date.today() - timedelta(days=20)
+    full = bars(first_day, 21)
+    provider = FakeProvider({'AAA.NS': full.iloc[:15]})
+    store = price_store.PriceStore(str(tmp_path), provider)
+    assert len(store.get_history('AAA')) == 15
+
+    # nothing new yet: the cached history is kept
+    provider.requests.clear()
+    assert len(store.get_history('AAA')) == 15
+    last_cached = first_day + timedelta(days=14)
+    assert provider.requests == [('AAA.NS', last_cached + timedelta(days=1))]
+
+    provider.histories['AAA.NS'] = full
+    provider.requests.clear()
+    assert store.get_history('AAA').equals(full)
+    assert provider.requests == [('AAA.NS', last_cached + timedelta(days=1))]
+    assert price_store.PriceStore(str(tmp_path), provider).load('AAA').equals(full)
+
+    # up to today: no request at all
+    provider.requests.clear()
+    assert store.get_history('AAA').equals(full)
+    assert provider.requests == []
+    assert store.get_history('AAA', refresh=False).equals(full)
+    assert provider.requests == []
+
+def test_index_download_failure_is_not_fatal(tmp_path):
+    class FailingProvider:
+        def history(self, yfinance_symbol, start=None):
+            raise ModuleNotFoundError("No module named 'yfinance'")
+    store = price_store.PriceStore(str(tmp_path), FailingProvider())
+    assert store.get_index_history('NIFTY50') is None
+
+    cached = bars(date(2024, 1, 1), 3)
+    store.save('NIFTY50', cached)
+    assert store.get_index_history('NIFTY50').equals(cached)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import socket
+import pytest
+from investinganalytics import server
+
+"""
+The analytics server over HTTP on localhost (port 0) and over a Unix socket, on a small portfolio.
+"""
+
+TRADEBOOK_HEADER = ('symbol,isin,trade_date,exchange,segment,series,trade_type,auction,quantity,price,'
+                    'trade_id,order_id,order_execution_time\n')
+
+def trade_line(n, symbol, trade_date, trade_type, quantity, price):
+    return (f'{symbol},INE000000000,{trade_date},NSE,EQ,EQ,{trade_type},False,{quantity},{price},'
+            f'{10000000 + n},{1000000000000 + n},{trade_date}T09:15:00\n')
+
+def write_tradebook(folder, trades):
+    with open(os.path.join(folder, 'tradebook-2020.csv'), 'w') as f:
+        f.write(TRADEBOOK_HEADER + ''.join(trade_line(n, *trade) for n, trade in enumerate(trades)))
+
+TRADES = [
+    ('OLDA', '2020-01-02', 'buy', 10, 100.0),     # AAA under its old name
+    ('AAA', '2020-03-02', 'buy', 10, 120.0),
+    ('AAA', '2020-06-01', 'sell', 5, 150.0),
+    ('BBB-BE', '2020-02-03', 'buy', 4, 50.0),
+    ('BBB', '2020-09-01', 'sell', 4, 70.0)
+]
+
+@pytest.fixture
+def portfolio(tmp_path, monkeypatch):
+    """
+    A portfolio folder, with the resources, tradebook cache and price cache in the working directory
+    """
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('resources')
+    with open(os.path.join('resources', 'aliases.csv'), 'w') as f:
+        f.write('OLDA, AAA\n')
+    with open(os.path.join('resources', 'corporate-actions.csv'), 'w') as f:
+        f.write('date,original-symbol,original-qty,converted-symbol,converted-qty\n')
+    folder = str(tmp_path / 'portfolio')
+    os.mkdir(folder)
+    write_tradebook(folder, TRADES)
+    with open(os.path.join(folder, 'holdings.csv'), 'w') as f:
+        f.write('Instrument,Qty.,Avg. cost,LTP,Cur. val,P&L,Net chg.,Day chg.\n'
+                'AAA,15,113.33,160.0,2400.0,700.0,0.0,0.0\n')
+    return folder
+
+async def request(reader, writer, method, target):
+    """
+    Sends one keep-alive request on the connection, returns (status, JSON body)
+    """
+    writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) != b'\r\n':
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+def serve_and_query(service, queries, socket_path=None):
+    """
+    Starts the server on a free port (or socket_path), sends queries (method, target) on one
+    connection and returns their (status, body)
+    """
+    async def run():
+        assert await service.reload()
+        listener = await server.start(service, port=0, socket_path=socket_path)
+        try:
+            if socket_path is None:
+                host, port = listener.sockets[0].getsockname()[:2]
+                reader, writer = await asyncio.open_connection(host, port)
+            else:
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+            answers = []
+            for method, target in queries:
+                answers.append(await request(reader, writer, method, target))
+            writer.close()
+            return answers
+        finally:
+            listener.close()
+            await listener.wait_closed()
+    return asyncio.run(run())
+
+def new_service(folder):
+    return server.AnalyticsService(folder, poll_seconds=0.05)
+
+def test_endpoints_on_localhost(portfolio):
+    answers = serve_and_query(new_service(portfolio), [
+        ('GET', '/health'), ('GET', '/xirr'), ('GET', '/stocks?sort=profit&top=1'),
+        ('GET', '/stocks/AAA'), ('GET', '/trades/OLDA'), ('GET', '/trades/BBB-BE'),
+        ('GET', '/trades/ZZZ'), ('GET', '/stocks?sort=nothing'), ('GET', '/nav'),
+        ('GET', '/nowhere'), ('DELETE', '/xirr')])
+    (status, health), (status_xirr, summary), (status_top, top), (status_stock, stock), \
+        (status_aaa, aaa), (status_bbb, bbb), *errors = answers
+    assert status == 200 and health['loaded'] and health['trades'] == len(TRADES) + 1
+    assert health['generation'] == 1 and not health['nav']
+    assert status_xirr == 200 and summary
+    assert status_top == 200 and len(top) == 1
+    assert status_stock == 200 and stock['symbol'] == 'AAA'
+    # old names and series suffixes resolve to the current symbol
+    assert status_aaa == 200 and len(aaa) == 4 and {trade['symbol'] for trade in aaa} == {'AAA'}
+    assert [trade['trade_type'] for trade in aaa] == ['buy', 'buy', 'sell', 'sell']
+    assert status_bbb == 200 and len(bbb) == 2
+    # no trades, bad sort column, no prices cached, unknown endpoint, unsupported method
+    assert [status for status, _ in errors] == [404, 400, 404, 404, 405]
+    assert all('error' in body for _, body in errors)
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='no Unix sockets')
+def test_endpoints_on_unix_socket(portfolio, tmp_path):
+    # socket paths are limited to about 100 characters, tmp_path may be longer
+    socket_path = os.path.join(os.path.relpath(tmp_path), 'server.sock')
+    [(status, health)] = serve_and_query(new_service(portfolio), [('GET', '/health')], socket_path)
+    assert status == 200 and health['trades'] == len(TRADES) + 1
+
+def test_reload_picks_up_changes(portfolio):
+    service = new_service(portfolio)
+    answers = serve_and_query(service, [('GET', '/trades/BBB')])
+    assert len(answers[0][1]) == 2
+
+    write_tradebook(portfolio, TRADES + [('BBB', '2020-10-01', 'buy', 1, 60.0)])
+    [(status, reloaded), (_, bbb), (_, health)] = serve_and_query(
+        service, [('POST', '/reload'), ('GET', '/trades/BBB'), ('GET', '/health')])
+    assert status == 200 and reloaded['reloaded'] and reloaded['error'] is None
+    assert len(bbb) == 3 and health['generation'] == 3
+
+def test_failed_load_keeps_the_previous_state(portfolio):
+    service = new_service(portfolio)
+    assert service.load()
+    with open(os.path.join(portfolio, 'tradebook-2020.csv'), 'w') as f:
+        f.write('not,a,tradebook\n1,2,3\n')
+    assert not service.load()
+    assert service.state is not None and service.generation == 1 and service.last_error
+    assert service.fingerprint() == service.loaded_fingerprint
+
+def test_watch_reloads_changed_files(portfolio):
+    service = new_service(portfolio)
+
+    async def run():
+        await service.reload()
+        watcher = asyncio.create_task(service.watch())
+        try:
+            write_tradebook(portfolio, TRADES[:3])
+            # the size changes, whatever the mtime resolution
+            for _ in range(200):
+                if service.generation == 2:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            watcher.cancel()
+    asyncio.run(run())
+    assert service.generation == 2 and len(service.state.trades) == 3 + 1
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from investinganalytics import trades_to_snapshots
+
+def sample_trades():
+    return pd.DataFrame({
+        'symbol': ['AAA', 'BBB', 'AAA', 'BBB'],
+        'trade_date': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04']),
+        'trade_type': ['buy', 'buy', 'sell', 'sell'],
+        'quantity': [10, 5, 4, 5],
+        'price': [100.0, 50.0, 110.0, 60.0]
+    })
+
+def test_holdings_on_every_date():
+    snapshots = trades_to_snapshots.convert(sample_trades())
+    assert snapshots.get_closest_previous_snapshot('2023-12-31').holdings() == {}
+    assert snapshots.get_closest_previous_snapshot('2024-01-02').holdings() == {'AAA': 10, 'BBB': 5}
+    assert snapshots.get_closest_previous_snapshot('2024-01-10').holdings() == {'AAA': 6}
+    matrix = snapshots.holdings_matrix(np.array(['2024-01-01', '2024-01-03'], dtype='datetime64[D]'))
+    assert matrix.tolist() == [[10.0, 0.0], [6.0, 5.0]]
+
+def test_updating_a_snapshot_leaves_the_ledger_alone():
+    snapshots = trades_to_snapshots.convert(sample_trades())
+    snapshot = snapshots.get_closest_previous_snapshot('2024-01-02')
+    snapshot.update('NEW', 5)
+    copied = snapshots.get_closest_previous_snapshot('2024-01-03').copy()
+    copied.update('OTHER', 1)
+    assert snapshot.holdings() == {'AAA': 10, 'BBB': 5, 'NEW': 5}
+    assert copied.holdings() == {'AAA': 6, 'BBB': 5, 'OTHER': 1}
+
+    # later lookups still see the ledger's symbols only
+    assert snapshots.get_closest_previous_snapshot('2024-01-04').holdings() == {'AAA': 6}
+    assert snapshots.get_closest_previous_snapshot('2023-12-31').quantities.shape == (2,)
+    assert snapshots.holdings_matrix(np.array(['2024-01-04'], dtype='datetime64[D]')).shape == (1, 2)
+
+def test_copies_do_not_see_each_others_symbols():
+    original = trades_to_snapshots.Snapshot()
+    original.update('AAA', 1)
+    copied = original.copy()
+    copied.update('BBB', 2)
+    original.update('CCC', 3)
+    assert original.holdings() == {'AAA': 1, 'CCC': 3}
+    assert copied.holdings() == {'AAA': 1, 'BBB': 2}
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from pyxirr import xirr
+from investinganalytics import xirr_filter_multiple
+from investinganalytics import xirr_memo
+from investinganalytics import xirr_solver
+
+"""
+The batched solver against pyxirr: the same symbols get an XIRR, and the rates agree to within 1e-9.
+"""
+
+TOLERANCE = 1e-9
+
+def random_trades(n_symbols=300, n_trades=4000, seed=7):
+    rng = np.random.default_rng(seed)
+    symbols = np.array([f'S{i:03d}' for i in range(n_symbols)], dtype=object)[rng.integers(0, n_symbols, n_trades)]
+    trade_type = np.where(rng.random(n_trades) < 0.55, 'buy', 'sell').astype(object)
+    # a few symbols only bought and a few only sold
+    trade_type[symbols == 'S000'] = 'buy'
+    trade_type[symbols == 'S001'] = 'sell'
+    return pd.DataFrame({
+        'symbol': symbols,
+        'trade_date': np.datetime64('2012-01-01') + rng.integers(0, 4000, n_trades).astype('timedelta64[D]'),
+        'trade_type': trade_type,
+        'quantity': rng.integers(1, 100, n_trades),
+        'price': rng.uniform(10, 2000, n_trades)
+    })
+
+def assert_same_results(expected, actual):
+    assert actual['symbols_with_no_buys'] == expected['symbols_with_no_buys']
+    assert actual['symbols_with_no_sells'] == expected['symbols_with_no_sells']
+    assert actual['xirr'].keys() == expected['xirr'].keys()
+    for symbol, result in expected['xirr'].items():
+        rate = actual['xirr'][symbol]['xirr']
+        if result['xirr'] is None:
+            assert rate is None, symbol
+        else:
+            assert rate is not None and abs(rate - result['xirr']) <= TOLERANCE, symbol
+        assert actual['xirr'][symbol]['profit'] == result['profit']
+
+def test_batched_matches_per_symbol():
+    trades = random_trades()
+    expected = xirr_filter_multiple.calculate_xirr_stock(trades, 'xirr', None)
+    assert 'S000' in expected['symbols_with_no_sells'] and 'S001' in expected['symbols_with_no_buys']
+    assert_same_results(expected, xirr_filter_multiple.calculate_xirr_stock(trades, 'xirr', None, batched=True))
+
+def test_memo_matches_per_symbol():
+    trades = random_trades()
+    expected = xirr_filter_multiple.calculate_xirr_stock(trades, 'xirr', None)
+    memo = xirr_memo.XirrMemo(filename=None)
+    # solved into the memo, then read from it
+    assert_same_results(expected, xirr_filter_multiple.calculate_xirr_stock(trades, 'xirr', None, memo=memo))
+    assert len(memo) > 0
+    assert_same_results(expected, xirr_filter_multiple.calculate_xirr_stock(trades, 'xirr', None, memo=memo))
+
+def test_solver_matches_pyxirr_on_random_streams():
+    rng = np.random.default_rng(1)
+    n_groups = 2000
+    codes = rng.integers(0, n_groups, 20000)
+    dates = np.datetime64('2015-01-01') + rng.integers(0, 3000, len(codes)).astype('timedelta64[D]')
+    amounts = np.where(rng.random(len(codes)) < 0.6, -1, 1) * rng.uniform(100, 10000, len(codes))
+    for scan_roots in (True, False):
+        rates = xirr_solver.xirr_by_group(codes, dates, amounts, n_groups, scan_roots=scan_roots)
+        for group in range(n_groups):
+            rows = np.flatnonzero(codes == group)
+            rows = rows[np.argsort(dates[rows], kind='stable')]
+            stream = amounts[rows]
+            expected = xirr(dates[rows], stream) if (stream > 0).any() and (stream < 0).any() else None
+            if expected is None:
+                assert np.isnan(rates[group]), group
+            else:
+                assert abs(rates[group] - expected) <= TOLERANCE, group
@@ -1,27 +1,122 @@
+import contextlib
+import logging
 import sys
 import os
-from investinganalytics import xirr_filter_multiple as xirr_f
+# only the standard library is imported at startup, the calculations (pandas, pyxirr ...) are
+# imported by run() once the arguments are known to be valid
+from investinganalytics import instrumentation
+from investinganalytics import startup
 
 # Specify the pattern for your CSV files (replace with your pattern)
-allowed_modes = ['xirr', 'trade_history']
+allowed_modes = ['xirr', 'trade_history', 'benchmark']
+def extractOptions(args):
+    """
+    Takes the options out of args, leaving the positional arguments.
+    --quiet: only warnings, and no per stock tables
+    --verbose: also debug messages (e.g. all the trades read)
+    --output <path>: also write the report to path (json, or a directory for csv / parquet)
+    --format <json|csv|parquet>: format of the report, default from the extension of path
+    --profile-startup: print the import times and how long loading the portfolio took
+    --instrument: print the time spent in every stage and the counters (rows, cache hits ...)
+    --memory: with --instrument, also track the peak memory of every stage (slower)
+    --trace <path>: write the stages as a Chrome trace (chrome://tracing, Perfetto)
+    --profile <path>: write a cProfile profile of the run (pstats format, e.g. for snakeviz)
+    --dividends: also count the dividends received (from the price history, downloaded if not cached)
+    --xirr-cache: take the XIRR of the stocks whose cashflows did not change from cache/xirr/memo.json
+    """
+    options = {'level': logging.INFO, 'quiet': False, 'output': None, 'report_format': None,
+               'profile_startup': False, 'instrument': False, 'memory': False, 'trace': None, 'profile': None,
+               'dividends': False, 'xirr_cache': False}
+    positional = []
+    args = iter(args)
+    for arg in args:
+        if arg == '--quiet':
+            options['level'] = logging.WARNING
+            options['quiet'] = True
+        elif arg == '--verbose':
+            options['level'] = logging.DEBUG
+        elif arg == '--output':
+            options['output'] = next(args, None)
+        elif arg == '--format':
+            options['report_format'] = next(args, None)
+        elif arg == '--profile-startup':
+            options['profile_startup'] = True
+        elif arg == '--instrument':
+            options['instrument'] = True
+        elif arg == '--memory':
+            options['instrument'] = options['memory'] = True
+        elif arg == '--trace':
+            options['trace'] = next(args, None)
+        elif arg == '--profile':
+            options['profile'] = next(args, None)
+        elif arg == '--dividends':
+            options['dividends'] = True
+        elif arg == '--xirr-cache':
+            options['xirr_cache'] = True
+        else:
+            positional.append(arg)
+    return positional, options
+
 def parseCommandLine(args):
     """
+    python3 xirr.py <directory> [xirr | trade_history <symbol> [<symbol> ...] | benchmark [<index> ...]]
+                    [--quiet | --verbose]
+                    [--output <path>] [--format json|csv|parquet] [--profile-startup]
+                    [--instrument] [--memory] [--trace <path>] [--profile <path>] [--dividends]
+                    [--xirr-cache]
     """
-    tradebook_directory = sys.argv[1]
+    args, options = extractOptions(args[1:])
+    if not args:
+        print('FATAL: directory containing tradebooks not specified')
+        return
+    tradebook_directory = args[0]
     if not isDirectory(tradebook_directory):
         return
     mode: str = 'xirr'
     target_stock : str = None
-    if len(sys.argv) > 2:
-        mode = sys.argv[2]
+    if len(args) > 1:
+        mode = args[1]
         if not isValidMode(mode):
             allowed_modes_formatted = format_with_pipe(allowed_modes)
             print(f'FATAL: mode should be one of {allowed_modes_formatted}')
             return
     if mode == 'trade_history':
-        target_stock = sys.argv[3]
+        if len(args) < 3:
+            print('FATAL: trade_history mode needs the symbol of the stock')
+            return
+        target_stock = args[2] if len(args) == 3 else args[2:]
+    elif mode == 'benchmark':
+        # the indices to compare with, NIFTY50 by default
+        target_stock = args[2:] or None
 
-    xirr_f.my_main(tradebook_directory, mode, target_stock)
+    profile_startup = options.pop('profile_startup')
+    instrument = options.pop('instrument')
+    trace = options.pop('trace')
+    profile = options.pop('profile')
+    if instrument or trace:
+        instrumentation.enable(memory=options.pop('memory'))
+    else:
+        options.pop('memory')
+
+    with contextlib.ExitStack() as stack:
+        profiler = stack.enter_context(startup.ImportProfiler()) if profile_startup else None
+        if profile:
+            stack.enter_context(instrumentation.profiled(profile))
+        run(tradebook_directory, mode, target_stock, **options)
+
+    if profile_startup:
+        startup.print_profile(profiler)
+    if instrument:
+        instrumentation.print_report()
+    if trace:
+        instrumentation.write_chrome_trace(trace)
+
+def run(tradebook_directory, mode, target_stock, level=logging.INFO, **options):
+    from investinganalytics import reporting
+    from investinganalytics import xirr_filter_multiple as xirr_f
+    startup.mark('imports done')
+    reporting.configure_logging(level)
+    xirr_f.my_main(tradebook_directory, mode, target_stock, **options)
 
 def isDirectory(path):
     if not os.path.exists(path):
@@ -60,7 +155,15 @@ def getInputFromUser():
     if not isValidMode(mode):
         print(f'FATAL: mode should be one of {allowed_modes_formatted}')
         return
-    xirr_f.my_main(tradebook_directory, mode, None)
+    target_stock = None
+    if mode == 'trade_history':
+        target_stock = input('> Enter the symbol(s) of the stock, separated by spaces: ').split()
+        if not target_stock:
+            print('FATAL: trade_history mode needs the symbol of the stock')
+            return
+    elif mode == 'benchmark':
+        target_stock = input('> Enter the indices to compare with, separated by spaces (default NIFTY50): ').split() or None
+    run(tradebook_directory, mode, target_stock)
 
 if __name__ == "__main__":  # This ensures the code only runs when the script is executed directly
     if len(sys.argv) > 1:
@@ -0,0 +1,32 @@
+import argparse
+import os
+from investinganalytics import batch
+from investinganalytics import reporting
+
+"""
+Calculates XIRR for many portfolios in one run:
+    python3 xirr_batch.py <root-directory | manifest.csv> [--output <directory>] [--workers N] [--prices]
+
+root-directory: every sub-directory containing tradebook-*.csv files is a portfolio, named after it
+manifest.csv: a CSV file with the columns name, folder
+"""
+
+def parseCommandLine():
+    parser = argparse.ArgumentParser(description='Calculates XIRR for many portfolios in parallel')
+    parser.add_argument('portfolios', help='directory of portfolio folders, or manifest CSV (name, folder)')
+    parser.add_argument('--output', default='batch-results', help='directory for the reports')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPUs)')
+    parser.add_argument('--prices', action='store_true', help='also write the daily value of every portfolio')
+    return parser.parse_args()
+
+if __name__ == "__main__":  # This ensures the code only runs when the script is executed directly
+    args = parseCommandLine()
+    reporting.configure_logging()
+    if not os.path.exists(args.portfolios):
+        print(f"FATAL: Path '{args.portfolios}' does not exist.")
+    else:
+        portfolios = batch.find_portfolios(args.portfolios)
+        if not portfolios:
+            print(f"FATAL: No portfolio with {batch.TRADEBOOK_FILE_PATTERN} files found in '{args.portfolios}'")
+        else:
+            batch.run_batch(portfolios, args.output, args.workers, args.prices)
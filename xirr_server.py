@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import logging
+import os
+from investinganalytics import reporting
+from investinganalytics import server
+
+"""
+Serves the analytics of a portfolio folder on localhost, for dashboards and other tools:
+    python3 xirr_server.py <directory> [--host 127.0.0.1] [--port 8737 | --socket <path>] [--poll 1.0]
+
+The folder is loaded once and reloaded when its files change, see investinganalytics/server.py for the
+endpoints, e.g.
+    curl http://127.0.0.1:8737/xirr
+    curl http://127.0.0.1:8737/trades/INFY
+"""
+
+def parseCommandLine():
+    parser = argparse.ArgumentParser(description='Serves the XIRR, stock-wise results, trade history and '
+                                                 'daily value of a portfolio over HTTP on localhost')
+    parser.add_argument('directory', help='directory containing the tradebooks and holdings.csv')
+    parser.add_argument('--host', default=server.DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=server.DEFAULT_PORT, help='0 picks a free port')
+    parser.add_argument('--socket', help='serve on this Unix socket instead of TCP')
+    parser.add_argument('--poll', type=float, default=server.DEFAULT_POLL_SECONDS,
+                        help='seconds between checks of the files for changes')
+    parser.add_argument('--verbose', action='store_true', help='also log every request')
+    return parser.parse_args()
+
+if __name__ == "__main__":  # This ensures the code only runs when the script is executed directly
+    args = parseCommandLine()
+    reporting.configure_logging(logging.DEBUG if args.verbose else logging.INFO)
+    if not os.path.isdir(args.directory):
+        print(f"FATAL: Path '{args.directory}' is not a directory.")
+    else:
+        service = server.AnalyticsService(args.directory, poll_seconds=args.poll)
+        try:
+            asyncio.run(server.serve(service, args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            pass